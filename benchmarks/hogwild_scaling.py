@@ -0,0 +1,99 @@
+"""
+Throughput of hogwild training with a growing number of processes.
+
+Trains a TComplEx-shaped model (sparse entity, relation and timestamp embeddings scored by a complex trilinear
+product) with Adagrad and negative sampling on random facts, and reports the facts processed per second
+for every process count:
+
+    python benchmarks/hogwild_scaling.py --processes 1 2 4 8
+"""
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import argparse
+import time
+
+import torch
+
+from tkge.train.distributed import run_hogwild
+
+
+class SparseTComplEx(torch.nn.Module):
+    def __init__(self, num_entities: int, num_relations: int, num_timestamps: int, rank: int):
+        super().__init__()
+
+        self.rank = rank
+        self.embeddings = torch.nn.ModuleList([
+            torch.nn.Embedding(s, 2 * rank, sparse=True) for s in [num_entities, num_relations, num_timestamps]
+        ])
+        for embedding in self.embeddings:
+            embedding.weight.data *= 1e-2
+
+    def forward(self, facts: torch.Tensor):
+        lhs = self.embeddings[0](facts[:, 0]).chunk(2, dim=1)
+        rel = self.embeddings[1](facts[:, 1]).chunk(2, dim=1)
+        rhs = self.embeddings[0](facts[:, 2]).chunk(2, dim=1)
+        time = self.embeddings[2](facts[:, 3]).chunk(2, dim=1)
+
+        rt = rel[0] * time[0] - rel[1] * time[1], rel[1] * time[0] + rel[0] * time[1]
+
+        return ((lhs[0] * rt[0] - lhs[1] * rt[1]) * rhs[0] + (lhs[1] * rt[0] + lhs[0] * rt[1]) * rhs[1]).sum(1)
+
+
+def train(model: SparseTComplEx, facts: torch.Tensor, rank: int, world_size: int, batch_size: int,
+          num_negatives: int, num_entities: int):
+    optimizer = torch.optim.Adagrad(model.parameters(), lr=0.1)
+    shard = facts[rank::world_size]
+
+    for batch in shard.split(batch_size):
+        negatives = batch.repeat_interleave(num_negatives, dim=0)
+        negatives[:, 2] = torch.randint(num_entities, (negatives.size(0),))
+
+        scores = torch.cat([model(batch), model(negatives)])
+        labels = torch.cat([torch.ones(batch.size(0)), torch.zeros(negatives.size(0))])
+
+        optimizer.zero_grad()
+        torch.nn.functional.binary_cross_entropy_with_logits(scores, labels).backward()
+        optimizer.step()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--facts", type=int, default=200000)
+    parser.add_argument("--entities", type=int, default=100000)
+    parser.add_argument("--relations", type=int, default=500)
+    parser.add_argument("--timestamps", type=int, default=365)
+    parser.add_argument("--rank", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--negatives", type=int, default=10)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    facts = torch.stack([torch.randint(args.entities, (args.facts,)),
+                         torch.randint(args.relations, (args.facts,)),
+                         torch.randint(args.entities, (args.facts,)),
+                         torch.randint(args.timestamps, (args.facts,))], dim=1)
+
+    print(f"{'processes':>10} {'seconds':>10} {'facts/s':>12} {'speedup':>10}")
+
+    baseline = None
+    for world_size in args.processes:
+        model = SparseTComplEx(args.entities, args.relations, args.timestamps, args.rank)
+        model.share_memory()
+
+        start = time.time()
+        run_hogwild(lambda rank: train(model, facts, rank, world_size, args.batch_size, args.negatives,
+                                       args.entities), world_size)
+        elapsed = time.time() - start
+
+        throughput = args.facts / elapsed
+        baseline = baseline or throughput
+        print(f"{world_size:>10} {elapsed:>10.2f} {throughput:>12.0f} {throughput / baseline:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
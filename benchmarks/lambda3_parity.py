@@ -0,0 +1,141 @@
+"""
+Training loss and step time of the lambda3 temporal smoothness modes.
+
+Trains TComplEx with N3 and lambda3 regularization on synthetic facts whose timestamps carry a smooth signal, once
+per lambda3 mode, from the same initialization and batches. After every epoch it reports the full objective, i.e. the
+data loss plus N3 plus the full lambda3 penalty, such that the modes are compared on the same quantity:
+
+    python benchmarks/lambda3_parity.py --timestamps 2000 --epochs 5
+"""
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import argparse
+import tempfile
+import time
+
+import torch
+import yaml
+
+from tkge.common.config import Config
+from tkge.data.batch import Batch
+from tkge.models.model import TComplExModel
+from tkge.train.optim import get_optimizer
+from tkge.train.regularization import Regularizer
+
+
+class SyntheticDataset:
+    def __init__(self, num_entities: int, num_relations: int, num_timestamps: int):
+        self._num_entities = num_entities
+        self._num_relations = num_relations
+        self._num_timestamps = num_timestamps
+
+    def num_entities(self):
+        return self._num_entities
+
+    def num_relations(self):
+        return self._num_relations
+
+    def num_timestamps(self):
+        return self._num_timestamps
+
+
+def create_config(args, mode: str, every: int) -> Config:
+    options = {
+        'console': {'folder': tempfile.gettempdir(), 'flush_interval': 1., 'trace_format': 'json'},
+        'task': {'device': 'cpu'},
+        'model': {'name': 'tcomplex', 'rank': args.rank, 'no_time_emb': False, 'init_size': 1e-2},
+        'train': {'regularizer': {
+            'n3': {'type': 'n3_regularize', 'weight': 1e-2},
+            'lambda3': {'type': 'lambda3_regularize', 'weight': 1e-2, 'mode': mode, 'every': every}}}
+    }
+
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as file:
+        yaml.dump(options, file)
+
+    config = Config(folder=file.name, load_default=False)
+    os.remove(file.name)
+
+    return config
+
+
+def synthetic_facts(args) -> torch.Tensor:
+    """Facts whose tail drifts slowly with the timestamp, so neighbouring timestamps should get similar embeddings."""
+    generator = torch.Generator().manual_seed(0)
+
+    heads = torch.randint(args.entities, (args.facts,), generator=generator)
+    relations = torch.randint(args.relations // 2, (args.facts,), generator=generator) * 2
+    # most facts cluster on few timestamps, as in ICEWS-style data
+    timestamps = (torch.rand(args.facts, generator=generator) ** 3 * args.timestamps).long()
+    tails = (heads + relations + timestamps * 16 // args.timestamps) % args.entities
+
+    return torch.stack([heads, relations, tails, timestamps], dim=1)
+
+
+def objective(model, regularizers, full_lambda3, facts: torch.Tensor, batch_size: int) -> float:
+    total = 0.
+    with torch.no_grad():
+        for batch in facts.split(batch_size):
+            scores, factors = model.forward(Batch(batch))
+            loss = torch.nn.functional.cross_entropy(scores, batch[:, 2])
+            loss += regularizers['n3'](factors['n3']) + full_lambda3(factors['lambda3'])
+
+            total += loss.item() * batch.size(0)
+
+    return total / facts.size(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=1000)
+    parser.add_argument("--relations", type=int, default=20)
+    parser.add_argument("--timestamps", type=int, default=2000)
+    parser.add_argument("--facts", type=int, default=50000)
+    parser.add_argument("--rank", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--every", type=int, default=10)
+    args = parser.parse_args()
+
+    facts = synthetic_facts(args)
+    dataset = SyntheticDataset(args.entities, args.relations, args.timestamps)
+
+    full_lambda3 = Regularizer.create(create_config(args, "full", 1), "lambda3")
+
+    print(f"{'mode':>10} {'epoch':>6} {'objective':>10} {'ms/step':>8}")
+
+    for mode in ["full", "batch", "periodic"]:
+        config = create_config(args, mode, args.every)
+
+        torch.manual_seed(0)
+        model = TComplExModel(config, dataset)
+        optimizer = get_optimizer(model, "Adagrad", {'lr': 0.1})
+        regularizers = {name: Regularizer.create(config, name) for name in ['n3', 'lambda3']}
+
+        generator = torch.Generator().manual_seed(1)
+        for epoch in range(1, args.epochs + 1):
+            elapsed, steps = 0., 0
+
+            for batch in facts[torch.randperm(facts.size(0), generator=generator)].split(args.batch_size):
+                start = time.time()
+
+                scores, factors = model.forward(Batch(batch))
+                loss = torch.nn.functional.cross_entropy(scores, batch[:, 2])
+                loss += regularizers['n3'](factors['n3']) + regularizers['lambda3'](factors['lambda3'])
+
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+
+                elapsed += time.time() - start
+                steps += 1
+
+            loss = objective(model, regularizers, full_lambda3, facts, args.batch_size)
+            print(f"{mode:>10} {epoch:>6} {loss:>10.4f} {1000 * elapsed / steps:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Startup time of the command line interface.
+
+Runs every command in a fresh interpreter `--repeat` times and reports the median and minimum wall time:
+
+- help: `tkge.py --help`, which imports no task, model or torch
+- train_help: `tkge.py train --help`, which imports the training task
+- eval_imports: the imports an eval run does before it loads any data
+- where_in: importing numba and the first call of a jitted function, loaded from the on-disk cache after the
+  first run
+- eval: `tkge.py eval -c CONFIG`, only with --config
+
+    python benchmarks/startup_time.py --repeat 5 [--config config.yaml]
+"""
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import argparse
+import statistics
+import subprocess
+import time
+
+CLI = os.path.join(BASE_DIR, "tkge.py")
+
+SNIPPETS = {
+    "eval_imports": "from tkge.task.task import Task; Task.by_name('eval')",
+    "where_in": "import numpy as np; from tkge.indexing import where_in; where_in(np.arange(4), np.arange(2))"
+}
+
+
+def wall_time(command, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=BASE_DIR, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times), min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--config", type=str, default=None, help="configuration of an eval run to time")
+    args = parser.parse_args()
+
+    commands = {
+        "help": [sys.executable, CLI, "--help"],
+        "train_help": [sys.executable, CLI, "train", "--help"],
+        **{name: [sys.executable, "-c", snippet] for name, snippet in SNIPPETS.items()}
+    }
+    if args.config:
+        commands["eval"] = [sys.executable, CLI, "eval", "-c", args.config]
+
+    print(f"{'command':>14} {'median':>9} {'min':>9}")
+    for name, command in commands.items():
+        median, minimum = wall_time(command, args.repeat)
+        print(f"{name:>14} {median:>8.3f}s {minimum:>8.3f}s")
+
+
+if __name__ == '__main__':
+    main()
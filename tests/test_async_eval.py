@@ -0,0 +1,95 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import tempfile
+import unittest
+
+from tkge.task.trainer import TrainTask
+from tkge.train.async_eval import AsyncEvaluator
+from tkge.train.checkpoint import load_checkpoint, load_model_state
+
+
+class MockConfig:
+    def __init__(self, folder: str):
+        self.options = {"train": {"checkpoint": {"folder": folder, "keep_best": True, "format": "torch"}},
+                        "model": {"name": "mock"}, "dataset": {"name": "mock"}}
+        self.log_prefix = ""
+
+    def get(self, key: str):
+        value = self.options
+        for name in key.split("."):
+            value = value[name]
+        return value
+
+    def log(self, msg: str, **kwargs):
+        pass
+
+    def trace(self, **kwargs):
+        pass
+
+
+class MockTrainTask(TrainTask):
+    """Validates the model by the sum of its weights, failing for epoch `fail_epoch`."""
+
+    def __init__(self, folder: str, fail_epoch: int = -1):
+        self.config = MockConfig(folder)
+        self.device = "cpu"
+        self.valid_metric = "mean_reciprocal_ranking"
+        self.best_metric = None
+        self.fail_epoch = fail_epoch
+
+        self.model = torch.nn.Linear(3, 1, bias=False)
+        torch.nn.init.ones_(self.model.weight)
+
+    def validate(self, epoch: int) -> float:
+        if epoch == self.fail_epoch:
+            raise ValueError(f"epoch {epoch}")
+
+        return self.model.weight.sum().item()
+
+
+class TestAsyncEvaluator(unittest.TestCase):
+    def test_validates_snapshot_of_submitted_epoch(self):
+        with tempfile.TemporaryDirectory() as folder:
+            task = MockTrainTask(folder)
+            evaluator = AsyncEvaluator(task)
+
+            try:
+                assert evaluator.submit(1) == []
+                # training goes on while the snapshot is validated
+                task.model.weight.data.zero_()
+                assert evaluator.wait() == [(1, 3.)]
+
+                task.best_metric = 3.
+                evaluator.submit(2)
+                assert evaluator.submit(3) == [(2, 0.)]
+                assert evaluator.wait() == [(3, 0.)]
+            finally:
+                evaluator.terminate()
+
+            # the evaluator saved the improving epoch only
+            path = os.path.join(folder, "best_model_mock_dataset_mock.ckpt")
+            assert load_checkpoint(path)["last_epoch"] == 1
+            assert torch.equal(load_model_state(path)["weight"], torch.ones(1, 3))
+
+    def test_failure_is_raised(self):
+        with tempfile.TemporaryDirectory() as folder:
+            evaluator = AsyncEvaluator(MockTrainTask(folder, fail_epoch=2))
+
+            try:
+                evaluator.submit(1)
+                evaluator.submit(2)
+                with self.assertRaisesRegex(RuntimeError, "ValueError: epoch 2"):
+                    evaluator.wait()
+            finally:
+                evaluator.terminate()
+
+            assert not evaluator.process.is_alive()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import numpy as np
+import tempfile
+import unittest
+
+from tkge.eval.breakdown import Ranks, group_metrics, metrics_by_group
+from tkge.indexing import index_frequency_percentiles, index_time_windows, FREQUENCY_PERCENTILES
+
+
+class MockDataset:
+    def __init__(self, triples=None, timestamps=None):
+        self.triples = triples
+        self.ts2id = {ts: ts_id for ts_id, ts in enumerate(timestamps or [])}
+        self._indexes = dict()
+
+    def get(self, split: str):
+        return {"triple": self.triples}
+
+    def num_entities(self):
+        return 8
+
+    def num_relations(self):
+        return 4
+
+    def num_timestamps(self):
+        return len(self.ts2id)
+
+
+class TestGroupMetrics(unittest.TestCase):
+    def test_matches_metrics_of_each_group(self):
+        generator = torch.Generator().manual_seed(0)
+        ranks = torch.randint(1, 50, (1000,), generator=generator).float()
+        groups = torch.randint(5, (1000,), generator=generator)
+        # group 5 is empty
+        metrics = group_metrics(ranks, groups, num_groups=6, k=[1, 10])
+
+        for group in range(5):
+            group_ranks = ranks[groups == group].double()
+            assert metrics['count'][group] == len(group_ranks)
+            assert torch.isclose(metrics['mean_ranking'][group], group_ranks.mean())
+            assert torch.isclose(metrics['mean_reciprocal_ranking'][group], (1. / group_ranks).mean())
+            assert torch.isclose(metrics['hits_at_10'][group], (group_ranks <= 10).double().mean())
+
+        by_name = metrics_by_group(metrics, ["a", "b", "c", "d", "e", "f"])
+        assert list(by_name) == ["a", "b", "c", "d", "e"]
+        assert by_name["c"]["count"] == (groups == 2).sum().item()
+
+
+class TestRanks(unittest.TestCase):
+    def test_preallocated_ranks_are_saved(self):
+        ranks = Ranks(5)
+        ranks.add(torch.LongTensor([[0, 1, 2, 3], [4, 5, 6, 7]]), torch.Tensor([1, 2]), torch.Tensor([3, 4]))
+        ranks.add(torch.LongTensor([[8, 9, 10, 11]]), torch.Tensor([5]), torch.Tensor([6]))
+
+        assert ranks.head.tolist() == [1, 2, 5] and ranks.tail.tolist() == [3, 4, 6]
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "ranks", "ranks_test.npz")
+            ranks.save(path)
+
+            saved = np.load(path)
+            assert saved["ids"].dtype == np.int32 and saved["ids"].shape == (3, 4)
+            assert saved["tail"].tolist() == [3, 4, 6]
+
+
+class TestFrequencyPercentiles(unittest.TestCase):
+    def test_quartiles_by_frequency(self):
+        # subject i occurs i times, relation 3 most often
+        triples = [[s, 3 if s > 2 else s % 3, 0] for s in range(8) for _ in range(s)]
+        percentiles = index_frequency_percentiles(MockDataset(triples))
+
+        names = [FREQUENCY_PERCENTILES[p] for p in percentiles["subject"].tolist()]
+        assert names == ["25%", "25%", "50%", "50%", "75%", "75%", "top", "top"]
+        assert FREQUENCY_PERCENTILES[percentiles["relation"][3]] == "top"
+        assert FREQUENCY_PERCENTILES[percentiles["object"][0]] == "top"
+
+
+class TestTimeWindows(unittest.TestCase):
+    def test_windows_in_chronological_order(self):
+        dataset = MockDataset(timestamps=["2014-12-31", "2014-01-01", "2015-01-01", "2014-12-29", "2014-02-00"])
+
+        windows, names = index_time_windows(dataset, "week")
+        # ISO weeks of the days, 2014-12-29 starts week 1 of 2015
+        assert names == ["2014-W01", "2014-W05", "2015-W01"]
+        assert windows.tolist() == [2, 0, 2, 2, 1]
+
+        windows, names = index_time_windows(dataset, "month")
+        assert names == ["2014-01", "2014-02", "2014-12", "2015-01"]
+        assert windows.tolist() == [2, 0, 3, 2, 1]
+
+        windows, names = index_time_windows(dataset, "year")
+        assert names == ["2014", "2015"] and windows.tolist() == [0, 0, 1, 0, 0]
+
+
+if __name__ == '__main__':
+    unittest.main()
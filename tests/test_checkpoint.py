@@ -0,0 +1,175 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import tempfile
+import unittest
+
+from tkge.task.trainer import TrainTask
+from tkge.train.checkpoint import CheckpointWriter, checkpoint_epochs, latest_checkpoint, load_checkpoint, \
+    load_model_state, is_sharded, expand_checkpoints
+from tkge.common.error import ConfigurationError
+from tkge.train.sampling import NegativeSampler
+
+
+class MockConfig:
+    def __init__(self, folder: str):
+        self.options = {"train": {"checkpoint": {"folder": folder, "every": 2}, "max_epochs": 5}}
+        self.messages = []
+
+    def get(self, key: str):
+        value = self.options
+        for name in key.split("."):
+            value = value[name]
+        return value
+
+    def log(self, msg: str, **kwargs):
+        self.messages.append(msg)
+
+
+class MockSampler(NegativeSampler):
+    def __init__(self):
+        self.cache = [1, 2]
+
+    def state_dict(self):
+        return {"cache": list(self.cache)}
+
+    def load_state_dict(self, state):
+        self.cache = state["cache"]
+
+
+class MockTrainTask(TrainTask):
+    def __init__(self, folder: str, seed: int):
+        torch.manual_seed(seed)
+
+        self.config = MockConfig(folder)
+        self.rank = 0
+        self.start_epoch = 1
+        self.best_metric = None
+        self.validations_without_improvement = 0
+        self.valid_metric = "mean_reciprocal_ranking"
+        self.subbatch_size = -1
+
+        self.model = torch.nn.Linear(3, 1)
+        self.optimizer = torch.optim.Adagrad(self.model.parameters(), lr=0.1)
+        self.lr_scheduler = None
+        self.sampler = MockSampler()
+        self.regularizer = dict()
+        self.checkpoint_writer = CheckpointWriter(folder, "mock", "mock", keep=2, background=True,
+                                                  log=self.config.log)
+
+
+class TestCheckpointWriter(unittest.TestCase):
+    def test_retains_most_recent_and_best(self):
+        with tempfile.TemporaryDirectory() as folder:
+            writer = CheckpointWriter(folder, "mock", "mock", keep=2)
+
+            for epoch in range(1, 5):
+                writer.save({"last_epoch": epoch}, epoch, best=epoch == 2)
+            writer.save({"last_epoch": 5}, None, best=True)
+            writer.wait()
+
+            assert sorted(checkpoint_epochs(folder, "mock", "mock")) == [3, 4]
+            assert latest_checkpoint(folder, "mock", "mock").endswith("epoch_4_model_mock_dataset_mock.ckpt")
+            assert load_checkpoint(os.path.join(folder, "best_model_mock_dataset_mock.ckpt"))["last_epoch"] == 5
+            assert not [f for f in os.listdir(folder) if f.endswith(".tmp")]
+
+    def test_error_is_raised_on_next_save(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "file")
+            open(path, "w").close()
+
+            writer = CheckpointWriter(os.path.join(path, "ckpt"), "mock", "mock", keep=0)
+            writer.save({"last_epoch": 1}, 1)
+
+            with self.assertRaises(RuntimeError):
+                writer.wait()
+
+
+class TestExpandCheckpoints(unittest.TestCase):
+    def test_patterns_in_natural_order(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for epoch in [1, 2, 10]:
+                open(os.path.join(folder, f"epoch_{epoch}.ckpt"), "w").close()
+            best = os.path.join(folder, "best.ckpt")
+
+            paths = expand_checkpoints([best, os.path.join(folder, "epoch_*.ckpt")])
+            assert [os.path.basename(path) for path in paths] == ["best.ckpt", "epoch_1.ckpt", "epoch_2.ckpt",
+                                                                  "epoch_10.ckpt"]
+            assert expand_checkpoints(best) == [best]
+
+            with self.assertRaises(ConfigurationError):
+                expand_checkpoints(os.path.join(folder, "*.pt"))
+
+
+class TestShardedCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.state_dict = {"embedding.weight": torch.randn(7, 3), "scale": torch.tensor(2., dtype=torch.float64),
+                           "empty": torch.zeros(0, 4, dtype=torch.long), "half": torch.randn(5).bfloat16()}
+
+    def test_model_state_is_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as folder:
+            writer = CheckpointWriter(folder, "mock", "mock", keep=1, format="sharded")
+            for epoch in [1, 2]:
+                writer.save({"last_epoch": epoch, "state_dict": self.state_dict, "optimizer": {"lr": 0.1}}, epoch,
+                            best=epoch == 1)
+            writer.wait()
+
+            path = latest_checkpoint(folder, "mock", "mock")
+            assert is_sharded(path) and sorted(checkpoint_epochs(folder, "mock", "mock")) == [2]
+            assert is_sharded(os.path.join(folder, "best_model_mock_dataset_mock.ckpt"))
+
+            state_dict = load_model_state(path)
+            assert state_dict.keys() == self.state_dict.keys()
+            for name, tensor in state_dict.items():
+                assert tensor.dtype == self.state_dict[name].dtype and torch.equal(tensor, self.state_dict[name])
+
+            # writing to a mapped tensor leaves the checkpoint as it is
+            module = torch.nn.Module()
+            module.weight = torch.nn.Parameter(torch.zeros(7, 3))
+            module.load_state_dict({"weight": state_dict["embedding.weight"]}, assign=True)
+            module.weight.data.zero_()
+            assert torch.equal(load_model_state(path)["embedding.weight"], self.state_dict["embedding.weight"])
+
+            checkpoint = load_checkpoint(path)
+            assert checkpoint["last_epoch"] == 2 and checkpoint["optimizer"] == {"lr": 0.1}
+
+    def test_torch_format_is_still_loaded(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "model.ckpt")
+            torch.save({"state_dict": self.state_dict, "optimizer": {}}, path)
+
+            assert torch.equal(load_model_state(path)["embedding.weight"], self.state_dict["embedding.weight"])
+
+
+class TestResume(unittest.TestCase):
+    def test_resumed_task_continues_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as folder:
+            task = MockTrainTask(folder, seed=0)
+            task.model(torch.ones(2, 3)).sum().backward()
+            task.optimizer.step()
+            task.best_metric = 0.5
+
+            task._checkpoint(2, improved=False)
+            # training goes on while the snapshot is written
+            task.model.weight.data.zero_()
+            task.checkpoint_writer.wait()
+            expected = torch.rand(3)
+
+            resumed = MockTrainTask(folder, seed=1)
+            resumed.load_ckpt(latest_checkpoint(folder, "mock", "mock"))
+
+            assert resumed.start_epoch == 3
+            assert resumed.best_metric == 0.5
+            assert resumed.sampler.cache == [1, 2]
+            assert not torch.equal(resumed.model.weight, task.model.weight)
+            assert torch.equal(resumed.optimizer.state_dict()["state"][0]["sum"],
+                               task.optimizer.state_dict()["state"][0]["sum"])
+            assert torch.equal(torch.rand(3), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import numpy as np
+import random
+import unittest
+
+from tkge.common.jit import lazy_njit
+from tkge.data.batch import Batch
+from tkge.data.dataset import SplitDataset
+from tkge.data.dataloader import NegativeSamplingCollator, worker_init_fn
+from tkge.train.sampling import NegativeSampler
+
+
+@lazy_njit
+def numba_randint(high, size):
+    return np.random.randint(0, high, size)
+
+
+class MockNegativeSampler(NegativeSampler):
+    """Corrupts the tails with entities drawn from the torch, python, numpy and numba PRNGs in turn."""
+
+    uses_numba = True
+
+    def __init__(self):
+        self.num_samples = 4
+        self.filter = False
+        self.as_matrix = True
+        self.model = None
+
+    def _sample(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
+        bs = pos_batch.size(0)
+        negatives = torch.stack([torch.randint(100, (bs,)),
+                                 torch.LongTensor([random.randrange(100) for _ in range(bs)]),
+                                 torch.from_numpy(np.random.randint(0, 100, bs)).long(),
+                                 torch.from_numpy(numba_randint(100, bs)).long()], dim=1)
+
+        samples = pos_batch.repeat_interleave(1 + self.num_samples)
+        samples.ids[:, 2] = torch.cat([pos_batch.ids[:, 2:3], negatives], dim=1).view(-1)
+
+        return samples.as_matrix(1 + self.num_samples)
+
+    def _label(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
+        labels = torch.zeros(pos_batch.size(0), 1 + self.num_samples)
+        labels[:, 0] = 1
+
+        return labels
+
+
+class TestNegativeSamplingCollator(unittest.TestCase):
+    def setUp(self):
+        self.dataset = SplitDataset({'triple': [[i, i % 3, (7 * i) % 20] for i in range(20)],
+                                     'timestamp_float': [[i % 5] for i in range(20)]}, ['timestamp_float'])
+
+    def _load(self, seed: int):
+        # the main process' numba PRNG is left in a different state by every run, like by earlier sampling
+        numba_randint(100, 1)
+
+        torch.manual_seed(seed)
+        loader = torch.utils.data.DataLoader(self.dataset, batch_size=6, shuffle=True, num_workers=2,
+                                             collate_fn=NegativeSamplingCollator(MockNegativeSampler(), "tail"),
+                                             worker_init_fn=worker_init_fn)
+
+        return list(loader)
+
+    def test_samples_in_workers(self):
+        batches = self._load(seed=0)
+
+        assert [samples.ids.shape for samples, _ in batches] == [torch.Size([6, 5, 3])] * 3 + [torch.Size([2, 5, 3])]
+        assert all(labels[:, 0].eq(1).all() and labels[:, 1:].eq(0).all() for _, labels in batches)
+
+        # every positive shows up once, followed by corrupted tails
+        positives = torch.cat([samples.ids[:, 0] for samples, _ in batches])
+        assert sorted(positives[:, 0].tolist()) == list(range(20))
+        assert torch.equal(positives[:, 2], (7 * positives[:, 0]) % 20)
+
+    def test_seeded_runs_are_identical(self):
+        first, second = self._load(seed=1), self._load(seed=1)
+
+        for (samples, labels), (other_samples, other_labels) in zip(first, second):
+            assert torch.equal(samples.ids, other_samples.ids) and torch.equal(samples.times, other_samples.times)
+            assert torch.equal(labels, other_labels)
+
+        other_seed = self._load(seed=2)
+        assert not all(torch.equal(samples.ids, other.ids) for (samples, _), (other, _) in zip(first, other_seed))
+
+
+if __name__ == '__main__':
+    unittest.main()
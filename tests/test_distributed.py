@@ -0,0 +1,112 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import socket
+import unittest
+
+from tkge.train.distributed import init_process_group, broadcast_parameters, all_reduce_gradients, all_reduce_sum, \
+    run_hogwild
+
+
+class MockModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+
+        self.dense = torch.nn.Embedding(10, 4)
+        self.sparse = torch.nn.Embedding(10, 4, sparse=True)
+
+    def forward(self, ids: torch.Tensor):
+        return (self.dense(ids[:, 0]) * self.sparse(ids[:, 1])).sum(1).pow(2).mean()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _data_parallel_step(rank: int, world_size: int, port: int):
+    init_process_group(rank, world_size, master_port=port)
+
+    try:
+        # different initializations per rank, overwritten by the one of rank 0
+        torch.manual_seed(rank)
+        model = MockModel()
+        broadcast_parameters(model)
+
+        torch.manual_seed(42)
+        full = MockModel()
+        full.load_state_dict(model.state_dict())
+
+        ids = torch.LongTensor([[0, 1], [2, 3], [4, 5], [6, 7], [8, 9], [1, 0]])
+        shard = ids[rank::world_size]
+
+        model(shard).backward()
+        all_reduce_gradients(model.parameters(), world_size)
+
+        full(ids).backward()
+
+        assert torch.allclose(model.dense.weight.grad, full.dense.weight.grad, atol=1e-6)
+        assert model.sparse.weight.grad.is_sparse
+        assert torch.allclose(model.sparse.weight.grad.to_dense(), full.sparse.weight.grad.to_dense(), atol=1e-6)
+
+        assert all_reduce_sum(rank + 1.) == world_size * (world_size + 1) / 2
+    finally:
+        dist.destroy_process_group()
+
+
+class TestDistributed(unittest.TestCase):
+    def test_gradients_match_single_process(self):
+        world_size = 2
+
+        mp.spawn(_data_parallel_step, args=(world_size, _free_port()), nprocs=world_size, join=True)
+
+
+class MockTask:
+    hogwild_barrier = None
+
+
+class TestHogwild(unittest.TestCase):
+    def test_updates_shared_parameters(self):
+        embedding = torch.nn.Embedding(8, 2, sparse=True)
+        torch.nn.init.zeros_(embedding.weight)
+        embedding.share_memory()
+
+        task = MockTask()
+
+        def train(rank: int):
+            optimizer = torch.optim.SGD(embedding.parameters(), lr=1.)
+
+            # every process descends on its own rows only
+            for _ in range(rank + 1):
+                optimizer.zero_grad()
+                embedding(torch.LongTensor([2 * rank, 2 * rank + 1])).sum().mul(-1).backward()
+                optimizer.step()
+
+            task.hogwild_barrier.wait()
+
+        run_hogwild(train, 4, task)
+
+        assert (embedding.weight == torch.arange(1., 5.).repeat_interleave(2)[:, None]).all()
+
+    def test_failure_is_raised(self):
+        task = MockTask()
+
+        def train(rank: int):
+            if rank == 1:
+                raise ValueError()
+
+            task.hogwild_barrier.wait()
+
+        with self.assertRaises(Exception):
+            run_hogwild(train, 2, task)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,9 @@ sys.path.append(BASE_DIR)
 import torch
 import unittest
 from unittest import mock
+from collections import defaultdict
+
+from tkge.data.batch import Batch
 from tkge.eval.metrics import Evaluation
 
 
@@ -33,5 +36,46 @@ class TestEvaluation(unittest.TestCase):
         assert all(ranks == ranks_gt)
 
 
+class MockFilteredEvaluation(Evaluation):
+    def __init__(self, facts: torch.Tensor, num_entities: int):
+        self.filter = 'time-aware'
+        self.preference = 'optimistic'
+        self.ordering = 'descending'
+        self.vocab_size = num_entities
+        self.device = 'cpu'
+        self.reciprocal_relation = True
+
+        self.filtered_data = {'sp_': defaultdict(list), '_po': defaultdict(list)}
+        for s, p, o, t in facts.tolist():
+            self.filtered_data['sp_'][f"{s}-{p}-None-{t}"].append(o)
+            self.filtered_data['_po'][f"None-{p}-{o}-{t}"].append(s)
+
+
+class TestHeadAndTailRanks(unittest.TestCase):
+    def test_matches_separate_ranking(self):
+        generator = torch.Generator().manual_seed(0)
+        facts = torch.stack([torch.randint(size, (50,), generator=generator) for size in [20, 3, 20, 2]], dim=1)
+        evaluation = MockFilteredEvaluation(facts, num_entities=20)
+        batch = Batch(facts[:30])
+        scores = torch.rand(60, 20, generator=generator)
+
+        ranks_head, ranks_tail = evaluation.head_and_tail_ranks(batch, scores)
+
+        assert torch.equal(ranks_head, evaluation.ranks(batch, scores[:30], miss='s'))
+        assert torch.equal(ranks_tail, evaluation.ranks(batch, scores[30:], miss='o'))
+
+    def test_reciprocal_queries(self):
+        batch = Batch(torch.LongTensor([[1, 2, 3, 4]]), torch.Tensor([[0.5]]))
+
+        queries = batch.head_and_tail_queries(reciprocal=True)
+        assert queries.ids.tolist() == [[3, 3, 1, 4], [1, 2, 3, 4]]
+        assert queries.missing[:, 2].all() and not queries.missing[:, [0, 1, 3]].any()
+        assert queries.times.tolist() == [[0.5], [0.5]]
+
+        queries = batch.head_and_tail_queries()
+        assert queries.ids.tolist() == [[1, 2, 3, 4], [1, 2, 3, 4]]
+        assert queries.missing.tolist() == [[True, False, False, False], [False, False, True, False]]
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,57 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import unittest
+
+from tkge.train.instrumentation import Instrumentation, StageInstrumentation
+
+
+class MockConfig:
+    def __init__(self):
+        self.records = []
+
+    def get(self, key: str):
+        return {"task.device": "cpu", "train.instrumentation.synchronize": True}[key]
+
+    def trace(self, **kwargs):
+        self.records.append(kwargs)
+
+
+class TestStageInstrumentation(unittest.TestCase):
+    def test_records_stages_per_epoch(self):
+        config = MockConfig()
+        instrumentation = StageInstrumentation(config, rank=1)
+
+        loader = [(torch.zeros(3, 4), None), (torch.zeros(2, 4), None)]
+        for samples, _ in instrumentation.iterate("load", loader):
+            with instrumentation.stage("forward", samples.size(0)):
+                pass
+
+        records = instrumentation.end_epoch(1)
+
+        assert records["forward"]["calls"] == 2 and records["forward"]["samples"] == 5
+        # the last call waits for the end of the loader
+        assert records["load"]["calls"] == 3 and records["load"]["samples"] == 5
+        assert {r["stage"] for r in config.records} == {"load", "forward"}
+        assert all(r["epoch"] == 1 and r["rank"] == 1 for r in config.records)
+
+        assert instrumentation.end_epoch(2) == {}
+
+    def test_disabled_measures_nothing(self):
+        config = MockConfig()
+        instrumentation = Instrumentation(config)
+
+        loader = [1, 2]
+        assert instrumentation.iterate("load", loader) is loader
+        with instrumentation.stage("forward", 1):
+            pass
+
+        assert instrumentation.end_epoch(1) == {} and not config.records
+
+
+if __name__ == '__main__':
+    unittest.main()
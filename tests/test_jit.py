@@ -0,0 +1,45 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import numpy as np
+import unittest
+
+from tkge.common.jit import lazy_njit, LazyJit
+
+
+@lazy_njit
+def square(x):
+    return x * x
+
+
+@lazy_njit(calls=[square])
+def sum_of_squares(x):
+    total = 0
+    for i in x:
+        total += square(i)
+    return total
+
+
+@lazy_njit
+def undeclared_sum_of_squares(x):
+    return square(x[0])
+
+
+class TestLazyJit(unittest.TestCase):
+    def test_declared_callees_leave_module_untouched(self):
+        assert sum_of_squares(np.arange(4)) == 14
+        assert isinstance(globals()["square"], LazyJit)
+
+        # the callee is still usable from python
+        assert square(3) == 9
+
+    def test_undeclared_callee_is_rejected(self):
+        with self.assertRaisesRegex(TypeError, "square"):
+            undeclared_sum_of_squares(np.arange(4))
+
+
+if __name__ == '__main__':
+    unittest.main()
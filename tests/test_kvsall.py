@@ -0,0 +1,68 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import unittest
+
+from tkge.data.dataset import KvsAllDataset
+from tkge.data.batch import Batch
+from tkge.models.model import TComplExModel
+
+
+class TestKvsAllDataset(unittest.TestCase):
+    def test_csr_labels(self):
+        data = {'triple': [[0, 0, 1], [0, 0, 2], [0, 0, 2], [3, 0, 2], [4, 1, 5]],
+                'timestamp_id': [[0], [0], [0], [0], [4]],
+                'timestamp_float': [[1.], [1.], [1.], [1.], [5.]]}
+
+        dataset = KvsAllDataset(data, ['timestamp_float'], ['sp_', '_po'], num_entities=6)
+
+        # (0, 0, ?, 0), (3, 0, ?, 0), (4, 1, ?, 4), (?, 0, 1, 0), (?, 0, 2, 0), (?, 1, 5, 4)
+        assert len(dataset) == 6
+        assert (dataset.queries.missing[:3, 2]).all() and (dataset.queries.missing[3:, 0]).all()
+        assert (dataset.queries.times.view(-1) == torch.Tensor([1., 1., 5., 1., 1., 5.])).all()
+
+        queries, labels = dataset.collate([0, 4, 5])
+
+        assert (queries.ids == torch.LongTensor([[0, 0, 1, 0], [0, 0, 2, 0], [4, 1, 5, 4]])).all()
+        assert (labels.to_dense() == torch.Tensor([[0, 1, 1, 0, 0, 0],
+                                                   [1, 0, 0, 1, 0, 0],
+                                                   [0, 0, 0, 0, 1, 0]])).all()
+
+
+class MockTComplExModel(TComplExModel):
+    def __init__(self):
+        torch.nn.Module.__init__(self)
+
+        self.rank = 2
+        self.no_time_emb = False
+        self.init_size = 1.
+        # two relations and their reciprocals
+        self.num_ent, self.num_rel, self.num_ts = 5, 4, 3
+
+        self.prepare_embedding()
+
+
+class TestReciprocalQueries(unittest.TestCase):
+    def test_head_queries_of_reciprocal_relations(self):
+        torch.manual_seed(0)
+        model = MockTComplExModel()
+
+        # (?, p, o, t) queries of a forward and of the last reciprocal relation
+        queries = Batch(torch.LongTensor([[0, 2, 1, 0], [0, 3, 4, 2]])).with_missing(0)
+        tail_queries = Batch(torch.LongTensor([[1, 3, 0, 0], [4, 2, 0, 2]])).with_missing(2)
+
+        scores, _ = model.score_queries(queries)
+
+        assert torch.equal(scores, model.score_queries(tail_queries)[0])
+        assert torch.allclose(model.predict(queries), scores, atol=1e-6)
+
+        facts = Batch(torch.LongTensor([[0, 2, 1, 0], [0, 3, 4, 2]]))
+        assert facts.head_and_tail_queries(reciprocal=True).ids[:2].tolist() == [[1, 3, 0, 0], [4, 2, 0, 2]]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ import torch
 import unittest
 
 from tkge.models.utils import *
+from tkge.data.batch import Batch
 
 
 class TestEvaluation(unittest.TestCase):
@@ -31,6 +32,20 @@ class TestEvaluation(unittest.TestCase):
 
         assert (c == t).all()
 
+    def test_all_candidates_of_ent_batch_queries(self):
+        # ids beyond 2^24 are not representable as float32
+        big = 2 ** 24 + 1
+        q = Batch(torch.LongTensor([[big, 1, 2, 7], [3, 2, big, 8]]), torch.Tensor([[0.5], [1.5]])).with_missing(2)
+        q.missing[0] = torch.BoolTensor([True, False, False, False])
+
+        c = all_candidates_of_ent_queries(q, 3)
+
+        assert c.ids.dtype == torch.long
+        assert (c.ids[:, 0] == torch.LongTensor([0, 1, 2, 3, 3, 3])).all()
+        assert (c.ids[:, 2] == torch.LongTensor([2, 2, 2, 0, 1, 2])).all()
+        assert (c.ids[:, 3] == torch.LongTensor([7, 7, 7, 8, 8, 8])).all()
+        assert (c.times.view(-1) == torch.Tensor([0.5, 0.5, 0.5, 1.5, 1.5, 1.5])).all()
+
 
 if __name__ == '__main__':
     unittest.main()
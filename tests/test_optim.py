@@ -0,0 +1,140 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import unittest
+
+from tkge.train.optim import LazyAdam, LazyAdagrad, get_optimizer
+from tkge.common.error import ConfigurationError
+
+
+class MockModel(torch.nn.Module):
+    def __init__(self, sparse: bool = True):
+        super().__init__()
+
+        self.entity_embedding = torch.nn.Embedding(100, 4, sparse=sparse)
+        self.relation_embedding = torch.nn.Embedding(10, 4)
+
+    def forward(self, ids: torch.Tensor):
+        return (self.entity_embedding(ids[:, 0]) * self.relation_embedding(ids[:, 1])).sum(1).pow(2).mean()
+
+
+def train(model: MockModel, optimizer: torch.optim.Optimizer, steps: int = 20):
+    generator = torch.Generator().manual_seed(0)
+
+    for _ in range(steps):
+        # only the first 10 entities are ever touched
+        ids = torch.stack([torch.randint(10, (8,), generator=generator),
+                           torch.randint(10, (8,), generator=generator)], dim=1)
+
+        optimizer.zero_grad()
+        model(ids).backward()
+        optimizer.step()
+
+
+class MockCompositeOptimizer:
+    """Reference: the torch optimizers for sparse and dense parameters side by side."""
+
+    def __init__(self, *optimizers):
+        self.optimizers = optimizers
+
+    def zero_grad(self):
+        for optimizer in self.optimizers:
+            optimizer.zero_grad()
+
+    def step(self):
+        for optimizer in self.optimizers:
+            optimizer.step()
+
+
+class TestLazyOptimizers(unittest.TestCase):
+    def _assert_matches(self, lazy_optimizer, sparse_optimizer, dense_optimizer):
+        torch.manual_seed(0)
+        lazy, reference = MockModel(), MockModel()
+        reference.load_state_dict(lazy.state_dict())
+
+        optimizer = lazy_optimizer(lazy.parameters())
+        train(lazy, optimizer)
+        train(reference, MockCompositeOptimizer(sparse_optimizer([reference.entity_embedding.weight]),
+                                                dense_optimizer([reference.relation_embedding.weight])))
+
+        assert torch.allclose(lazy.entity_embedding.weight, reference.entity_embedding.weight, atol=1e-6)
+        assert torch.allclose(lazy.relation_embedding.weight, reference.relation_embedding.weight, atol=1e-6)
+
+        # state is kept for the touched rows only
+        state = optimizer.state[lazy.entity_embedding.weight]
+        assert state['size'] == 10
+        assert (state['slots'][10:] == -1).all()
+
+    def test_lazy_adam(self):
+        self._assert_matches(lambda p: LazyAdam(p, lr=0.1),
+                             lambda p: torch.optim.SparseAdam(p, lr=0.1),
+                             lambda p: torch.optim.Adam(p, lr=0.1))
+
+    def test_switch_to_dense_state(self):
+        torch.manual_seed(0)
+        lazy, reference = MockModel(), MockModel()
+        reference.load_state_dict(lazy.state_dict())
+
+        lazy_optimizer = LazyAdagrad(lazy.parameters(), lr=0.1)
+        reference_optimizer = torch.optim.Adagrad(reference.parameters(), lr=0.1)
+
+        for model, optimizer in [(lazy, lazy_optimizer), (reference, reference_optimizer)]:
+            train(model, optimizer, steps=5)
+
+            # a penalty on the whole table makes the gradient dense
+            optimizer.zero_grad()
+            model.entity_embedding.weight.pow(2).sum().backward()
+            optimizer.step()
+
+            train(model, optimizer, steps=5)
+
+        assert 'slots' not in lazy_optimizer.state[lazy.entity_embedding.weight]
+        assert torch.allclose(lazy.entity_embedding.weight, reference.entity_embedding.weight, atol=1e-6)
+
+    def test_lazy_adagrad(self):
+        self._assert_matches(lambda p: LazyAdagrad(p, lr=0.1, initial_accumulator_value=0.1),
+                             lambda p: torch.optim.Adagrad(p, lr=0.1, initial_accumulator_value=0.1),
+                             lambda p: torch.optim.Adagrad(p, lr=0.1, initial_accumulator_value=0.1))
+
+    def test_load_state_dict(self):
+        torch.manual_seed(0)
+        model = MockModel()
+        optimizer = LazyAdam(model.parameters(), lr=0.1)
+        train(model, optimizer, steps=5)
+
+        restored = LazyAdam(model.parameters(), lr=0.1)
+        restored.load_state_dict(optimizer.state_dict())
+
+        state = restored.state[model.entity_embedding.weight]
+        assert state['slots'].dtype == torch.long
+        assert torch.equal(state['slots'], optimizer.state[model.entity_embedding.weight]['slots'])
+
+        # continues like the original
+        train(model, restored, steps=1)
+
+
+class TestGetOptimizer(unittest.TestCase):
+    def test_sparse_model_gets_lazy_optimizer(self):
+        assert isinstance(get_optimizer(MockModel(sparse=True), "Adam", {'lr': 0.1}), LazyAdam)
+        assert isinstance(get_optimizer(MockModel(sparse=False), "Adam", {'lr': 0.1}), torch.optim.Adam)
+
+    def test_regex_groups(self):
+        model = MockModel()
+        optimizer = get_optimizer(model, "Adagrad", {'lr': 0.1},
+                                  {'relation': {'regex': 'relation_.*', 'args': {'lr': 0.5}}})
+
+        relation, default = optimizer.param_groups
+        assert relation['name'] == 'relation' and relation['lr'] == 0.5
+        assert relation['params'] == [model.relation_embedding.weight]
+        assert default['name'] == 'default' and default['lr'] == 0.1
+
+        with self.assertRaises(ConfigurationError):
+            get_optimizer(model, "Adagrad", {'lr': 0.1}, {'time': {'regex': 'time_.*'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
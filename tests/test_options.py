@@ -0,0 +1,84 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import tempfile
+import unittest
+import yaml
+from dataclasses import dataclass, FrozenInstanceError
+from typing import List, Optional
+
+from tkge.common.config import Config
+from tkge.common.error import ConfigurationError
+from tkge.common.options import build_options
+
+
+@dataclass(frozen=True)
+class MockEmbeddingOptions:
+    dim: int
+    init: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class MockOptions:
+    name: str
+    weight: float
+    k: List[int]
+    embedding: MockEmbeddingOptions
+    sparse: bool = False
+
+
+class TestBuildOptions(unittest.TestCase):
+    def setUp(self):
+        self.value = {"name": "mock", "weight": "1e-2", "k": [1, 3.], "embedding": {"dim": 8.}, "+++": "+++"}
+
+    def test_converts_types(self):
+        options = build_options(self.value, MockOptions, "model")
+
+        assert options == MockOptions("mock", 0.01, [1, 3], MockEmbeddingOptions(8))
+        assert isinstance(options.embedding.dim, int)
+
+        with self.assertRaises(FrozenInstanceError):
+            options.weight = 1.
+
+    def test_unknown_key_is_reported(self):
+        self.value["embedding"]["dimm"] = 8
+
+        with self.assertRaisesRegex(ConfigurationError, r"model\.embedding\.dimm \(did you mean dim\?\)"):
+            build_options(self.value, MockOptions, "model")
+
+    def test_missing_and_wrong_types_are_reported(self):
+        with self.assertRaisesRegex(ConfigurationError, "model.weight is missing"):
+            build_options({k: v for k, v in self.value.items() if k != "weight"}, MockOptions, "model")
+
+        with self.assertRaisesRegex(ConfigurationError, "model.sparse should be True or False"):
+            build_options(dict(self.value, sparse="yes"), MockOptions, "model")
+
+        with self.assertRaisesRegex(ConfigurationError, "model.k.1 should be an integer"):
+            build_options(dict(self.value, k=[1, 2.5]), MockOptions, "model")
+
+
+class TestFrozenConfig(unittest.TestCase):
+    def test_frozen_config_rejects_changes(self):
+        options = {"console": {"folder": tempfile.gettempdir(), "flush_interval": 0, "trace_format": "json"},
+                   "model": {"name": "mock", "dropout": 0.4}}
+
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as file:
+            yaml.dump(options, file)
+
+        config = Config(folder=file.name, load_default=False)
+        os.remove(file.name)
+
+        config.freeze()
+
+        assert config.get("model.dropout") == 0.4
+        assert config.get("model.dropout") == 0.4
+
+        with self.assertRaises(ConfigurationError):
+            config.set("model.dropout", 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import unittest
+
+from tkge.train.regularization import InplaceRenormReg, InplaceClampReg, Lambda3Reg, NormReg, N3Reg, F2Reg, RowSubset, \
+    merge_row_subsets
+
+
+class MockInplaceRenormReg(InplaceRenormReg):
+    def __init__(self, row_subset: bool):
+        torch.nn.Module.__init__(self)
+
+        self.p = 2
+        self.dim = 0
+        self.maxnorm = 1
+        self.row_subset = row_subset
+
+
+class MockInplaceClampReg(InplaceClampReg):
+    def __init__(self, row_subset: bool):
+        torch.nn.Module.__init__(self)
+
+        self.min = 0.1
+        self.max = 0.3
+        self.row_subset = row_subset
+
+
+class TestRowSubsetRegularizers(unittest.TestCase):
+    def _assert_matches_full_table(self, reg_type):
+        torch.manual_seed(0)
+        weight = torch.randn(20, 4)
+        reg_type(row_subset=False)([weight])
+
+        # a sparse step only changes the rows of the batch
+        rows = torch.LongTensor([3, 7, 3, 12])
+        weight[rows] += torch.randn(4, 4)
+        full, subset = weight.clone(), weight.clone()
+
+        reg_type(row_subset=False)([RowSubset(full, rows)])
+        reg_type(row_subset=True)([RowSubset(subset, rows)])
+
+        assert torch.equal(full, subset)
+
+    def test_renorm(self):
+        self._assert_matches_full_table(MockInplaceRenormReg)
+
+    def test_clamp(self):
+        self._assert_matches_full_table(MockInplaceClampReg)
+
+    def test_merge_subbatches(self):
+        weight, other = torch.zeros(5, 2), torch.zeros(5, 2)
+
+        merged = merge_row_subsets([(RowSubset(weight, torch.LongTensor([0, 1])), other),
+                                    (RowSubset(weight, torch.LongTensor([4])), other)])
+
+        assert merged[0].weight is weight and merged[0].rows.tolist() == [0, 1, 4]
+        assert merged[1] is other
+
+
+class MockLambda3Reg(Lambda3Reg):
+    def __init__(self, mode: str, every: int = 1):
+        torch.nn.Module.__init__(self)
+
+        self.weight = 0.5
+        self.mode = mode
+        self.every = every
+        self.steps = 0
+
+
+class TestLambda3Reg(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.weight = torch.randn(6, 4, requires_grad=True)
+
+    def test_batch_covering_all_timestamps_equals_full(self):
+        full = MockLambda3Reg("full")([RowSubset(self.weight, torch.LongTensor([0]))])
+        batch = MockLambda3Reg("batch")([RowSubset(self.weight, torch.arange(6).repeat(2))])
+
+        assert torch.allclose(full, batch)
+
+    def test_batch_penalizes_successors_only(self):
+        batch = MockLambda3Reg("batch")([RowSubset(self.weight, torch.LongTensor([1, 5]), sparse=True)])
+        batch.backward()
+
+        # the last timestamp has no successor, the pair (1, 2) is penalized
+        assert self.weight.grad.is_sparse
+        assert self.weight.grad.coalesce().indices()[0].tolist() == [1, 2]
+
+    def test_periodic(self):
+        full = MockLambda3Reg("full")([self.weight])
+        periodic = MockLambda3Reg("periodic", every=3)
+
+        # the steps count optimizer steps, each computed on two sub-batches here
+        penalties = []
+        for _ in range(6):
+            penalties.append([periodic([self.weight]) for _ in range(2)])
+            periodic.step()
+
+        assert penalties[:2] == [[0., 0.]] * 2 and penalties[3:5] == [[0., 0.]] * 2
+        assert all(torch.allclose(penalty, 3 * full) for penalty in penalties[2] + penalties[5])
+
+        # checkpoints carry on the count
+        restored = MockLambda3Reg("periodic", every=3)
+        restored.load_state_dict(periodic.state_dict())
+
+        assert restored.steps == 6
+
+
+class MockNormReg(NormReg):
+    def __init__(self):
+        torch.nn.Module.__init__(self)
+
+
+class MockN3Reg(N3Reg):
+    def __init__(self):
+        torch.nn.Module.__init__(self)
+
+        self.weight = 0.5
+
+
+class MockF2Reg(F2Reg):
+    def __init__(self):
+        torch.nn.Module.__init__(self)
+
+        self.weight = 0.5
+
+
+class TestPenaltyRegularizers(unittest.TestCase):
+    def test_row_subsets_penalize_whole_table(self):
+        torch.manual_seed(0)
+        weights = [torch.randn(6, 4) * 2, torch.randn(3, 4)]
+        subsets = [RowSubset(weights[0], torch.LongTensor([0, 5])), RowSubset(weights[1], torch.LongTensor([1]))]
+
+        for reg in [MockNormReg(), MockN3Reg(), MockF2Reg()]:
+            assert torch.equal(reg(subsets), reg(weights)), reg
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import unittest
+import numpy as np
+from collections import OrderedDict
+
+from tkge.data.batch import Batch
+from tkge.train.sampling import NSCachingNegativeSampler, BernoulliNegativeSampler
+from tkge.indexing import index_bernoulli_probabilities, index_relation_types
+
+
+class MockDataset:
+    def num_entities(self):
+        return 100
+
+
+class MockModel(torch.nn.Module):
+    """Scores a sample by the id of its corrupted entity, so the cache should hold the largest ids."""
+
+    def forward(self, samples):
+        return (samples.ids[:, 0] + samples.ids[:, 2]).float(), None
+
+
+class MockNSCachingNegativeSampler(NSCachingNegativeSampler):
+    def __init__(self, memory_budget: float, targets=('head', 'tail')):
+        self.num_samples = 4
+        self.filter = False
+        self.as_matrix = True
+        self.dataset = MockDataset()
+        self.model = MockModel()
+
+        self.cache_size = 8
+        self.candidate_size = 16
+        self.cache_ratio = 0.5
+        self.memory_budget = memory_budget
+        self.targets = list(targets)
+        self.descending = True
+        self.device = 'cpu'
+
+        self.cache = {'head': OrderedDict(), 'tail': OrderedDict()}
+        self.negatives = {'head': None, 'tail': None}
+
+
+def query(*ids):
+    # the key of a query without timestamp features
+    return np.array(ids, dtype=np.int64).tobytes()
+
+
+class TestNSCachingNegativeSampler(unittest.TestCase):
+    def test_sample_shape_and_positives(self):
+        sampler = MockNSCachingNegativeSampler(memory_budget=1)
+        pos_batch = Batch(torch.LongTensor([[1, 0, 2, 5], [3, 1, 4, 6], [1, 0, 2, 5]]))
+
+        samples, labels = sampler.sample(pos_batch, "tail")
+
+        assert list(samples.size()) == [3, 5]
+        assert samples.ids.dtype == torch.long
+        assert list(labels.shape) == [3, 5]
+
+        assert (samples.ids[:, 0] == pos_batch.ids).all()
+        assert (samples.ids[:, :, [0, 1, 3]] == pos_batch.ids[:, None, [0, 1, 3]]).all()
+
+    def test_cache_keeps_hard_negatives(self):
+        sampler = MockNSCachingNegativeSampler(memory_budget=1)
+        pos_batch = Batch(torch.LongTensor([[1, 0, 2, 5]]))
+
+        for _ in range(20):
+            sampler.sample(pos_batch, "tail")
+
+        cached = sampler.negatives['tail'][sampler.cache['tail'][query(1, 0, 5)]]
+
+        assert cached.dtype == torch.int32
+        assert cached.size(0) == sampler.cache_size
+        # refreshing only ever replaces cached entities by higher-scoring ones
+        assert cached.min() >= 100 - 4 * sampler.cache_size
+
+    def test_lru_eviction(self):
+        sampler = MockNSCachingNegativeSampler(memory_budget=1, targets=['head'])
+        sampler.negatives['head'] = torch.zeros((2, sampler.cache_size), dtype=torch.int32)
+
+        for i in range(5):
+            sampler.sample(Batch(torch.LongTensor([[i, 0, 2, 5]])), "head")
+
+        # head corruptions of these rows all share the query (p, o, t)
+        assert list(sampler.cache['head'].keys()) == [query(0, 2, 5)]
+
+        for i in range(5):
+            sampler.sample(Batch(torch.LongTensor([[1, i, 2, 5]])), "head")
+
+        # evicted rows are taken over by the new queries
+        assert list(sampler.cache['head'].items()) == [(query(3, 2, 5), 1), (query(4, 2, 5), 0)]
+        assert sampler.negatives['head'].size(0) == 2
+
+    def test_bytes_held_within_budget(self):
+        sampler = MockNSCachingNegativeSampler(memory_budget=0.02)
+        pos_batch = Batch(torch.randint(100, (50, 4)), torch.rand((50, 3)))
+
+        for i in range(10):
+            pos_batch.ids[:, 1] = i
+            sampler.sample(pos_batch, "both")
+
+        # the maps including their entries, the keys, the row indices and the tables
+        held = sum(sys.getsizeof(cache) + sum(sys.getsizeof(key) + sys.getsizeof(row) for key, row in cache.items())
+                   for cache in sampler.cache.values())
+        held += sum(table.untyped_storage().nbytes() for table in sampler.negatives.values())
+        budget = sampler.memory_budget * 2 ** 20
+
+        assert len(sampler.cache['head']) == len(sampler.cache['tail']) == sampler.negatives['head'].size(0)
+        assert 0.8 * budget < held <= budget
+
+        # checkpoints restore the caches into tables of the same size
+        restored = MockNSCachingNegativeSampler(memory_budget=0.02)
+        restored.load_state_dict(sampler.state_dict())
+
+        for target in ['head', 'tail']:
+            assert list(restored.cache[target].keys()) == list(sampler.cache[target].keys())
+            assert torch.equal(restored.state_dict()[target]['negatives'], sampler.state_dict()[target]['negatives'])
+
+
+class MockTrainDataset:
+    def __init__(self):
+        # relation 0 is 1-N (one head, many tails), relation 1 is M-1
+        self._indexes = dict()
+        self.train_set = {'triple': [[0, 0, 1], [0, 0, 2], [0, 0, 3], [0, 0, 3],
+                                     [1, 1, 4], [2, 1, 4], [3, 1, 4]]}
+
+    def get(self, split: str = "train"):
+        return self.train_set
+
+    def num_entities(self):
+        return 5
+
+    def num_relations(self):
+        return 3
+
+
+class MockBernoulliNegativeSampler(BernoulliNegativeSampler):
+    def __init__(self, dataset):
+        self.num_samples = 3
+        self.filter = False
+        self.as_matrix = True
+        self.dataset = dataset
+        self.model = None
+
+        self.head_probabilities = index_bernoulli_probabilities(dataset)
+
+
+class TestBernoulliNegativeSampler(unittest.TestCase):
+    def test_relation_statistics(self):
+        dataset = MockTrainDataset()
+
+        probabilities = index_bernoulli_probabilities(dataset)
+
+        assert torch.allclose(probabilities, torch.Tensor([0.75, 0.25, 0.5]))
+        assert index_relation_types(dataset) == ["1-N", "M-1", "1-1"]
+        assert 'bernoulli_probabilities' in dataset._indexes
+
+    def test_single_slot_corrupted(self):
+        sampler = MockBernoulliNegativeSampler(MockTrainDataset())
+        pos_batch = Batch(torch.LongTensor([[0, 0, 1, 7], [1, 1, 4, 8]]).repeat((50, 1)))
+
+        samples, labels = sampler.sample(pos_batch, "both")
+
+        assert list(samples.size()) == [100, 4]
+        assert list(labels.shape) == [100, 4]
+
+        changed_head = (samples.ids[:, :, 0] != pos_batch.ids[:, None, 0]).any(1)
+        changed_tail = (samples.ids[:, :, 2] != pos_batch.ids[:, None, 2]).any(1)
+
+        assert (samples.ids[:, 0] == pos_batch.ids).all()
+        assert not (changed_head & changed_tail).any()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import unittest
+
+from tkge.eval.subsample import query_strata, stratified_subsample, estimate_mean
+
+
+class TestStratifiedSubsample(unittest.TestCase):
+    def setUp(self):
+        generator = torch.Generator().manual_seed(0)
+        # relation 0 is much more frequent than relations 1 and 2
+        relations = torch.cat([torch.zeros(7000), torch.ones(2000), torch.full((1000,), 2)]).long()
+        timestamps = torch.randint(365, (10000,), generator=generator)
+        self.ids = torch.stack([torch.zeros_like(relations), relations, torch.zeros_like(relations), timestamps], 1)
+
+    def test_strata_get_proportional_shares(self):
+        strata = query_strata(self.ids, num_timestamps=365, num_buckets=4)
+        indices = stratified_subsample(strata, 500, seed=1)
+
+        assert len(torch.unique(indices)) == 500
+        assert torch.equal(indices, stratified_subsample(strata, 500, seed=1))
+
+        population = torch.bincount(strata, minlength=12).double()
+        sample = torch.bincount(strata[indices], minlength=12).double()
+        assert (sample - population * 500 / 10000).abs().max() <= 1
+
+    def test_confidence_interval_covers_mean(self):
+        values = (self.ids[:, 1] == 0).double() + torch.rand(10000, generator=torch.Generator().manual_seed(0))
+        strata = query_strata(self.ids, num_timestamps=365, num_buckets=4)
+
+        covered = 0
+        for seed in range(100):
+            indices = stratified_subsample(strata, 200, seed=seed)
+            mean, half_width = estimate_mean(values[indices], population=10000)
+            covered += abs(mean - values.mean().item()) <= half_width
+
+        # stratification by relation removes most of the variance, the interval is conservative
+        assert covered >= 90
+
+    def test_full_population_is_exact(self):
+        strata = query_strata(self.ids, num_timestamps=365, num_buckets=4)
+        indices = stratified_subsample(strata, 10000)
+
+        mean, half_width = estimate_mean(torch.ones(10000)[indices], population=10000)
+        assert mean == 1. and half_width == 0.
+
+
+if __name__ == '__main__':
+    unittest.main()
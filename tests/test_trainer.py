@@ -0,0 +1,187 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import torch
+import unittest
+
+from tkge.data.batch import Batch
+from tkge.task.trainer import TrainTask
+from tkge.models.loss import Loss
+from tkge.train.regularization import NormReg
+from tkge.train.statistics import LossStatistics
+from tkge.train.instrumentation import Instrumentation
+
+
+class MockConfig:
+    def __init__(self, options: dict = None):
+        self.options = options or {}
+        self.messages = []
+
+    def get(self, key: str):
+        value = self.options
+        for name in key.split("."):
+            value = value[name]
+        return value
+
+    def log(self, msg: str, **kwargs):
+        self.messages.append(msg)
+
+
+class MockLoss(Loss):
+    def __init__(self, reduction: str = "mean"):
+        self.reduction = reduction
+
+    def __call__(self, scores, labels, **kwargs):
+        return torch.nn.functional.binary_cross_entropy_with_logits(scores, labels, reduction=self.reduction)
+
+
+class MockNormReg(NormReg):
+    def __init__(self):
+        torch.nn.Module.__init__(self)
+
+
+class MockModel(torch.nn.Module):
+    """
+    Scores samples by an embedding lookup and fails on sub-batches larger than `max_size`. The embeddings of the
+    samples are the factors of a norm penalty.
+    """
+
+    def __init__(self, max_size: int):
+        super().__init__()
+
+        self.max_size = max_size
+        self.embedding = torch.nn.Embedding(10, 1)
+
+    def fit(self, samples: Batch):
+        if samples.size(0) > self.max_size:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+
+        embeddings = self.embedding(samples.ids[..., 2])
+
+        return embeddings.squeeze(-1), {"norm": embeddings.view(-1, 1) * 2}
+
+
+class MockTrainTask(TrainTask):
+    def __init__(self, subbatch_size: int, subbatch_auto_tune: bool, max_size: int = 100, reduction: str = "mean"):
+        torch.manual_seed(0)
+
+        self.config = MockConfig()
+        self.train_type = "negative_sampling"
+        self.world_size = 1
+        self.subbatch_size = subbatch_size
+        self.subbatch_auto_tune = subbatch_auto_tune
+
+        self.model = MockModel(max_size)
+        self.optimizer = torch.optim.SGD(self.model.parameters(), lr=1.)
+        self.loss = MockLoss(reduction)
+        self.regularizer = {"norm": MockNormReg()}
+        self.inplace_regularizer = dict()
+        self.instrumentation = Instrumentation(self.config)
+
+
+class TestSubbatching(unittest.TestCase):
+    def setUp(self):
+        self.samples = Batch(torch.LongTensor([[0, 0, i % 10, 0] for i in range(24)]).view(8, 3, 4))
+        self.labels = torch.Tensor([[1, 0, 0]]).repeat(8, 1)
+
+    def test_equivalent_to_full_batch(self):
+        # the norm penalty sums over the samples
+        for reduction in ["mean", "sum"]:
+            full = MockTrainTask(subbatch_size=-1, subbatch_auto_tune=False, reduction=reduction)
+            split = MockTrainTask(subbatch_size=3, subbatch_auto_tune=False, reduction=reduction)
+
+            full_terms = full._train_batch(self.samples, self.labels)
+            split_terms = split._train_batch(self.samples, self.labels)
+
+            for name in ["loss", "data", "norm"]:
+                assert torch.allclose(full_terms[name], split_terms[name]), (reduction, name)
+            assert full_terms["norm"] > 0
+            assert torch.allclose(full.model.embedding.weight, split.model.embedding.weight, atol=1e-6), reduction
+
+    def test_auto_tune_halves_subbatch_size(self):
+        task = MockTrainTask(subbatch_size=-1, subbatch_auto_tune=True, max_size=3)
+
+        task._train_batch(self.samples, self.labels)
+
+        assert task.subbatch_size == 2
+        assert len(task.config.messages) == 2
+
+    def test_out_of_memory_raised_without_auto_tune(self):
+        task = MockTrainTask(subbatch_size=-1, subbatch_auto_tune=False, max_size=3)
+
+        with self.assertRaises(RuntimeError):
+            task._train_batch(self.samples, self.labels)
+
+
+class MockValidatedTrainTask(TrainTask):
+    def __init__(self, metric: str, patience: int = 0, threshold_epochs: int = 0, threshold: float = 0.):
+        self.config = MockConfig({"train": {"valid": {"every": 1, "early_stopping": {
+            "patience": patience, "threshold": {"epochs": threshold_epochs, "metric_value": threshold}}}}})
+        self.valid_metric = metric
+        self.best_metric = None
+        self.validations_without_improvement = 0
+
+        self.model = torch.nn.Linear(1, 1)
+        self.optimizer = torch.optim.SGD(self.model.parameters(), lr=1.)
+        self.lr_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(self.optimizer, mode="max", patience=0)
+
+    def validate(self, values):
+        """Validates every epoch with the given metric values and returns the epoch after which training stops."""
+        for epoch, value in enumerate(values, start=1):
+            self._track_validation(value)
+            self._step_scheduler(avg_loss=0., value=value)
+            if self._should_stop_early(epoch):
+                return epoch
+
+
+class TestEarlyStopping(unittest.TestCase):
+    def test_patience(self):
+        task = MockValidatedTrainTask("mean_reciprocal_ranking", patience=2)
+
+        assert task.validate([0.1, 0.2, 0.15, 0.3, 0.25, 0.2, 0.4]) == 6
+        assert task.best_metric == 0.3
+
+    def test_lower_mean_rank_is_better(self):
+        task = MockValidatedTrainTask("mean_ranking", patience=1)
+
+        assert task.validate([100., 80., 90.]) == 3
+
+    def test_threshold(self):
+        assert MockValidatedTrainTask("hits_at_10", threshold_epochs=2, threshold=0.5).validate([0.1, 0.4, 0.6]) == 2
+        assert MockValidatedTrainTask("hits_at_10", threshold_epochs=2, threshold=0.5).validate([0.1, 0.5, 0.6]) is None
+
+    def test_plateau_scheduler_follows_validation_metric(self):
+        task = MockValidatedTrainTask("mean_reciprocal_ranking")
+        task.validate([0.1, 0.2, 0.2])
+
+        assert task.optimizer.param_groups[0]["lr"] == 0.1
+
+
+class TestLossStatistics(unittest.TestCase):
+    def test_per_sample_and_per_batch_means(self):
+        statistics = LossStatistics(["loss", "data", "n3"])
+
+        statistics.add({"loss": torch.tensor(3.), "data": torch.tensor(1.), "n3": torch.tensor(2.)}, batch_size=3)
+        statistics.add({"loss": torch.tensor(1.), "data": torch.tensor(1.)}, batch_size=1)
+
+        summary = statistics.summary()
+
+        assert summary["avg_loss"] == 2.5 and summary["avg_loss_per_batch"] == 2.
+        assert summary["avg_data"] == 1. and summary["avg_n3"] == 1.5
+
+    def test_sum_over_processes(self):
+        statistics = [LossStatistics(["loss"]) for _ in range(2)]
+        statistics[0].add({"loss": torch.tensor(2.)}, batch_size=2)
+        statistics[1].add({"loss": torch.tensor(4.)}, batch_size=2)
+
+        merged = LossStatistics.from_tensor(["loss"], statistics[0].to_tensor() + statistics[1].to_tensor())
+
+        assert merged.num_samples == 4 and merged.num_batches == 2
+        assert merged.summary()["avg_loss"] == 3.
+
+
+if __name__ == '__main__':
+    unittest.main()
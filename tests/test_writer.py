@@ -0,0 +1,83 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import multiprocessing as mp
+import pickle
+import tempfile
+import time
+import unittest
+
+from tkge.common.writer import BackgroundWriter
+
+
+def _read(path: str) -> str:
+    if not os.path.exists(path):
+        return ""
+
+    with open(path) as file:
+        return file.read()
+
+
+class TestBackgroundWriter(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "log", "kge.log")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_flushes_in_background(self):
+        writer = BackgroundWriter(self.path, flush_interval=0.05)
+
+        writer.write("a\n")
+        writer.write("b\n")
+        assert _read(self.path) == ""
+
+        time.sleep(0.5)
+        assert _read(self.path) == "a\nb\n"
+
+        writer.close()
+
+    def test_flushes_early_when_full(self):
+        writer = BackgroundWriter(self.path, flush_interval=60, flush_size=4)
+
+        writer.write("abcd\n")
+        time.sleep(0.5)
+
+        assert _read(self.path) == "abcd\n"
+
+        writer.close()
+
+    def test_writes_through_without_interval(self):
+        writer = BackgroundWriter(self.path, flush_interval=0)
+
+        writer.write("a\n")
+
+        assert _read(self.path) == "a\n"
+
+    def test_forked_process_flushes_on_exit(self):
+        writer = BackgroundWriter(self.path, flush_interval=60)
+        writer.write("parent\n")
+
+        process = mp.get_context("fork").Process(target=writer.write, args=("child\n",))
+        process.start()
+        process.join()
+
+        assert _read(self.path) == "child\n"
+
+        writer.close()
+        assert _read(self.path) == "child\nparent\n"
+
+    def test_pickle_keeps_settings(self):
+        writer = pickle.loads(pickle.dumps(BackgroundWriter(self.path, flush_interval=0)))
+
+        writer.write("a\n")
+
+        assert _read(self.path) == "a\n"
+
+
+if __name__ == '__main__':
+    unittest.main()
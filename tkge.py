@@ -1,8 +1,7 @@
 import argparse
+import sys
 
 from tkge.task.task import Task
-from tkge.task.trainer import TrainTask
-from tkge.task.tester import TestTask
 from tkge.common.config import Config
 
 desc = 'Temporal KG Completion methods'
@@ -23,21 +22,45 @@ subparsers = parser.add_subparsers(title="task",
                                    description="valid tasks: train, evaluate, predict, search",
                                    dest="task")
 
-# subparser train
-parser_train = TrainTask.parse_arguments(subparsers)
-parser_eval = TestTask.parse_arguments(subparsers)
+# only the task to run is imported, with torch and the models; `--help` imports none of them
+task_name = next((arg for arg in sys.argv[1:] if arg in Task.list_available()), None)
 
-args = parser.parse_args()
+for name in Task.list_available():
+    if name == task_name:
+        Task.by_name(name).parse_arguments(subparsers)
+    else:
+        subparsers.add_parser(name, help=f"see `{name} --help`")
 
-task_dict = {
-    'train': TrainTask,
-    'eval': TestTask
-}
+# the training processes of `train --num-processes` re-import this module
+if __name__ == '__main__':
+    args = parser.parse_args()
 
-config = Config(folder=args.config, load_default=False)  # TODO load_default is false
-task = task_dict[args.task](config)
+    if args.task is None:
+        parser.print_help()
+        sys.exit(1)
 
-task.main()
+    config = Config(folder=args.config, load_default=False)  # TODO load_default is false
 
-# trainer = TrainTask(config)
-# tester = TestTask(config)
+    if args.task == 'train':
+        if args.resume:
+            config = Task.by_name("train").resume_config(config, args.overrides)
+
+        if args.num_processes is not None:
+            config.set("train.distributed.num_processes", args.num_processes)
+
+        num_processes = config.get("train.distributed.num_processes")
+        if num_processes > 1:
+            from tkge.train.distributed import launch
+
+            launch(Task.by_name("train"), config, num_processes)
+            sys.exit(0)
+
+    if args.task == 'eval' and args.num_processes is not None:
+        config.set("test.num_processes", args.num_processes)
+
+    task = Task.by_name(args.task)(config)
+
+    task.main()
+
+    # trainer = TrainTask(config)
+    # tester = TestTask(config)
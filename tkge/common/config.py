@@ -1,7 +1,8 @@
-from typing import Any, Dict, Optional, Union, TypeVar
+from typing import Any, Dict, Optional, Type, Union, TypeVar
 import yaml
+import json
 import copy
-import collections
+from collections.abc import Mapping
 import os
 import time
 import uuid
@@ -11,8 +12,11 @@ import re
 from enum import Enum
 
 from tkge.common.error import ConfigurationError
+from tkge.common.writer import BackgroundWriter
+from tkge.common.options import build_options
 
 T = TypeVar("T", bound="Config")
+O = TypeVar("O")
 
 
 class Config:
@@ -34,10 +38,19 @@ class Config:
             with open(folder, "r") as file:
                 self.options = yaml.load(file, Loader=yaml.SafeLoader)
 
+        # set by `freeze` once the task is set up, see `get`
+        self.frozen = False
+        self._frozen_values: Dict[str, Any] = dict()
+
         self.folder = folder  # main folder (config file, checkpoints, ...)
         self.log_folder = self.get("console.folder")  # None means use self.folder; used for kge.log, trace.yaml
         self.log_prefix: str = None
 
+        # kge.log and the trace file are written by background writers, created on first use
+        self.flush_interval = self.get("console.flush_interval")
+        self.trace_format = self.check("console.trace_format", ["yaml", "json"])
+        self._writers: Dict[str, BackgroundWriter] = dict()
+
     def _import(self, module_name: str):
         """Imports the specified module configuration.
 
@@ -90,7 +103,14 @@ class Config:
         Nested dictionary values can be accessed via "." (e.g., "job.type"). Strips all
         '+++' keys unless `remove_plusplusplus` is set to `False`.
 
+        Once the configuration is frozen, scalar values are looked up only once per
+        key. Modules reading options on every batch should nevertheless take a
+        `snapshot` of their options in their constructor.
+
         """
+        if self.frozen and key in self._frozen_values:
+            return self._frozen_values[key]
+
         result = self.options
 
         for name in key.split("."):
@@ -102,10 +122,10 @@ class Config:
         if isinstance(result, str) and re.findall(r'[+\-]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)', result):
             result = float(result)
 
-        if remove_plusplusplus and isinstance(result, collections.Mapping):
+        if remove_plusplusplus and isinstance(result, Mapping):
             def do_remove_plusplusplus(option):
                 """Recursive function to remove '+++'"""
-                if isinstance(option, collections.Mapping):
+                if isinstance(option, Mapping):
                     option.pop("+++", None)
                     for values in option.values():
                         do_remove_plusplusplus(values)
@@ -114,8 +134,32 @@ class Config:
             result = copy.deepcopy(result)
             do_remove_plusplusplus(result)
 
+        if self.frozen and (result is None or isinstance(result, (str, int, float, bool))):
+            self._frozen_values[key] = result
+
         return result
 
+    def snapshot(self, key: str, options_type: Type[O]) -> O:
+        """Return the options under ``key`` as an instance of the frozen dataclass ``options_type``.
+
+        Values are converted to the annotated types of the fields. Missing options,
+        options of the wrong type and unknown (e.g. mistyped) keys under ``key`` raise
+        a :class:`ConfigurationError` right away, i.e. when a module is set up
+        instead of when an option is first used. See :func:`build_options`.
+
+        """
+        return build_options(self.get(key), options_type, key)
+
+    def freeze(self):
+        """Make the configuration read-only, e.g. after a task has been set up.
+
+        Modules keep the snapshots of their options taken during setup, later
+        changes would silently not apply to them. Setting an option of a frozen
+        configuration raises a :class:`ConfigurationError`.
+
+        """
+        self.frozen = True
+
     def get_default(self, key: str) -> Any:
         """Returns the value of the key if present or default if not.
 
@@ -185,6 +229,9 @@ class Config:
         into the configuration.
 
         """
+        if self.frozen:
+            raise ConfigurationError(f"Cannot set {key}, the configuration is frozen")
+
         create = True
         from tkge.common.misc import is_number
 
@@ -347,33 +394,45 @@ class Config:
         return new_config
 
     # Logging and Tracing
+    def _writer(self, filename: str) -> BackgroundWriter:
+        if filename not in self._writers:
+            self._writers[filename] = BackgroundWriter(filename, self.flush_interval)
+
+        return self._writers[filename]
+
+    def flush(self):
+        """Write the buffered log messages and trace records to their files."""
+        for writer in self._writers.values():
+            writer.flush()
+
     def log(self, msg: str, echo=True, prefix=""):
         """Add a message to the default log file.
 
         Optionally also print on console. ``prefix`` is used to indent each
-        output line.
+        output line. The message is written to the file within
+        ``console.flush_interval`` seconds.
 
         """
-        if not os.path.exists(self.logdir()):
-            os.makedirs(self.logdir(), 0o700)
-
-        with open(self.logfile(), "a") as file:
-            for line in msg.splitlines():
-                if prefix:
-                    line = prefix + line
-                if self.log_prefix:
-                    line = self.log_prefix + line
-                if echo:
-                    print(line)
-                file.write(str(datetime.datetime.now()) + " " + line + "\n")
+        lines = []
+        for line in msg.splitlines():
+            if prefix:
+                line = prefix + line
+            if self.log_prefix:
+                line = self.log_prefix + line
+            if echo:
+                print(line)
+            lines.append(str(datetime.datetime.now()) + " " + line + "\n")
+
+        self._writer(self.logfile()).write("".join(lines))
 
     def trace(
             self, echo=False, echo_prefix="", echo_flow=False, log=False, **kwargs
     ) -> Dict[str, Any]:
         """Write a set of key-value pairs to the trace file.
 
-        The pairs are written as a single-line YAML record. Optionally, also
-        echo to console and/or write to log file.
+        The pairs are written as a single-line YAML record or, with
+        ``console.trace_format`` json, as a JSON line. Optionally, also echo to
+        console and/or write to log file.
 
         And id and the current time is automatically added using key ``timestamp``.
 
@@ -381,7 +440,10 @@ class Config:
         """
         kwargs["timestamp"] = time.time()
         kwargs["entry_id"] = str(uuid.uuid4())
-        line = yaml.dump(kwargs, width=float("inf"), default_flow_style=True).strip()
+        if self.trace_format == "json":
+            line = json.dumps(kwargs, separators=(",", ":"), default=_json_default)
+        else:
+            line = yaml.dump(kwargs, width=float("inf"), default_flow_style=True).strip()
         if echo or log:
             msg = yaml.dump(kwargs, default_flow_style=echo_flow)
             if log:
@@ -391,8 +453,7 @@ class Config:
                     if echo_prefix:
                         line = echo_prefix + line
                         print(line)
-        with open(self.tracefile(), "a") as file:
-            file.write(line + "\n")
+        self._writer(self.tracefile()).write(line + "\n")
         return kwargs
 
     # -- FOLDERS AND CHECKPOINTS ----------------------------------------------
@@ -504,7 +565,15 @@ class Config:
 
     def tracefile(self) -> str:
         folder = self.log_folder if self.log_folder else self.folder
-        return os.path.join(folder, "trace.yaml")
+        return os.path.join(folder, "trace.jsonl" if self.trace_format == "json" else "trace.yaml")
+
+
+def _json_default(value):
+    """Serializes numpy and torch scalars in trace records, and anything else as its string."""
+    if hasattr(value, "item"):
+        return value.item()
+
+    return str(value)
 
 
 def _process_deprecated_options(options: Dict[str, Any]):
@@ -0,0 +1,56 @@
+import functools
+import types
+from typing import Sequence
+
+
+class LazyJit:
+    """
+    A function compiled by `numba.njit` on its first call, see `lazy_njit`.
+
+    numba is imported only then, and the compiled machine code is cached on disk (`cache=True`, in __pycache__ next
+    to the source), so later runs load it instead of compiling again. The LazyJit functions the function calls are
+    declared as `calls`: they are compiled first and their dispatchers bound to their names in a copy of the
+    function's globals, such that jitted functions can call each other while the modules are left untouched.
+    """
+
+    def __init__(self, fn, calls: Sequence["LazyJit"] = (), **options):
+        self.fn = fn
+        self.calls = tuple(calls)
+        self.options = dict(cache=True, **options)
+        self._dispatcher = None
+
+        functools.update_wrapper(self, fn)
+
+    @property
+    def dispatcher(self):
+        if self._dispatcher is None:
+            import numba
+
+            fn = self.fn
+            if self.calls:
+                globals_ = dict(fn.__globals__)
+                globals_.update({callee.__name__: callee.dispatcher for callee in self.calls})
+                fn = types.FunctionType(fn.__code__, globals_, fn.__name__, fn.__defaults__, fn.__closure__)
+
+            undeclared = [name for name in fn.__code__.co_names if isinstance(fn.__globals__.get(name), LazyJit)]
+            if undeclared:
+                raise TypeError(f"{self.fn.__qualname__} calls the lazily jitted {undeclared}, which should be "
+                                f"declared with lazy_njit(calls=...)")
+
+            self._dispatcher = numba.njit(**self.options)(fn)
+
+        return self._dispatcher
+
+    def __call__(self, *args, **kwargs):
+        return self.dispatcher(*args, **kwargs)
+
+
+def lazy_njit(fn=None, calls: Sequence[LazyJit] = (), **options):
+    """
+    Decorator like `numba.njit` compiling on the first call, used as `@lazy_njit` or `@lazy_njit(**options)`. The
+    LazyJit functions the function calls, by their own name, are declared as `calls`.
+    """
+    if fn is None:
+        return functools.partial(lazy_njit, calls=calls, **options)
+
+    return LazyJit(fn, calls=calls, **options)
@@ -2,12 +2,15 @@
 
 from typing import List
 
+import numpy as np
 from torch import nn as nn
 import os
 # from path import Path
 import inspect
 import subprocess
 
+from tkge.common.jit import lazy_njit
+
 def is_number(s, number_type):
     """ Returns True is string is a number. """
     try:
@@ -125,3 +128,46 @@ def round_to_points(round_points_to: List[int], to_be_rounded: int):
                 round_to_points.__name__
             )
         )
+
+
+def get_seed(config, what: str) -> int:
+    """
+    Returns the seed of PRNG `what` (e.g., python, torch, numpy) as set in `random_seed.<what>`. If it is -1, a seed
+    is derived from `random_seed.default` and the name of the PRNG. Returns -1 if neither is set.
+    """
+    seed = config.get(f"random_seed.{what}")
+    if seed < 0 and config.get("random_seed.default") >= 0:
+        import zlib
+        # python's hash() of strings is salted per process, crc32 is stable
+        seed = (config.get("random_seed.default") + zlib.crc32(what.encode())) % 2 ** 32
+
+    return seed
+
+
+@lazy_njit
+def seed_numba(seed: int):
+    """Seeds the PRNG of numba, which is separate from the one of numpy."""
+    np.random.seed(seed)
+
+
+def seed_from_config(config):
+    """Seeds the python, torch, numpy and numba PRNGs of the current process as configured in `random_seed`."""
+    import random
+    import numpy
+    import torch
+
+    seed = get_seed(config, "python")
+    if seed > -1:
+        random.seed(seed)
+
+    seed = get_seed(config, "torch")
+    if seed > -1:
+        torch.manual_seed(seed)
+
+    seed = get_seed(config, "numpy")
+    if seed > -1:
+        numpy.random.seed(seed)
+
+    seed = get_seed(config, "numba")
+    if seed > -1:
+        seed_numba(seed)
@@ -0,0 +1,119 @@
+import collections.abc
+import dataclasses
+import difflib
+import typing
+from typing import Any, Type, TypeVar
+
+from tkge.common.error import ConfigurationError
+
+O = TypeVar("O")
+
+
+def build_options(value: Any, options_type: Type[O], key: str) -> O:
+    """
+    Converts the configuration subtree `value` found at `key` into an instance of the (frozen) dataclass
+    `options_type`, see `Config.snapshot`.
+
+    Every field of the dataclass is looked up in the subtree and converted to its annotated type: bool, int, float,
+    str, Optional, List, Tuple, Dict (any mapping) and nested dataclasses are supported, `Any` takes the value as it is.
+    Fields with defaults may be missing. Raises a ConfigurationError for a missing field, a value of the wrong type and
+    for keys of the subtree not matching any field, e.g. mistyped ones.
+    """
+    if not isinstance(value, collections.abc.Mapping):
+        raise ConfigurationError(f"Options {key} should be a mapping, got {value!r}")
+
+    hints = typing.get_type_hints(options_type)
+    fields = {field.name: field for field in dataclasses.fields(options_type)}
+
+    unknown = [name for name in value if name not in fields and name != "+++"]
+    if unknown:
+        suggestions = {name: difflib.get_close_matches(name, fields, n=1) for name in unknown}
+        hints_msg = ", ".join(f"{key}.{name}" + (f" (did you mean {match[0]}?)" if match else "")
+                              for name, match in suggestions.items())
+        raise ConfigurationError(f"Unknown options {hints_msg}, expected {list(fields)}")
+
+    kwargs = dict()
+    for name, field in fields.items():
+        if name not in value:
+            if field.default is dataclasses.MISSING and field.default_factory is dataclasses.MISSING:
+                raise ConfigurationError(f"Option {key}.{name} is missing")
+            continue
+
+        kwargs[name] = _convert(value[name], hints[name], f"{key}.{name}")
+
+    return options_type(**kwargs)
+
+
+def _convert(value: Any, value_type: Any, key: str) -> Any:
+    origin = getattr(value_type, "__origin__", None)
+    args = getattr(value_type, "__args__", None) or ()
+
+    if value_type is Any:
+        return value
+
+    if origin is typing.Union:
+        if value is None and type(None) in args:
+            return None
+
+        errors = []
+        for arg in args:
+            if arg is type(None):
+                continue
+            try:
+                return _convert(value, arg, key)
+            except ConfigurationError as e:
+                errors.append(str(e))
+
+        raise ConfigurationError("; ".join(errors))
+
+    if dataclasses.is_dataclass(value_type):
+        return build_options(value, value_type, key)
+
+    if origin in (list, tuple) or value_type in (list, tuple):
+        if not isinstance(value, (list, tuple)):
+            raise ConfigurationError(f"Option {key} should be a list, got {value!r}")
+
+        if origin is tuple and not (len(args) == 2 and args[1] is Ellipsis):
+            if len(args) != len(value):
+                raise ConfigurationError(f"Option {key} should have {len(args)} entries, got {value!r}")
+            return tuple(_convert(v, arg, f"{key}.{i}") for i, (v, arg) in enumerate(zip(value, args)))
+
+        item_type = args[0] if args else Any
+        items = [_convert(v, item_type, f"{key}.{i}") for i, v in enumerate(value)]
+
+        return tuple(items) if (origin or value_type) is tuple else items
+
+    if origin is dict or value_type is dict:
+        if not isinstance(value, collections.abc.Mapping):
+            raise ConfigurationError(f"Option {key} should be a mapping, got {value!r}")
+
+        return {k: v for k, v in value.items() if k != "+++"}
+
+    if value_type is bool:
+        if not isinstance(value, bool):
+            raise ConfigurationError(f"Option {key} should be True or False, got {value!r}")
+        return value
+
+    if value_type in (int, float):
+        # yaml reads numbers like 1e-2 as strings, see Config.get
+        try:
+            number = float(value) if isinstance(value, str) else value
+        except ValueError:
+            number = None
+
+        if isinstance(number, bool) or not isinstance(number, (int, float)):
+            raise ConfigurationError(f"Option {key} should be a number, got {value!r}")
+
+        if value_type is int:
+            if number != int(number):
+                raise ConfigurationError(f"Option {key} should be an integer, got {value!r}")
+            return int(number)
+
+        return float(number)
+
+    if value_type is str:
+        if not isinstance(value, str):
+            raise ConfigurationError(f"Option {key} should be a string, got {value!r}")
+        return value
+
+    raise ConfigurationError(f"Option {key} has unsupported type {value_type}")
@@ -20,6 +20,8 @@ class Registrable(Configurable):
     """
 
     _registry: Dict[Type, Dict[str, Tuple[Type, Optional[str]]]] = defaultdict(dict)
+    # names declared with `register_lazy`, mapped to the module registering them
+    _lazy_registry: Dict[Type, Dict[str, str]] = defaultdict(dict)
     default_implementation: Optional[str] = None
 
     @classmethod
@@ -54,10 +56,22 @@ class Registrable(Configurable):
                     raise ConfigurationError(msg)
 
             registry[name] = (subclass, constructor)
+            Registrable._lazy_registry[cls].pop(name, None)
             return subclass
 
         return register_subclass
 
+    @classmethod
+    def register_lazy(cls: Type[T], name: str, module: str):
+        """
+        Declares that importing `module` registers a subclass under `name`, without importing it.
+
+        The module is imported by the first `by_name(name)`, so modules that are never used, and their
+        dependencies, aren't imported at all.
+        """
+        if name not in Registrable._registry[cls]:
+            Registrable._lazy_registry[cls][name] = module
+
     @classmethod
     def by_name(cls: Type[T], name: str) -> Callable[..., T]:
         """
@@ -83,6 +97,14 @@ class Registrable(Configurable):
         a constructor (as you need to call `cls.register()` in order to tell us what separate
         function to use).
         """
+        if name in Registrable._lazy_registry[cls]:
+            module = Registrable._lazy_registry[cls][name]
+            importlib.import_module(module)
+
+            if name not in Registrable._registry[cls]:
+                raise ConfigurationError(f"{name} is declared in module {module}, which doesn't register it as "
+                                         f"{cls.__name__}")
+
         if name in Registrable._registry[cls]:
             subclass, constructor = Registrable._registry[cls][name]
             return subclass, constructor
@@ -124,7 +146,7 @@ class Registrable(Configurable):
     @classmethod
     def list_available(cls) -> List[str]:
         """List default first if it exists"""
-        keys = list(Registrable._registry[cls].keys())
+        keys = list(Registrable._registry[cls].keys()) + list(Registrable._lazy_registry[cls].keys())
         default = cls.default_implementation
 
         if default is None:
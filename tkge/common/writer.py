@@ -0,0 +1,113 @@
+import os
+import threading
+from multiprocessing.util import Finalize
+
+
+class BackgroundWriter:
+    """
+    Appends text to a file, buffering it in memory and writing it from a background thread.
+
+    `write` only appends to the buffer. The buffer is written to the file (and flushed to the OS) every
+    `flush_interval` seconds, as soon as it holds `flush_size` characters, on `flush` and when the process exits, also
+    for processes forked or spawned by multiprocessing. A crashing process thus loses at most the text written in the
+    last `flush_interval` seconds. With `flush_interval` <= 0 every write goes to the file right away.
+
+    The writer can be used from several threads and survives a fork: the child starts with an empty buffer and its
+    own background thread, the text buffered by the parent is written by the parent. Pickling it (e.g. as part of a
+    Config passed to a spawned process) only keeps its settings.
+    """
+
+    def __init__(self, path: str, flush_interval: float, flush_size: int = 1 << 16):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._init_process()
+
+    def _init_process(self):
+        self._pid = os.getpid()
+
+        self._lock = threading.Lock()  # guards the buffer
+        self._io_lock = threading.Lock()  # keeps the order of concurrent flushes
+        self._buffer = []
+        self._size = 0
+
+        self._file = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        Finalize(None, self.close, exitpriority=0)
+
+    def write(self, text: str):
+        if self._pid != os.getpid():
+            self._init_process()
+
+        with self._lock:
+            self._buffer.append(text)
+            self._size += len(text)
+            size = self._size
+
+            if self.flush_interval > 0 and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"writer {self.path}", daemon=True)
+                self._thread.start()
+
+        if self.flush_interval <= 0:
+            self.flush()
+        elif size >= self.flush_size:
+            self._wakeup.set()
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+
+        with self._io_lock:
+            with self._lock:
+                text, self._buffer, self._size = "".join(self._buffer), [], 0
+
+            if not text:
+                return
+
+            if self._file is None:
+                folder = os.path.dirname(self.path)
+                if folder:
+                    os.makedirs(folder, 0o700, exist_ok=True)
+
+                self._file = open(self.path, "a")
+
+            self._file.write(text)
+            self._file.flush()
+
+    def close(self):
+        """Writes the buffered text and stops the background thread. Later writes reopen the file."""
+        if self._pid != os.getpid():
+            return
+
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+        self.flush()
+
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+        self._thread = None
+        self._closed = False
+        self._wakeup.clear()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+
+            self.flush()
+
+    def __getstate__(self):
+        return {'path': self.path, 'flush_interval': self.flush_interval, 'flush_size': self.flush_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
@@ -1,2 +1,8 @@
 from .dataset import DatasetProcessor
-from .custom_dataset import ICEWS14AtiseDatasetProcessor, TestICEWS14DatasetProcessor
+from .batch import Batch
+
+# the custom datasets are imported by DatasetProcessor.create, see Registrable.register_lazy
+DatasetProcessor.register_lazy("icews14_atise", "tkge.data.custom_dataset")
+DatasetProcessor.register_lazy("yago11k", "tkge.data.custom_dataset")
+DatasetProcessor.register_lazy("icews14_TA", "tkge.data.custom_dataset")
+DatasetProcessor.register_lazy("icews14_tcomplex", "tkge.data.custom_dataset")
@@ -0,0 +1,139 @@
+import torch
+
+from typing import List, Optional, Union
+
+
+class Batch:
+    """
+    Typed batch of (temporal) facts flowing from the data loader through negative sampling to the models and the
+    evaluation.
+
+    Attributes:
+        ids: int64 tensor of shape [..., 3] or [..., 4] holding (s, p, o) and, if timestamps are indexed, the
+            timestamp id t
+        times: float tensor of shape [..., k] holding the float time features (e.g. year, month, day), k may be 0
+        missing: optional bool tensor shaped like ids marking the slots absent in prediction queries
+
+    A flat batch has a leading dimension of batch_size. Negative samplers return matrix batches of shape
+    [batch_size, 1 + num_samples, ...] whose first sample per row is the positive, see `as_matrix`.
+    """
+
+    def __init__(self, ids: torch.Tensor, times: Optional[torch.Tensor] = None, missing: Optional[torch.Tensor] = None):
+        self.ids = ids
+        self.times = times if times is not None else ids.new_zeros(ids.shape[:-1] + (0,), dtype=torch.float)
+        self.missing = missing
+
+    @staticmethod
+    def collate(batch: Union[List["Batch"], "Batch"]) -> "Batch":
+        """Collate function stacking single facts into a flat batch, to be passed as `collate_fn` of a DataLoader."""
+        if isinstance(batch, Batch):
+            # already fetched as a whole by SplitDataset.__getitems__
+            return batch
+
+        return Batch(torch.stack([b.ids for b in batch], dim=0),
+                     torch.stack([b.times for b in batch], dim=0))
+
+    @staticmethod
+    def cat(batches: List["Batch"], dim: int = 0) -> "Batch":
+        missing = None
+        if any(b.missing is not None for b in batches):
+            missing = torch.cat([b.missing if b.missing is not None else torch.zeros_like(b.ids, dtype=torch.bool)
+                                 for b in batches], dim=dim)
+
+        return Batch(torch.cat([b.ids for b in batches], dim=dim),
+                     torch.cat([b.times for b in batches], dim=dim),
+                     missing)
+
+    def __len__(self):
+        return self.ids.size(0)
+
+    def size(self, dim: Optional[int] = None):
+        """Size of the batch without the trailing column dimension, e.g. [batch_size, 1 + num_samples]."""
+        size = self.ids.shape[:-1]
+
+        return size if dim is None else size[dim]
+
+    def __getitem__(self, index) -> "Batch":
+        return Batch(self.ids[index],
+                     self.times[index],
+                     self.missing[index] if self.missing is not None else None)
+
+    def clone(self) -> "Batch":
+        return Batch(self.ids.clone(),
+                     self.times.clone(),
+                     self.missing.clone() if self.missing is not None else None)
+
+    def to(self, device, non_blocking: bool = False) -> "Batch":
+        return Batch(self.ids.to(device, non_blocking=non_blocking),
+                     self.times.to(device, non_blocking=non_blocking),
+                     self.missing.to(device, non_blocking=non_blocking) if self.missing is not None else None)
+
+    def pin_memory(self) -> "Batch":
+        return Batch(self.ids.pin_memory(),
+                     self.times.pin_memory(),
+                     self.missing.pin_memory() if self.missing is not None else None)
+
+    def repeat_interleave(self, repeats: int) -> "Batch":
+        """Repeats every fact `repeats` times in place, i.e. [a, b] becomes [a, a, b, b] for repeats=2."""
+        return Batch(self.ids.repeat_interleave(repeats, dim=0),
+                     self.times.repeat_interleave(repeats, dim=0),
+                     self.missing.repeat_interleave(repeats, dim=0) if self.missing is not None else None)
+
+    def as_matrix(self, num_columns: int) -> "Batch":
+        """Views a flat batch as [-1, num_columns, ...], e.g. positives and their negatives per row."""
+        # explicit sizes, -1 is ambiguous for an empty time block
+        shape = (self.ids.size(0) // num_columns, num_columns)
+
+        return Batch(self.ids.view(shape + (self.ids.size(-1),)),
+                     self.times.view(shape + (self.times.size(-1),)),
+                     self.missing.view(shape + (self.missing.size(-1),)) if self.missing is not None else None)
+
+    def flatten(self) -> "Batch":
+        """Inverse of `as_matrix`."""
+        size = self.size().numel()
+
+        return Batch(self.ids.reshape(size, self.ids.size(-1)),
+                     self.times.reshape(size, self.times.size(-1)),
+                     self.missing.reshape(size, self.missing.size(-1)) if self.missing is not None else None)
+
+    def with_missing(self, slot: int) -> "Batch":
+        """Turns the facts into prediction queries lacking `slot` (0 for head, 2 for tail). The ids are shared."""
+        missing = torch.zeros_like(self.ids, dtype=torch.bool)
+        missing[..., slot] = True
+
+        return Batch(self.ids, self.times, missing)
+
+    def head_and_tail_queries(self, reciprocal: bool = False) -> "Batch":
+        """
+        The head queries followed by the tail queries of a flat batch of facts, to be scored by a single predict
+        call. With `reciprocal`, the head queries are posed as tail queries, see `as_tail_queries`.
+        """
+        bs = self.size(0)
+
+        ids = self.ids.repeat(2, 1)
+        missing = torch.zeros_like(ids, dtype=torch.bool)
+        missing[:bs, 0] = True
+        missing[bs:, 2] = True
+
+        queries = Batch(ids, self.times.repeat(2, 1), missing)
+
+        return queries.as_tail_queries() if reciprocal else queries
+
+    def as_tail_queries(self) -> "Batch":
+        """
+        The queries of a flat batch with every head query (?, p, o, t) posed as the tail query (o, p ^ 1, ?, t) of the
+        reciprocal relation: with task.reciprocal_relation, every relation has an even id and its reciprocal the
+        next, odd one.
+        """
+        head = self.missing[:, 0]
+
+        ids = self.ids.clone()
+        ids[head, 0] = self.ids[head, 2]
+        ids[head, 1] ^= 1
+        ids[head, 2] = self.ids[head, 0]
+
+        missing = self.missing.clone()
+        missing[head, 0] = False
+        missing[head, 2] = True
+
+        return Batch(ids, self.times, missing)
@@ -0,0 +1,65 @@
+import torch
+import numpy as np
+
+import random
+from typing import List, Tuple
+
+from tkge.data.batch import Batch
+from tkge.train.sampling import NegativeSampler
+from tkge.train.instrumentation import Instrumentation
+from tkge.common.misc import seed_numba
+
+
+class NegativeSamplingCollator:
+    """
+    Collate function applying a negative sampler to every batch of positives.
+
+    Used as `collate_fn` of the training DataLoader, negative sampling runs inside the loader's worker processes and
+    overlaps with the model computation on the main process, which receives ready (samples, labels) pairs.
+
+    Sampling on the main process (num_workers=0) is measured as stage `sample` of `instrumentation`, if given.
+
+    For samplers using numba (see NegativeSampler.uses_numba), the numba PRNG of a worker is seeded like the others
+    in `worker_init_fn` on the worker's first batch, such that numba is only imported by workers which need it.
+    """
+
+    def __init__(self, sampler: NegativeSampler, sample_target: str, instrumentation: Instrumentation = None):
+        self.sampler = sampler
+        self.sample_target = sample_target
+        self.instrumentation = instrumentation
+
+        self.numba_seeded = False
+
+    def __call__(self, batch: List[Batch]) -> Tuple[Batch, torch.Tensor]:
+        if self.sampler.uses_numba and not self.numba_seeded:
+            # the main process is seeded by seed_from_config
+            if torch.utils.data.get_worker_info() is not None:
+                seed_numba(_worker_seed())
+            self.numba_seeded = True
+
+        pos_batch = Batch.collate(batch)
+
+        if self.instrumentation is None:
+            return self.sampler.sample(pos_batch, self.sample_target)
+
+        with self.instrumentation.stage("sample", pos_batch.size(0)):
+            return self.sampler.sample(pos_batch, self.sample_target)
+
+
+def worker_init_fn(worker_id: int):
+    """
+    Seeds the python and numpy PRNGs of a loader worker.
+
+    PyTorch seeds the torch PRNG of each worker with base_seed + worker_id, where base_seed is drawn from the PRNG of
+    the main process. Deriving the remaining seeds from it makes the sampling of every worker deterministic as soon as
+    `random_seed.torch` (or `random_seed.default`) is set.
+    """
+    seed = _worker_seed()
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def _worker_seed() -> int:
+    """The seed of the python, numpy and numba PRNGs of a loader worker, derived from the one of its torch PRNG."""
+    return torch.initial_seed() % 2 ** 32
@@ -9,9 +9,10 @@ from tkge.common.registry import Registrable
 from tkge.common.config import Config
 from tkge.common.error import ConfigurationError
 from tkge.data.utils import get_all_days_of_year
+from tkge.data.batch import Batch
+from tkge.indexing import KvsAllIndex
 
 import enum
-import arrow
 
 SPOT = enum.Enum('spot', ('s', 'p', 'o', 't'))
 
@@ -43,6 +44,9 @@ class DatasetProcessor(Registrable):
         self.all_triples = []
         self.all_quadruples = []
 
+        # derived data structures (see tkge.indexing), computed on first use
+        self._indexes = dict()
+
         self.load()
         self.process()
         self.filter()
@@ -235,6 +239,8 @@ class GDELTDatasetProcessor(DatasetProcessor):
 @DatasetProcessor.register(name="icews14")
 class ICEWS14DatasetProcessor(DatasetProcessor):
     def process(self):
+        import arrow
+
         all_timestamp = get_all_days_of_year(2014)
         self.ts2id = {ts: (arrow.get(ts) - arrow.get('2014-01-01')).days for ts in all_timestamp}
 
@@ -363,23 +369,101 @@ class SplitDataset(torch.utils.data.Dataset):
         # TODO(gengyuan) assert the lengths of all lists in self.dataset
         # assert all( for i in dataset.items())
 
+        for type in self.datatype:
+            if type not in ['timestamp_id', 'timestamp_float']:
+                raise NotImplementedError
+
+        # ids are kept as int64, float ids lose precision above 2^24
+        ids = torch.tensor(self.dataset['triple'], dtype=torch.long).view(-1, 3)
+        if 'timestamp_id' in self.datatype:
+            ids = torch.cat([ids, torch.tensor(self.dataset['timestamp_id'], dtype=torch.long).view(-1, 1)], dim=1)
+
+        if 'timestamp_float' in self.datatype:
+            times = torch.tensor(self.dataset['timestamp_float'], dtype=torch.float).view(ids.size(0), -1)
+        else:
+            times = torch.zeros((ids.size(0), 0))
+
+        self.ids = ids
+        self.times = times
+
     def __len__(self):
         # TODO(gengyuan) calculate the length
         return len(self.dataset['triple'])
 
     def __getitem__(self, index, train=True):
-        sample = torch.Tensor(self.dataset['triple'][index])
+        return Batch(self.ids[index], self.times[index])
 
-        for type in self.datatype:
-            if type == 'timestamp_id':
-                timestamp_id = torch.Tensor(self.dataset['timestamp_id'][index])
-                sample = torch.cat([sample, timestamp_id], dim=0)
+    def __getitems__(self, indices: List[int]):
+        # fetches a whole batch at once, see Batch.collate
+        indices = torch.tensor(indices, dtype=torch.long)
 
-            elif type == 'timestamp_float':
-                timestamp_float = torch.Tensor(self.dataset['timestamp_float'][index])
-                sample = torch.cat([sample, timestamp_float], dim=0)
-            else:
-                raise NotImplementedError
+        return Batch(self.ids[indices], self.times[indices])
+
+
+class KvsAllDataset(torch.utils.data.Dataset):
+    """
+    Distinct KvsAll training queries of a split with all entities completing them.
+
+    A query is a fact with its head or tail left out, i.e. (s, p, ?, t) for query type 'sp_' and (?, p, o, t) for
+    '_po'. The completing entities are kept in CSR form: the ones of query i are values[offsets[i]:offsets[i+1]]. The
+    labels of a batch are only materialized in `collate`, as a sparse num_queries x num_entities matrix.
+    """
+
+    def __init__(self, dataset: Dict[str, List], datatype: List[str], query_types: List[str], num_entities: int):
+        super().__init__()
+
+        self.num_entities = num_entities
+
+        # queries are keyed by the timestamp id, also for models only using the float time features
+        split = SplitDataset(dataset, datatype + ['timestamp_id'])
+        _, first = np.unique(split.ids.numpy(), axis=0, return_index=True)
+        first = torch.from_numpy(first)
+        ids, times = split.ids[first], split.times[first]
+
+        queries, missing, values, counts = [], [], [], []
+        for query_type in query_types:
+            slot = {'sp_': 2, '_po': 0}[query_type]
+            key_cols = [c for c in range(ids.size(1)) if c != slot]
+
+            sorted_facts = KvsAllIndex.sort_triples_by_keys(torch.cat([ids, torch.arange(len(ids)).view(-1, 1)], 1),
+                                                            key_cols, slot)
+            order = sorted_facts[:, -1]
+
+            _, count = torch.unique_consecutive(ids[order][:, key_cols], dim=0, return_counts=True)
+            query_rows = order[torch.cumsum(count, 0) - count]
+
+            query_missing = torch.zeros((len(query_rows), ids.size(1)), dtype=torch.bool)
+            query_missing[:, slot] = True
+
+            queries.append(query_rows)
+            missing.append(query_missing)
+            values.append(ids[order, slot])
+            counts.append(count)
+
+        query_rows = torch.cat(queries)
+        self.queries = Batch(ids[query_rows], times[query_rows], torch.cat(missing))
+
+        self.values = torch.cat(values)
+        self.offsets = torch.cat([torch.zeros(1, dtype=torch.long), torch.cumsum(torch.cat(counts), 0)])
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __getitem__(self, index):
+        return index
+
+    def collate(self, indices: List[int]):
+        """Collate function returning a batch of queries and their sparse multi-hot labels."""
+        indices = torch.tensor(indices, dtype=torch.long)
+
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+
+        rows = torch.arange(len(indices)).repeat_interleave(lengths)
+        positions = torch.arange(int(lengths.sum())) - (torch.cumsum(lengths, 0) - lengths).repeat_interleave(lengths)
+        cols = self.values[starts.repeat_interleave(lengths) + positions]
 
-        return sample
+        labels = torch.sparse_coo_tensor(torch.stack([rows, cols]), torch.ones(len(rows)),
+                                         (len(indices), self.num_entities))
 
+        return self.queries[indices], labels
@@ -1,5 +1,4 @@
 import datetime
-import arrow
 
 from typing import List
 
@@ -24,6 +23,8 @@ def get_all_days_of_year(years: int, format: str = "YYYY-MM-DD") -> List[str]:
     get all days of the year in string format
     """
 
+    import arrow
+
     start_date = '%s-1-1' % years
     a = 0
     all_date_list = []
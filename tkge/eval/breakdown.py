@@ -0,0 +1,82 @@
+import torch
+import numpy as np
+
+import os
+from typing import Dict, List, Optional
+
+
+class Ranks:
+    """
+    Filtered ranks of the head and the tail of every fact of an evaluation run, in a tensor preallocated for all
+    facts, with the ids of the facts (s, p, o, ..., timestamp id). The metrics and their breakdowns are computed from
+    the complete ranks at the end, see `group_metrics`.
+    """
+
+    def __init__(self, num_facts: int):
+        # allocated for the number of id columns of the first batch
+        self.ids: torch.Tensor = torch.empty(num_facts, 0, dtype=torch.long)
+        # columns: head, tail
+        self.ranks = torch.empty(num_facts, 2)
+        self.size = 0
+
+    def add(self, ids: torch.Tensor, ranks_head: torch.Tensor, ranks_tail: torch.Tensor):
+        """Appends the ranks of a batch of facts."""
+        if self.ids.size(1) != ids.size(1):
+            self.ids = torch.empty(self.ranks.size(0), ids.size(1), dtype=torch.long)
+
+        stop = self.size + ids.size(0)
+
+        self.ids[self.size:stop] = ids
+        self.ranks[self.size:stop, 0] = ranks_head
+        self.ranks[self.size:stop, 1] = ranks_tail
+        self.size = stop
+
+    @property
+    def head(self) -> torch.Tensor:
+        return self.ranks[:self.size, 0]
+
+    @property
+    def tail(self) -> torch.Tensor:
+        return self.ranks[:self.size, 1]
+
+    def save(self, path: str):
+        """Writes the ids and ranks as int32 arrays `ids`, `head` and `tail` of a numpy .npz file."""
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        np.savez(path, ids=self.ids[:self.size].int().numpy(), head=self.head.int().numpy(),
+                 tail=self.tail.int().numpy())
+
+
+def group_metrics(ranks: torch.Tensor, groups: torch.Tensor, num_groups: int, k: List[int]) -> Dict[str, torch.Tensor]:
+    """
+    Number of queries, mean rank, mean reciprocal rank and hits at `k` of the queries of each of `num_groups` groups,
+    from their `ranks` and group ids, as tensors of size num_groups (nan for empty groups). The per-query values of
+    all metrics are summed per group in a single scatter.
+    """
+    ranks = ranks.double()
+    values = torch.stack([torch.ones_like(ranks), ranks, 1. / ranks] + [(ranks <= hits_k).double() for hits_k in k], 1)
+
+    sums = torch.zeros(num_groups, values.size(1), dtype=torch.double).index_add_(0, groups, values)
+    count = sums[:, 0]
+    means = sums[:, 1:] / count.unsqueeze(1)
+
+    metrics = {'count': count,
+               'mean_ranking': means[:, 0],
+               'mean_reciprocal_ranking': means[:, 1]}
+    for column, hits_k in enumerate(k):
+        metrics[f"hits_at_{hits_k}"] = means[:, 2 + column]
+
+    return metrics
+
+
+def metrics_by_group(metrics: Dict[str, torch.Tensor], names: Optional[List[str]] = None) \
+        -> Dict[str, Dict[str, float]]:
+    """The `group_metrics` of every non-empty group by group name (default: its id)."""
+    count = metrics['count']
+
+    return {(names[group] if names is not None else str(group)):
+                {name: int(values[group]) if name == 'count' else values[group].item()
+                 for name, values in metrics.items()}
+            for group in torch.nonzero(count).flatten().tolist()}
@@ -1,12 +1,18 @@
 import torch
 
-from typing import List, Tuple, Dict
+import os
+from typing import List, Tuple, Dict, Optional
 from collections import defaultdict
 
 from tkge.common.config import Config
 from tkge.common.configurable import Configurable
 from tkge.common.error import ConfigurationError
 from tkge.data.dataset import DatasetProcessor
+from tkge.data.batch import Batch
+from tkge.eval.breakdown import Ranks, group_metrics, metrics_by_group
+from tkge.train.instrumentation import Instrumentation
+from tkge.indexing import index_relation_types, index_frequency_percentiles, index_time_windows, \
+    FREQUENCY_PERCENTILES, TIME_WINDOWS
 
 import enum
 
@@ -26,19 +32,176 @@ class Evaluation(Configurable):
         self.ordering = self.config.get("eval.ordering")
         self.k = self.config.get("eval.k")
 
+        # head queries are posed as tail queries of the reciprocal relation, see head_and_tail_queries
+        self.reciprocal_relation = self.config.get("task.reciprocal_relation")
+
+        self.time_windows = self.config.get("entity_ranking.metrics_per.time_windows")
+        for window in self.time_windows:
+            if window not in TIME_WINDOWS:
+                raise ConfigurationError(f"entity_ranking.metrics_per.time_windows: {window} should be one of "
+                                         f"{TIME_WINDOWS}")
+
         self.filtered_data = defaultdict(None)
         self.filtered_data['sp_'] = self.dataset.filter(type=self.filter, target='o')
         self.filtered_data['_po'] = self.dataset.filter(type=self.filter, target='s')
 
-    def eval(self, queries: torch.Tensor, scores: torch.Tensor, miss='o'):
-        metrics = {}
-
+    def rank_facts(self, model: torch.nn.Module, loader: torch.utils.data.DataLoader,
+                   instrumentation: Optional[Instrumentation] = None) -> Ranks:
+        """Filtered ranks of the heads and tails of all facts of `loader` as predicted by `model`."""
+        instrumentation = instrumentation or Instrumentation(self.config)
+        ranks = Ranks(len(loader.dataset))
+
+        with torch.no_grad():
+            model.eval()
+
+            for batch in instrumentation.iterate("eval_load", loader):
+                bs = batch.size(0)
+
+                batch = batch.to(self.device, non_blocking=True)
+
+                # head and tail queries are scored at once
+                queries = self.head_and_tail_queries(batch)
+
+                with instrumentation.stage("eval_predict", bs):
+                    scores = model.predict(queries)
+                    assert list(scores.shape) == [2 * bs, self.vocab_size], \
+                        f"Scores {scores.shape} should be in shape [{2 * bs}, {self.vocab_size}]"
+
+                with instrumentation.stage("eval_metrics", bs):
+                    ranks_head, ranks_tail = self.head_and_tail_ranks(batch, scores)
+                    ranks.add(batch.ids.cpu(), ranks_head.cpu(), ranks_tail.cpu())
+
+        return ranks
+
+    def summary(self, ranks: Ranks) -> Dict[str, Dict[str, float]]:
+        """The metrics of head and tail prediction."""
+        # averaged in double precision over all queries
+        return {'head': self.metrics(ranks.head.double()), 'tail': self.metrics(ranks.tail.double())}
+
+    def breakdowns(self, ranks: Ranks) -> Dict[str, Dict[str, Dict[str, Dict[str, float]]]]:
+        """
+        Metrics of groups of the queries, by breakdown, side and group, for the breakdowns enabled in
+        entity_ranking.metrics_per:
+
+        - relation_type: the type (1-1, 1-N, M-1, M-N) of the relation, see index_relation_types
+        - argument_frequency: the frequency quartile in training of the subject, relation and object, as breakdowns
+          subject_frequency, relation_frequency and object_frequency
+        - relation: the relation
+        - timestamp: the timestamp id
+        - time_<window>: the time window of the timestamp for every window of time_windows, see index_time_windows
+
+        Every breakdown covers head and tail queries together (side "both") and, with head_and_tail, each side.
+        Groups are computed from the ranks with one scatter, see group_metrics.
+        """
+        ids = ranks.ids[:ranks.size]
+
+        sides = {"both": (torch.cat([ranks.head, ranks.tail]), 2)}
+        if self.config.get("entity_ranking.metrics_per.head_and_tail"):
+            sides.update({"head": (ranks.head, 1), "tail": (ranks.tail, 1)})
+
+        # name: group of every fact, number of groups, names of the groups
+        groupings = dict()
+        if self.config.get("entity_ranking.metrics_per.relation_type"):
+            relation_types = index_relation_types(self.dataset)
+            names = sorted(set(relation_types))
+            types = torch.tensor([names.index(t) for t in relation_types], dtype=torch.long)
+            groupings["relation_type"] = (types[ids[:, 1]], len(names), names)
+
+        if self.config.get("entity_ranking.metrics_per.argument_frequency"):
+            percentiles = index_frequency_percentiles(self.dataset)
+            for column, argument in enumerate(["subject", "relation", "object"]):
+                groupings[f"{argument}_frequency"] = (percentiles[argument][ids[:, column]],
+                                                      len(FREQUENCY_PERCENTILES), FREQUENCY_PERCENTILES)
+
+        if self.config.get("entity_ranking.metrics_per.relation"):
+            names = [None] * self.dataset.num_relations()
+            for name, relation in self.dataset.rel2id.items():
+                names[relation] = name
+            groupings["relation"] = (ids[:, 1], len(names), names)
+
+        if self.config.get("entity_ranking.metrics_per.timestamp"):
+            # queries carry the timestamp id in their last id column
+            groupings["timestamp"] = (ids[:, -1], self.dataset.num_timestamps(), None)
+
+        for window in self.time_windows:
+            windows, names = index_time_windows(self.dataset, window)
+            groupings[f"time_{window}"] = (windows[ids[:, -1]], len(names), names)
+
+        return {name: {side: metrics_by_group(group_metrics(side_ranks, groups.repeat(repeats), num_groups, self.k),
+                                              names)
+                       for side, (side_ranks, repeats) in sides.items()}
+                for name, (groups, num_groups, names) in groupings.items()}
+
+    def report(self, ranks: Ranks, name: str, **trace):
+        """
+        Logs and traces the `breakdowns` of the ranks of an evaluation run called `name` (with the keys of `trace`
+        added to the trace entries), and writes the ranks to entity_ranking.ranks_folder if set, see Ranks.save.
+        The breakdowns per relation, timestamp and time window are only traced.
+        """
+        for breakdown, sides in self.breakdowns(ranks).items():
+            for side, groups in sides.items():
+                self.config.trace(type="breakdown", breakdown=breakdown, side=side, groups=groups, **trace)
+
+                if breakdown in ["relation", "timestamp"] or breakdown.startswith("time_"):
+                    continue
+
+                for group, metrics in groups.items():
+                    self.config.log(f"Metrics({breakdown} {group}, {side}) : {metrics.items()}")
+
+        folder = self.config.get("entity_ranking.ranks_folder")
+        if folder:
+            path = os.path.join(folder, f"ranks_{name}.npz")
+            ranks.save(path)
+            self.config.log(f"Saved the ranks of {name} to {path}")
+
+    def eval(self, queries: Batch, scores: torch.Tensor, miss='o'):
+        return self.metrics(self.ranks(queries, scores, miss))
+
+    def ranks(self, queries: Batch, scores: torch.Tensor, miss='o') -> torch.Tensor:
+        """Filtered rank of the missing entity of every query, as a float tensor."""
         filtered_list = self.filtered_data['sp_'] if miss == 'o' else self.filtered_data['_po']
 
         filtered_index = self.filter_query(queries, filtered_list, miss=miss)
-        targets = queries[:, 2].long() if miss == 'o' else queries[:, 0].long()
+        targets = queries.ids[:, 2] if miss == 'o' else queries.ids[:, 0]
+
+        return self.ranking(scores, targets, filtered_index)
+
+    def head_and_tail_queries(self, facts: Batch) -> Batch:
+        """The head and tail queries of a flat batch of facts as one batch, see Batch.head_and_tail_queries."""
+        return facts.head_and_tail_queries(self.reciprocal_relation)
+
+    def head_and_tail_ranks(self, facts: Batch, scores: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Filtered ranks of the heads and of the tails of a flat batch of `facts`, from the `scores` of their
+        `head_and_tail_queries`. The filter mask of all queries is built at once and ranked in one pass.
+        """
+        bs = facts.size(0)
+
+        filtered_index = [[], []]
+        self._filtered_index(facts, self.filtered_data['_po'], "s", filtered_index)
+        self._filtered_index(facts, self.filtered_data['sp_'], "o", filtered_index, offset=bs)
+
+        filtered_mask = torch.zeros(scores.shape, dtype=torch.bool, device=scores.device)
+        filtered_mask[torch.tensor(filtered_index[0], dtype=torch.long),
+                      torch.tensor(filtered_index[1], dtype=torch.long)] = True
+
+        ranks = self.ranking(scores, torch.cat([facts.ids[:, 0], facts.ids[:, 2]]), filtered_mask)
+
+        return ranks[:bs], ranks[bs:]
+
+    def query_metric(self, ranks: torch.Tensor, metric: str) -> torch.Tensor:
+        """The value of `metric` (a key of `metrics`) for every query, whose mean is the metric."""
+        if metric == 'mean_ranking':
+            return ranks
+        if metric == 'mean_reciprocal_ranking':
+            return 1. / ranks
+        if metric.startswith('hits_at_') and float(metric[len('hits_at_'):]) in self.k:
+            return (ranks <= float(metric[len('hits_at_'):])).float()
 
-        ranks = self.ranking(scores, targets, filtered_index)
+        raise ValueError(f"Unknown metric {metric}")
+
+    def metrics(self, ranks: torch.Tensor) -> Dict[str, float]:
+        metrics = {}
 
         metrics['mean_ranking'] = self.mean_ranking(ranks)
         metrics['mean_reciprocal_ranking'] = self.mean_reciprocal_ranking(ranks)
@@ -53,7 +216,8 @@ class Evaluation(Configurable):
         query_size = scores.size(0)
         vocabulary_size = scores.size(1)
 
-        target_scores = scores[range(query_size), targets].unsqueeze(1).repeat((1, vocabulary_size))
+        # compared by broadcasting
+        target_scores = scores[torch.arange(query_size, device=scores.device), targets].unsqueeze(1)
 
         # TODO(gengyuan)
 
@@ -79,16 +243,23 @@ class Evaluation(Configurable):
 
         return ranks.float()
 
-    def filter_query(self, queries: torch.Tensor, filtered_list: Dict[str, List], miss: str = "o") -> torch.Tensor:
+    def filter_query(self, queries: Batch, filtered_list: Dict[str, List], miss: str = "o") -> torch.Tensor:
         filtered_index = [[], []]
         query_size = queries.size(0)
 
-        for i, q in enumerate(queries):
+        self._filtered_index(queries, filtered_list, miss, filtered_index)
+
+        filtered_mask = torch.zeros((query_size, self.vocab_size)).to(self.device)
+        filtered_mask[filtered_index] = 1
+
+        return filtered_mask.long()
+
+    def _filtered_index(self, queries: Batch, filtered_list: Dict[str, List], miss: str,
+                        filtered_index: List[List[int]], offset: int = 0):
+        """Appends the (row + `offset`, entity) pairs to filter for the queries to `filtered_index`."""
+        # queries carry the timestamp id in their last id column
+        for i, (sid, rid, oid, *_, tid) in enumerate(queries.ids.tolist(), start=offset):
             # TODO(gengyuan) formatting
-            sid = int(q[0])
-            rid = int(q[1])
-            oid = int(q[2])
-            tid = int(q[-1])
 
             if miss == "o":
                 query = f"{sid}-{rid}-None"
@@ -102,11 +273,6 @@ class Evaluation(Configurable):
                 filtered_index[0].append(i)
                 filtered_index[1].append(j)
 
-        filtered_mask = torch.zeros((query_size, self.vocab_size)).to(self.device)
-        filtered_mask[filtered_index] = 1
-
-        return filtered_mask.long()
-
     def mean_ranking(self, ranks):
         mr = torch.mean(ranks).item()
 
@@ -118,6 +284,6 @@ class Evaluation(Configurable):
         return mrr
 
     def hits(self, ranks):
-        hits_at = list(map(lambda x: torch.mean((ranks <= x).float()).item(), self.k))
+        hits_at = list(map(lambda x: torch.mean((ranks <= x).to(ranks.dtype)).item(), self.k))
 
         return hits_at
@@ -0,0 +1,61 @@
+import torch
+
+import math
+from typing import Tuple
+
+
+def query_strata(ids: torch.Tensor, num_timestamps: int, num_buckets: int) -> torch.Tensor:
+    """
+    Stratum of every fact of `ids` (columns s, p, o, ..., timestamp id): its relation combined with the one of
+    `num_buckets` equally wide ranges of timestamps it falls into.
+    """
+    num_buckets = max(1, min(num_buckets, num_timestamps))
+    buckets = ids[:, -1] * num_buckets // max(num_timestamps, 1)
+
+    return ids[:, 1] * num_buckets + buckets
+
+
+def stratified_subsample(strata: torch.Tensor, size: int, seed: int = 0) -> torch.Tensor:
+    """
+    Indices of a systematic sample of `size` elements from the elements sorted by stratum, in random order within
+    each stratum.
+
+    Every stratum gets its proportional share of the sample up to one element, so the sample mean estimates the
+    population mean without weighting (see `estimate_mean`), while strata of large relations do not crowd out the
+    others by chance. The indices are sorted by stratum, the order `estimate_mean` expects the values in.
+    """
+    population = strata.size(0)
+    if size >= population:
+        return torch.arange(population)
+
+    generator = torch.Generator().manual_seed(seed)
+
+    # stable sort by stratum of a random permutation
+    permutation = torch.randperm(population, generator=generator)
+    order = permutation[torch.sort(strata[permutation], stable=True)[1]]
+
+    step = population / size
+    start = torch.rand(1, generator=generator).item() * step
+    positions = (start + step * torch.arange(size, dtype=torch.float64)).long().clamp_(max=population - 1)
+
+    return order[positions]
+
+
+def estimate_mean(values: torch.Tensor, population: int, z: float = 1.96) -> Tuple[float, float]:
+    """
+    Mean of a metric over the population estimated from its `values` on a `stratified_subsample`, in sample order,
+    and the half width of its confidence interval (95% for the default `z`).
+
+    The variance is estimated from the differences of successive values, which accounts for the stratification of
+    a systematic sample (neighbours mostly share their stratum), with the finite population correction.
+    """
+    n = values.numel()
+    mean = values.double().mean().item()
+
+    if n < 2:
+        return mean, float("nan")
+
+    differences = values.double().diff()
+    variance = (1 - n / population) * differences.pow(2).sum().item() / (2 * n * (n - 1))
+
+    return mean, z * math.sqrt(max(variance, 0.))
@@ -1,8 +1,9 @@
 import torch
-import numba
 import numpy as np
 from typing import Iterator, List, Tuple
 
+from tkge.common.jit import lazy_njit
+
 
 class KvsAllIndex:
     """Construct an index from keys (e.g., sp) to all its values (o).
@@ -138,6 +139,64 @@ def index_KvsAll(dataset: "Dataset", split: str, key: str):
     return dataset._indexes.get(name)
 
 
+def index_relation_statistics(dataset):
+    """Count, per relation, the distinct training triples, distinct heads (sp pairs) and distinct tails (po pairs).
+
+    Adds index `relation_statistics` with a num_relations x 5 float tensor holding, per
+    relation, (num_triples, num_distinct_sp, num_distinct_po, tails_per_head,
+    heads_per_tail). All counts are computed at once with `unique`/`bincount` over the
+    encoded train triples.
+
+    """
+    if "relation_statistics" not in dataset._indexes:
+        num_relations = dataset.num_relations()
+
+        # facts recurring at several timestamps count once
+        triples = torch.tensor(dataset.get("train")["triple"], dtype=torch.long)
+        triples = torch.unique(triples, dim=0)
+        s, p, o = triples[:, 0], triples[:, 1], triples[:, 2]
+
+        num_triples = torch.bincount(p, minlength=num_relations)
+        num_sp = torch.bincount(torch.unique(p * dataset.num_entities() + s) // dataset.num_entities(),
+                                minlength=num_relations)
+        num_po = torch.bincount(torch.unique(p * dataset.num_entities() + o) // dataset.num_entities(),
+                                minlength=num_relations)
+
+        relation_stats = torch.stack((num_triples, num_sp, num_po), dim=1).float()
+        tails_per_head = relation_stats[:, 0] / relation_stats[:, 1].clamp(min=1)
+        heads_per_tail = relation_stats[:, 0] / relation_stats[:, 2].clamp(min=1)
+
+        dataset._indexes["relation_statistics"] = torch.cat(
+            (relation_stats, tails_per_head[:, None], heads_per_tail[:, None]), dim=1
+        )
+
+    return dataset._indexes["relation_statistics"]
+
+
+def index_bernoulli_probabilities(dataset):
+    """Probability of corrupting the head of a positive, per relation.
+
+    According to Wang et al. "Knowledge Graph Embedding by Translating on Hyperplanes.",
+    AAAI14: heads are replaced with probability tph / (tph + hpt), so that the entity on
+    the "many" side of a 1-N or M-1 relation is kept and false negatives become less
+    likely. Relations without training triples fall back to 0.5.
+
+    Adds index `bernoulli_probabilities` with a float tensor of size num_relations.
+
+    """
+    if "bernoulli_probabilities" not in dataset._indexes:
+        relation_stats = index_relation_statistics(dataset)
+        tph, hpt = relation_stats[:, 3], relation_stats[:, 4]
+
+        probabilities = torch.full_like(tph, 0.5)
+        seen = relation_stats[:, 0] > 0
+        probabilities[seen] = tph[seen] / (tph[seen] + hpt[seen])
+
+        dataset._indexes["bernoulli_probabilities"] = probabilities
+
+    return dataset._indexes["bernoulli_probabilities"]
+
+
 def index_relation_types(dataset):
     """Classify relations into 1-N, M-1, 1-1, M-N.
 
@@ -149,29 +208,13 @@ def index_relation_types(dataset):
 
     """
     if "relation_types" not in dataset._indexes:
-        # 2nd dim: num_s, num_distinct_po, num_o, num_distinct_so, is_M, is_N
-        relation_stats = torch.zeros((dataset.num_relations(), 6))
-        for index, p in [
-            (dataset.index("train_sp_to_o"), 1),
-            (dataset.index("train_po_to_s"), 0),
-        ]:
-            for prefix, labels in index.items():
-                relation_stats[prefix[p], 0 + p * 2] = relation_stats[
-                    prefix[p], 0 + p * 2
-                ] + len(labels)
-                relation_stats[prefix[p], 1 + p * 2] = (
-                    relation_stats[prefix[p], 1 + p * 2] + 1.0
-                )
-        relation_stats[:, 4] = (relation_stats[:, 0] / relation_stats[:, 1]) > 1.5
-        relation_stats[:, 5] = (relation_stats[:, 2] / relation_stats[:, 3]) > 1.5
-        relation_types = []
-        for i in range(dataset.num_relations()):
-            relation_types.append(
-                "{}-{}".format(
-                    "1" if relation_stats[i, 4].item() == 0 else "M",
-                    "1" if relation_stats[i, 5].item() == 0 else "N",
-                )
-            )
+        relation_stats = index_relation_statistics(dataset)
+        is_m = (relation_stats[:, 4] > 1.5).tolist()
+        is_n = (relation_stats[:, 3] > 1.5).tolist()
+
+        relation_types = [
+            "{}-{}".format("M" if m else "1", "N" if n else "1") for m, n in zip(is_m, is_n)
+        ]
 
         dataset._indexes["relation_types"] = relation_types
 
@@ -196,70 +239,85 @@ def index_relations_per_type(dataset):
     return relations_per_type
 
 
+FREQUENCY_PERCENTILES = ["25%", "50%", "75%", "top"]
+
+
 def index_frequency_percentiles(dataset, recompute=False):
+    """Frequency quartile of every subject, relation and object in the training facts.
+
+    Adds index `frequency_percentiles` with a dictionary mapping each of 'subject',
+    'relation' and 'object' to a long tensor holding, per entity (or relation), the
+    index in FREQUENCY_PERCENTILES of its quartile: the least frequent 25% of the
+    entities, the next 25% (50%), the next (75%) and the most frequent ones (top).
+    Items of equal frequency are ordered by index.
+
     """
-    :return: dictionary mapping from
-    {
-        'subject':
-        {25%, 50%, 75%, top} -> set of entities
-        'relations':
-        {25%, 50%, 75%, top} -> set of relations
-        'object':
-        {25%, 50%, 75%, top} -> set of entities
-    }
+    if "frequency_percentiles" not in dataset._indexes or recompute:
+        triples = torch.tensor(dataset.get("train")["triple"], dtype=torch.long)
+
+        result = dict()
+        for column, (arg, num) in enumerate(
+            [("subject", dataset.num_entities()), ("relation", dataset.num_relations()),
+             ("object", dataset.num_entities())]
+        ):
+            frequency = torch.bincount(triples[:, column], minlength=num)
+            order = torch.sort(frequency, stable=True)[1]
+
+            percentiles = torch.empty(num, dtype=torch.long)
+            for percentile, (begin, end) in enumerate([(0.0, 0.25), (0.25, 0.5), (0.5, 0.75), (0.75, 1.0)]):
+                percentiles[order[int(begin * num):int(end * num)]] = percentile
+
+            result[arg] = percentiles
+
+        dataset._indexes["frequency_percentiles"] = result
+
+    return dataset._indexes["frequency_percentiles"]
+
+
+TIME_WINDOWS = ["day", "week", "month", "year"]
+
+
+def index_time_windows(dataset, window: str, recompute=False) -> Tuple[torch.Tensor, List[str]]:
+    """Time window of every timestamp.
+
+    Adds index `time_windows_<window>` with a pair of a long tensor mapping each
+    timestamp id to its window and the names of the windows in chronological order.
+    Windows (see TIME_WINDOWS) are days (2014-01-31), ISO weeks (2014-W05), months
+    (2014-01) or years (2014) of the timestamps as encoded by the dataset, i.e.,
+    "year-month-day-..." up to dataset.temporal.resolution (see
+    DatasetProcessor.process_time). Parts missing at a coarser resolution count as
+    the first.
+
     """
-    if "frequency_percentiles" in dataset._indexes and not recompute:
-        return
-    subject_stats = torch.zeros((dataset.num_entities(), 1))
-    relation_stats = torch.zeros((dataset.num_relations(), 1))
-    object_stats = torch.zeros((dataset.num_entities(), 1))
-    for (s, p, o) in dataset.split("train"):
-        subject_stats[s] += 1
-        relation_stats[p] += 1
-        object_stats[o] += 1
-    result = dict()
-    for arg, stats, num in [
-        (
-            "subject",
-            [
-                i
-                for i, j in list(
-                    sorted(enumerate(subject_stats.tolist()), key=lambda x: x[1])
-                )
-            ],
-            dataset.num_entities(),
-        ),
-        (
-            "relation",
-            [
-                i
-                for i, j in list(
-                    sorted(enumerate(relation_stats.tolist()), key=lambda x: x[1])
-                )
-            ],
-            dataset.num_relations(),
-        ),
-        (
-            "object",
-            [
-                i
-                for i, j in list(
-                    sorted(enumerate(object_stats.tolist()), key=lambda x: x[1])
-                )
-            ],
-            dataset.num_entities(),
-        ),
-    ]:
-        for percentile, (begin, end) in [
-            ("25%", (0.0, 0.25)),
-            ("50%", (0.25, 0.5)),
-            ("75%", (0.5, 0.75)),
-            ("top", (0.75, 1.0)),
-        ]:
-            if arg not in result:
-                result[arg] = dict()
-            result[arg][percentile] = set(stats[int(begin * num) : int(end * num)])
-    dataset._indexes["frequency_percentiles"] = result
+    assert window in TIME_WINDOWS, f"Time window should be one of {TIME_WINDOWS}"
+
+    if f"time_windows_{window}" not in dataset._indexes or recompute:
+        import datetime
+
+        def name(timestamp: str) -> str:
+            parts = [max(int(part), 1) for part in timestamp.split('-')] + [1, 1]
+            date = datetime.date(*parts[:3])
+
+            if window == "day":
+                return date.isoformat()
+            if window == "week":
+                year, week, _ = date.isocalendar()
+                return f"{year:04d}-W{week:02d}"
+            if window == "month":
+                return f"{date.year:04d}-{date.month:02d}"
+            return f"{date.year:04d}"
+
+        timestamp_names = {ts_id: name(ts) for ts, ts_id in dataset.ts2id.items()}
+        names = sorted(set(timestamp_names.values()))
+        ids = {window_name: index for index, window_name in enumerate(names)}
+
+        windows = torch.zeros(dataset.num_timestamps(), dtype=torch.long)
+        for ts_id, window_name in timestamp_names.items():
+            windows[ts_id] = ids[window_name]
+
+        dataset._indexes[f"time_windows_{window}"] = (windows, names)
+
+    return dataset._indexes[f"time_windows_{window}"]
 
 
 class IndexWrapper:
@@ -290,6 +348,8 @@ def create_default_index_functions(dataset: "Dataset"):
             dataset.index_functions[f"{split}_{key}_to_{value}"] = IndexWrapper(
                 index_KvsAll, split=split, key=key
             )
+    dataset.index_functions["relation_statistics"] = index_relation_statistics
+    dataset.index_functions["bernoulli_probabilities"] = index_bernoulli_probabilities
     dataset.index_functions["relation_types"] = index_relation_types
     dataset.index_functions["relations_per_type"] = index_relations_per_type
     dataset.index_functions["frequency_percentiles"] = index_frequency_percentiles
@@ -300,7 +360,7 @@ def create_default_index_functions(dataset: "Dataset"):
         )
 
 
-@numba.njit
+@lazy_njit
 def where_in(x, y, not_in=False):
     """Retrieve the indices of the elements in x which are also in y.
 
@@ -29,13 +29,8 @@ class BinaryCrossEntropyLoss(Loss):
             return self._loss(scores, labels)
 
         elif self._train_type == "KvsAll":
-            # TODO determine how to form pairs for margin ranking in KvsAll training
-            # scores and labels are tensors of size (batch_size, num_entities)
-            # Each row has 1s and 0s of a single sp or po tuple from training
-            # How to combine them for pairs?
-            # Each 1 with all 0s? Can memory handle this?
-            raise NotImplementedError(
-                "Margin ranking with KvsAll training not yet supported."
-            )
+            # scores and labels are tensors of size (batch_size, num_entities), each
+            # row holding the completions of a single sp_ or _po query
+            return self._loss(scores, self._labels_as_kvsall(labels))
         else:
             raise ValueError("train.type for margin ranking.")
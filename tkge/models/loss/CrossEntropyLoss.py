@@ -29,6 +29,15 @@ class CrossEntropyLoss(Loss):
 
         # TODO(gengyuan) make sure each row has one and only one label
 
+        if self._train_type == "KvsAll":
+            # scores and labels are tensors of size (batch_size, num_entities), each
+            # row holding the completions of a single sp_ or _po query. The cross
+            # entropy is taken w.r.t. the row-normalized label distribution.
+            labels = self._labels_as_kvsall(labels)
+            labels = labels / labels.sum(dim=1, keepdim=True)
+
+            return -(labels * torch.log_softmax(scores, dim=1)).sum(dim=1).mean()
+
         if labels.dim()!=1:
             labels = labels.nonzero()
             labels = labels[:, 1]
@@ -40,14 +49,5 @@ class CrossEntropyLoss(Loss):
 
             return self._loss(scores, labels)
 
-        elif self._train_type == "KvsAll":
-            # TODO determine how to form pairs for margin ranking in KvsAll training
-            # scores and labels are tensors of size (batch_size, num_entities)
-            # Each row has 1s and 0s of a single sp or po tuple from training
-            # How to combine them for pairs?
-            # Each 1 with all 0s? Can memory handle this?
-            raise NotImplementedError(
-                "Margin ranking with KvsAll training not yet supported."
-            )
         else:
             raise ValueError("train.type for margin ranking.")
@@ -11,6 +11,8 @@ class LogRankLoss(Loss):
 
         self._device = config.get("task.device")
 
+        # __call__ averages over the batch; `reduction` only applies to the unused SoftMarginLoss
+        self.reduction = "mean"
         self._loss = torch.nn.SoftMarginLoss(reduction=reduction, **kwargs)
 
         self.gamma = self.config.get("train.loss.gamma")
@@ -7,9 +7,17 @@ from tkge.common.error import ConfigurationError
 
 
 class Loss(Registrable):
+    # how the loss of a batch combines the losses of its samples: "mean" or "sum". Sub-batches of a "mean"
+    # loss are weighted by their share of the batch, the ones of a "sum" loss are added up.
+    reduction = "mean"
+
     def __init__(self, config: Config):
         self.config = config
         self._loss = None
+        self._device = self.config.get("task.device")
+
+        self._label_smoothing = self.config.get("KvsAll.label_smoothing") \
+            if self.config.get("train.type") == "KvsAll" else 0.
 
     @staticmethod
     def create(config: Config):
@@ -48,7 +56,7 @@ class Loss(Registrable):
             return labels
         else:
             x = torch.zeros(
-                scores.shape, device=self.config.get("job.device"), dtype=torch.float
+                scores.shape, device=self._device, dtype=torch.float
             )
             x[range(len(scores)), labels] = 1.0
             return x
@@ -65,7 +73,21 @@ class Loss(Registrable):
         else:
             x = labels.nonzero()
             if not x[:, 0].equal(
-                    torch.arange(len(labels), device=self.config.get("job.device"))
+                    torch.arange(len(labels), device=self._device)
             ):
                 raise ValueError("exactly one 1 per row required")
             return x[:, 1]
+
+    def _labels_as_kvsall(self, labels):
+        """Densifies the (sparse) multi-hot KvsAll labels on their device and applies label smoothing.
+
+        With label smoothing, 0s become 1.0/num_entities and 1s become
+        (1.0-label_smoothing)+1.0/num_entities.
+        """
+        if labels.is_sparse:
+            labels = labels.to_dense()
+
+        if self._label_smoothing > 0:
+            labels = (1.0 - self._label_smoothing) * labels + 1.0 / labels.size(1)
+
+        return labels
@@ -10,6 +10,7 @@ class SoftMarginLoss(Loss):
 
         self._device = config.get("task.device")
 
+        self.reduction = reduction
         self._loss = torch.nn.SoftMarginLoss(reduction=reduction, **kwargs)
 
     def __call__(self, scores, labels, **kwargs):
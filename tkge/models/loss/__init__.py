@@ -1,6 +1,8 @@
 from .Loss import Loss
-from .CrossEntropyLoss import CrossEntropyLoss
-from .BinaryCrossEntropyLoss import BinaryCrossEntropyLoss
-from .MarginRankingLoss import MarginRankingLoss
-from .SoftMarginLoss import SoftMarginLoss
-from .LogRankLoss import LogRankLoss
\ No newline at end of file
+
+# the losses are imported by Loss.create, see Registrable.register_lazy
+Loss.register_lazy("cross_entropy_loss", "tkge.models.loss.CrossEntropyLoss")
+Loss.register_lazy("binary_cross_entropy_loss", "tkge.models.loss.BinaryCrossEntropyLoss")
+Loss.register_lazy("margin_ranking_loss", "tkge.models.loss.MarginRankingLoss")
+Loss.register_lazy("soft_margin_loss", "tkge.models.loss.SoftMarginLoss")
+Loss.register_lazy("log_rank_loss", "tkge.models.loss.LogRankLoss")
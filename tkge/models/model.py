@@ -7,15 +7,18 @@ import numpy as np
 from enum import Enum
 import os
 from collections import defaultdict
-from typing import Mapping, Dict
+from dataclasses import dataclass
+from typing import Mapping, Dict, Optional
 import random
 
 from tkge.common.registry import Registrable
 from tkge.common.config import Config
 from tkge.common.error import ConfigurationError
 from tkge.data.dataset import DatasetProcessor
+from tkge.data.batch import Batch
 from tkge.models.layers import LSTMModel
 from tkge.models.utils import *
+from tkge.train.regularization import RowSubset
 
 
 class BaseModel(nn.Module, Registrable):
@@ -50,18 +53,38 @@ class BaseModel(nn.Module, Registrable):
     def get_embedding(self, **kwargs):
         raise NotImplementedError
 
-    def forward(self, samples, **kwargs):
+    def forward(self, samples: Batch, **kwargs):
+        """
+        Scores a flat batch of facts. Ids are read from `samples.ids` (int64) and float time features from
+        `samples.times`.
+        """
         raise NotImplementedError
 
-    def predict(self, queries: torch.Tensor):
+    def predict(self, queries: Batch):
         """
         Should be a wrapper of method forward or a computation flow same as that in forward.
-        Particularly for prediction task with incomplete queries as inputs.
+        Particularly for prediction task with incomplete queries as inputs, whose absent slot is marked in
+        `queries.missing`.
         New modules or learnable parameter constructed in this namespace should be avoided since it's not evolved in training procedure.
         """
         raise NotImplementedError
 
-    def fit(self, samples: torch.Tensor):
+    def score_queries(self, queries: Batch):
+        """
+        Scores prediction queries against all entities for KvsAll training, returning a num_queries x num_entities
+        score matrix and the regularization factors.
+        Computed by scoring all candidates with forward; models scoring all entities at once should override it.
+        """
+        bs = queries.size(0)
+
+        candidates = all_candidates_of_ent_queries(queries, self.dataset.num_entities())
+
+        scores, factors = self.forward(candidates)
+        scores = scores.view(bs, -1)
+
+        return scores, factors
+
+    def fit(self, samples: Batch):
         # TODO(gengyuan): wrapping all the models
         """
         Should be a wrapper of forward or a computation flow same as that in forward.
@@ -73,11 +96,28 @@ class BaseModel(nn.Module, Registrable):
         raise NotImplementedError
 
 
+@dataclass(frozen=True)
+class DeSimplEEmbeddingOptions:
+    emb_dim: int
+    se_prop: float
+
+
+@dataclass(frozen=True)
+class DeSimplEOptions:
+    name: str
+    embedding: DeSimplEEmbeddingOptions
+    dropout: float
+    args: Optional[Dict] = None
+
+
 @BaseModel.register(name='de_simple')
 class DeSimplEModel(BaseModel):
     def __init__(self, config: Config, dataset: DatasetProcessor):
         super().__init__(config, dataset)
 
+        # read once, forward runs on every batch
+        self.options = self.config.snapshot("model", DeSimplEOptions)
+
         self.prepare_embedding()
 
         self.time_nl = torch.sin  # TODO add to configuration file
@@ -86,8 +126,8 @@ class DeSimplEModel(BaseModel):
         num_ent = self.dataset.num_entities()
         num_rel = self.dataset.num_relations()
 
-        emb_dim = self.config.get("model.embedding.emb_dim")
-        se_prop = self.config.get("model.embedding.se_prop")
+        emb_dim = self.options.embedding.emb_dim
+        se_prop = self.options.embedding.se_prop
         s_emb_dim = int(se_prop * emb_dim)
         t_emb_dim = emb_dim - s_emb_dim
 
@@ -233,40 +273,34 @@ class DeSimplEModel(BaseModel):
 
         return h_emb1, r_emb1, t_emb1, h_emb2, r_emb2, t_emb2
 
-    def forward(self, samples, **kwargs):
-        head = samples[:, 0].long()
-        rel = samples[:, 1].long()
-        tail = samples[:, 2].long()
-        year = samples[:, 3]
-        month = samples[:, 4]
-        day = samples[:, 5]
+    def forward(self, samples: Batch, **kwargs):
+        head = samples.ids[:, 0]
+        rel = samples.ids[:, 1]
+        tail = samples.ids[:, 2]
+        year = samples.times[:, 0]
+        month = samples.times[:, 1]
+        day = samples.times[:, 2]
 
         h_emb1, r_emb1, t_emb1, h_emb2, r_emb2, t_emb2 = self.get_embedding(head, rel, tail, year, month, day)
 
-        p = self.config.get('model.dropout')
-
         scores = ((h_emb1 * r_emb1) * t_emb1 + (h_emb2 * r_emb2) * t_emb2) / 2.0
-        scores = F.dropout(scores, p=p, training=self.training)  # TODO training
+        scores = F.dropout(scores, p=self.options.dropout, training=self.training)  # TODO training
         scores = torch.sum(scores, dim=1)
 
         return scores, None
 
-    def fit(self, samples: torch.Tensor):
+    def fit(self, samples: Batch):
         bs = samples.size(0)
-        dim = samples.size(1) // (1 + self.config.get("negative_sampling.num_samples"))
 
-        samples = samples.view(-1, dim)
+        samples = samples.flatten()
 
         scores, factor = self.forward(samples)
         scores = scores.view(bs, -1)
 
         return scores, factor
 
-    def predict(self, queries: torch.Tensor):
-        assert torch.isnan(queries).sum(1).byte().all(), "Either head or tail should be absent."
-
+    def predict(self, queries: Batch):
         bs = queries.size(0)
-        dim = queries.size(0)
 
         candidates = all_candidates_of_ent_queries(queries, self.dataset.num_entities())
 
@@ -300,56 +334,83 @@ class TComplExModel(BaseModel):
         for emb in self.embeddings:
             emb.weight.data *= self.init_size
 
-    def forward(self, x):
+    def forward(self, x: Batch):
         """
         x is spot
         """
-        lhs = self.embeddings[0](x[:, 0].long())
-        rel = self.embeddings[1](x[:, 1].long())
-        rhs = self.embeddings[0](x[:, 2].long())
-        time = self.embeddings[2](x[:, 3].long())
-
-        lhs = lhs[:, :self.rank], lhs[:, self.rank:]
-        rel = rel[:, :self.rank], rel[:, self.rank:]
+        rhs = self.embeddings[0](x.ids[:, 2])
         rhs = rhs[:, :self.rank], rhs[:, self.rank:]
-        time = time[:, :self.rank], time[:, self.rank:]
 
-        right = self.embeddings[0].weight  # all ent tensor
-        right = right[:, :self.rank], right[:, self.rank:]
-
-        rt = rel[0] * time[0], rel[1] * time[0], rel[0] * time[1], rel[1] * time[1]
-        full_rel = rt[0] - rt[3], rt[1] + rt[2]
+        scores, lhs, full_rel = self._score_all_entities(x.ids[:, 0], x.ids[:, 1], x.ids[:, 3])
 
         # 1st item: scores
         # 2nd item: reg item factors
         # 3rd item: time
 
-        scores = (lhs[0] * full_rel[0] - lhs[1] * full_rel[1]) @ right[0].t() + \
-                 (lhs[1] * full_rel[0] + lhs[0] * full_rel[1]) @ right[1].t()
         factors = {
             "n3": (torch.sqrt(lhs[0] ** 2 + lhs[1] ** 2),
                    torch.sqrt(full_rel[0] ** 2 + full_rel[1] ** 2),
                    torch.sqrt(rhs[0] ** 2 + rhs[1] ** 2)),
-            "lambda3": (self.embeddings[2].weight[:-1] if self.no_time_emb else self.embeddings[2].weight)
+            "lambda3": (self._time_factor(x.ids[:, 3]),)
         }
 
         return scores, factors
 
-    def predict(self, x):
-        assert torch.isnan(x).sum(1).byte().all(), "Either head or tail should be absent."
+    def score_queries(self, queries: Batch):
+        """
+        Scores (s, p, ?, t) queries against all entities; (?, p, o, t) queries are answered as tail queries of the
+        reciprocal relation p ^ 1, which also maps the reciprocal relations of the training data back to their
+        forward relation. Without a single answer, the N3 factors only cover the query embeddings.
+        """
+        ids = queries.as_tail_queries().ids
+
+        scores, lhs, full_rel = self._score_all_entities(ids[:, 0], ids[:, 1], ids[:, 3])
+
+        factors = {
+            "n3": (torch.sqrt(lhs[0] ** 2 + lhs[1] ** 2),
+                   torch.sqrt(full_rel[0] ** 2 + full_rel[1] ** 2)),
+            "lambda3": (self._time_factor(ids[:, 3]),)
+        }
+
+        return scores, factors
+
+    def _time_factor(self, time: torch.Tensor) -> RowSubset:
+        """The timestamp embeddings smoothed by lambda3 and the timestamps of the batch."""
+        if self.no_time_emb:
+            # the last embedding stands for facts without timestamp
+            return RowSubset(self.embeddings[2].weight[:-1], time)
+
+        return RowSubset(self.embeddings[2].weight, time, sparse=self.embeddings[2].sparse)
+
+    def _score_all_entities(self, lhs: torch.Tensor, rel: torch.Tensor, time: torch.Tensor):
+        lhs = self.embeddings[0](lhs)
+        rel = self.embeddings[1](rel)
+        time = self.embeddings[2](time)
+
+        lhs = lhs[:, :self.rank], lhs[:, self.rank:]
+        rel = rel[:, :self.rank], rel[:, self.rank:]
+        time = time[:, :self.rank], time[:, self.rank:]
+
+        right = self.embeddings[0].weight  # all ent tensor
+        right = right[:, :self.rank], right[:, self.rank:]
+
+        rt = rel[0] * time[0], rel[1] * time[0], rel[0] * time[1], rel[1] * time[1]
+        full_rel = rt[0] - rt[3], rt[1] + rt[2]
+
+        scores = (lhs[0] * full_rel[0] - lhs[1] * full_rel[1]) @ right[0].t() + \
+                 (lhs[1] * full_rel[0] + lhs[0] * full_rel[1]) @ right[1].t()
 
-        missing_head_ind = torch.isnan(x)[:, 0].byte().unsqueeze(1)
-        reversed_x = x.clone()
-        reversed_x[:, 1] += 1
-        reversed_x[:, (0, 2)] = reversed_x[:, (2, 0)]
+        return scores, lhs, full_rel
 
-        x = torch.where(missing_head_ind,
-                        reversed_x,
-                        x)
+    def predict(self, x: Batch):
+        assert x.missing[:, [0, 2]].sum(1).eq(1).all(), "Either head or tail should be absent."
 
-        lhs = self.embeddings[0](x[:, 0].long())
-        rel = self.embeddings[1](x[:, 1].long())
-        time = self.embeddings[2](x[:, 3].long())
+        # head queries are answered as tail queries of the reciprocal relation
+        x = x.as_tail_queries().ids
+
+        lhs = self.embeddings[0](x[:, 0])
+        rel = self.embeddings[1](x[:, 1])
+        time = self.embeddings[2](x[:, 3])
 
         lhs = lhs[:, :self.rank], lhs[:, self.rank:]
         rel = rel[:, :self.rank], rel[:, self.rank:]
@@ -365,10 +426,10 @@ class TComplExModel(BaseModel):
 
         return scores
 
-    def forward_over_time(self, x):
-        lhs = self.embeddings[0](x[:, 0])
-        rel = self.embeddings[1](x[:, 1])
-        rhs = self.embeddings[0](x[:, 2])
+    def forward_over_time(self, x: Batch):
+        lhs = self.embeddings[0](x.ids[:, 0])
+        rel = self.embeddings[1](x.ids[:, 1])
+        rhs = self.embeddings[0](x.ids[:, 2])
         time = self.embeddings[2].weight
 
         lhs = lhs[:, :self.rank], lhs[:, self.rank:]
@@ -446,14 +507,8 @@ class ATiSEModel(BaseModel):
         self.embedding['emb_TE'].weight.data.renorm_(p=2, dim=0, maxnorm=1)
         self.embedding['emb_TR'].weight.data.renorm_(p=2, dim=0, maxnorm=1)
 
-    def forward(self, sample: torch.Tensor):
-        bs = sample.size(0)
-        # TODO(gengyuan)
-        dim = sample.size(1) // (1 + self.config.get("negative_sampling.num_samples"))
-        sample = sample.view(-1, dim)
-
-        # TODO(gengyuan) type conversion when feeding the data instead of running the models
-        h_i, t_i, r_i, d_i = sample[:, 0].long(), sample[:, 2].long(), sample[:, 1].long(), sample[:, 3]
+    def forward(self, sample: Batch):
+        h_i, t_i, r_i, d_i = sample.ids[:, 0], sample.ids[:, 2], sample.ids[:, 1], sample.times[:, 0]
 
         pi = 3.14159265358979323846
 
@@ -485,72 +540,37 @@ class ATiSEModel(BaseModel):
                                                                  1) - self.emb_dim
         scores = (out1 + out2) / 4
 
-        scores = scores.view(bs, -1)
+        # only the rows of the entities and relations in the batch are updated
+        ent_rows, rel_rows = torch.cat([h_i, t_i]), r_i
 
         factors = {
-            "renorm": (self.embedding['emb_E'].weight,
-                       self.embedding['emb_R'].weight,
-                       self.embedding['emb_TE'].weight,
-                       self.embedding['emb_TR'].weight),
-            "clamp": (self.embedding['emb_E_var'].weight,
-                      self.embedding['emb_R_var'].weight)
+            "renorm": (RowSubset(self.embedding['emb_E'].weight, ent_rows),
+                       RowSubset(self.embedding['emb_R'].weight, rel_rows),
+                       RowSubset(self.embedding['emb_TE'].weight, ent_rows),
+                       RowSubset(self.embedding['emb_TR'].weight, rel_rows)),
+            "clamp": (RowSubset(self.embedding['emb_E_var'].weight, ent_rows),
+                      RowSubset(self.embedding['emb_R_var'].weight, rel_rows))
         }
 
         return scores, factors
 
-    # TODO(gengyaun):
-    # walkaround
-    def predict(self, sample: torch.Tensor):
-        bs = sample.size(0)
-        # TODO(gengyuan)
-        dim = sample.size(1) // (self.dataset.num_entities())
-        sample = sample.view(-1, dim)
-
-        # TODO(gengyuan) type conversion when feeding the data instead of running the models
-        h_i, t_i, r_i, d_i = sample[:, 0].long(), sample[:, 2].long(), sample[:, 1].long(), sample[:, 3]
-
-        pi = 3.14159265358979323846
-
-        h_mean = self.embedding['emb_E'](h_i).view(-1, self.emb_dim) + \
-                 d_i.view(-1, 1) * self.embedding['alpha_E'](h_i).view(-1, 1) * self.embedding['emb_TE'](h_i).view(-1,
-                                                                                                                   self.emb_dim) \
-                 + self.embedding['beta_E'](h_i).view(-1, self.emb_dim) * torch.sin(
-            2 * pi * self.embedding['omega_E'](h_i).view(-1, self.emb_dim) * d_i.view(-1, 1))
+    def fit(self, samples: Batch):
+        bs = samples.size(0)
 
-        t_mean = self.embedding['emb_E'](t_i).view(-1, self.emb_dim) + \
-                 d_i.view(-1, 1) * self.embedding['alpha_E'](t_i).view(-1, 1) * self.embedding['emb_TE'](t_i).view(-1,
-                                                                                                                   self.emb_dim) \
-                 + self.embedding['beta_E'](t_i).view(-1, self.emb_dim) * torch.sin(
-            2 * pi * self.embedding['omega_E'](t_i).view(-1, self.emb_dim) * d_i.view(-1, 1))
+        scores, factors = self.forward(samples.flatten())
+        scores = scores.view(bs, -1)
 
-        r_mean = self.embedding['emb_R'](r_i).view(-1, self.emb_dim) + \
-                 d_i.view(-1, 1) * self.embedding['alpha_R'](r_i).view(-1, 1) * self.embedding['emb_TR'](r_i).view(-1,
-                                                                                                                   self.emb_dim) \
-                 + self.embedding['beta_R'](r_i).view(-1, self.emb_dim) * torch.sin(
-            2 * pi * self.embedding['omega_R'](r_i).view(-1, self.emb_dim) * d_i.view(-1, 1))
+        return scores, factors
 
-        h_var = self.embedding['emb_E_var'](h_i).view(-1, self.emb_dim)
-        t_var = self.embedding['emb_E_var'](t_i).view(-1, self.emb_dim)
-        r_var = self.embedding['emb_R_var'](r_i).view(-1, self.emb_dim)
+    def predict(self, queries: Batch):
+        bs = queries.size(0)
 
-        out1 = torch.sum((h_var + t_var) / r_var, 1) + torch.sum(((r_mean - h_mean + t_mean) ** 2) / r_var,
-                                                                 1) - self.emb_dim
-        out2 = torch.sum(r_var / (h_var + t_var), 1) + torch.sum(((h_mean - t_mean - r_mean) ** 2) / (h_var + t_var),
-                                                                 1) - self.emb_dim
-        scores = (out1 + out2) / 4
+        candidates = all_candidates_of_ent_queries(queries, self.dataset.num_entities())
 
+        scores, _ = self.forward(candidates)
         scores = scores.view(bs, -1)
 
-        factors = {
-            "renorm": (self.embedding['emb_E'].weight,
-                       self.embedding['emb_R'].weight,
-                       self.embedding['emb_TE'].weight,
-                       self.embedding['emb_TR'].weight),
-            "clamp": (self.embedding['emb_E_var'].weight,
-                      self.embedding['emb_R_var'].weight)
-        }
-
-        return scores, factors
+        return scores
 
 
 # reference: https://github.com/bsantraigi/TA_TransE/blob/master/model.py
@@ -606,8 +626,9 @@ class TATransEModel(BaseModel):
 
         return rseq_e
 
-    def forward(self, samples: torch.Tensor):
-        h, r, t, tem = samples[:, 0].long(), samples[:, 1].long(), samples[:, 2].long(), samples[:, 3:].long()
+    def forward(self, samples: Batch):
+        # the time features of the TA datasets are token ids of the date digits
+        h, r, t, tem = samples.ids[:, 0], samples.ids[:, 1], samples.ids[:, 2], samples.times.long()
 
         h_e = self.embedding['ent'](h)
         t_e = self.embedding['ent'](t)
@@ -630,22 +651,18 @@ class TATransEModel(BaseModel):
 
         return scores, factors
 
-    def fit(self, samples: torch.Tensor):
+    def fit(self, samples: Batch):
         bs = samples.size(0)
-        dim = samples.size(1) // (1 + self.config.get("negative_sampling.num_samples"))
 
-        samples = samples.view(-1, dim)
+        samples = samples.flatten()
 
         scores, factor = self.forward(samples)
         scores = scores.view(bs, -1)
 
         return scores, factor
 
-    def predict(self, queries: torch.Tensor):
-        assert torch.isnan(queries).sum(1).byte().all(), "Either head or tail should be absent."
-
+    def predict(self, queries: Batch):
         bs = queries.size(0)
-        dim = queries.size(0)
 
         candidates = all_candidates_of_ent_queries(queries, self.dataset.num_entities())
 
@@ -688,8 +705,9 @@ class TADistmultModel(BaseModel):
             torch.nn.init.xavier_uniform_(emb.weight)
             emb.weight.data.renorm(p=2, dim=1, maxnorm=1)
 
-    def forward(self, samples: torch.Tensor):
-        h, r, t, tem = samples[:, 0].long(), samples[:, 1].long(), samples[:, 2].long(), samples[:, 3:].long()
+    def forward(self, samples: Batch):
+        # the time features of the TA datasets are token ids of the date digits
+        h, r, t, tem = samples.ids[:, 0], samples.ids[:, 1], samples.ids[:, 2], samples.times.long()
 
         h_e = self.embedding['ent'](h)
         t_e = self.embedding['ent'](t)
@@ -728,22 +746,18 @@ class TADistmultModel(BaseModel):
 
         return rseq_e
 
-    def fit(self, samples: torch.Tensor):
+    def fit(self, samples: Batch):
         bs = samples.size(0)
-        dim = samples.size(1) // (1 + self.config.get("negative_sampling.num_samples"))
 
-        samples = samples.view(-1, dim)
+        samples = samples.flatten()
 
         scores, factor = self.forward(samples)
         scores = scores.view(bs, -1)
 
         return scores, factor
 
-    def predict(self, queries: torch.Tensor):
-        assert torch.isnan(queries).sum(1).byte().all(), "Either head or tail should be absent."
-
+    def predict(self, queries: Batch):
         bs = queries.size(0)
-        dim = queries.size(0)
 
         candidates = all_candidates_of_ent_queries(queries, self.dataset.num_entities())
 
@@ -1,25 +1,36 @@
 import torch
 
+from typing import Optional, Union
 
-def all_candidates_of_ent_queries(queries: torch.Tensor, vocab_size: int):
+from tkge.data.batch import Batch
+
+
+def all_candidates_of_ent_queries(queries: Union[torch.Tensor, Batch], vocab_size: int,
+                                  missing: Optional[torch.Tensor] = None):
     """
     Generate all candidate tuples of the queries with absent entities.
     args:
-        queries: entity prediction queries with either head or tail absent / value: float('nan')
+        queries: entity prediction queries with either head or tail absent, either a Batch carrying a missing mask
+            or a tensor with the absent values marked by `missing` / value: float('nan')
             size: [query_num, query_dim]
         vocab_size: the vocabulary size of the dataset
+        missing: bool mask of the absent values, only used for tensor queries. Defaults to the NaN entries
     return:
         candidates: size [query_num * vocab_size, query_dim]
     """
+    if isinstance(queries, Batch):
+        return Batch(all_candidates_of_ent_queries(queries.ids, vocab_size, queries.missing),
+                     queries.times.repeat_interleave(vocab_size, dim=0))
 
-    assert torch.isnan(queries).sum(1).byte().all(), "Either head or tail should be absent."
+    if missing is None:
+        missing = torch.isnan(queries)
 
-    dim_size = queries.size(1)
+    assert missing.sum(1).byte().all(), "Either head or tail should be absent."
 
-    missing_pos = torch.isnan(queries).nonzero()
-    candidates = queries.repeat((1, vocab_size)).view(-1, dim_size)
+    query_size, dim_size = queries.size()
 
-    for p in missing_pos:
-        candidates[p[0] * vocab_size:(p[0] + 1) * vocab_size, p[1]] = torch.arange(vocab_size)
+    rows, cols = missing.nonzero(as_tuple=True)
+    candidates = queries.repeat_interleave(vocab_size, dim=0).view(query_size, vocab_size, dim_size)
+    candidates[rows, :, cols] = torch.arange(vocab_size, device=queries.device, dtype=queries.dtype)
 
-    return candidates
+    return candidates.view(-1, dim_size)
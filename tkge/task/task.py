@@ -1,20 +1,22 @@
 from typing import Optional
 import argparse
 
-from tkge.common.configurable import Configurable
 from tkge.common.registry import Registrable
 from tkge.common.config import Config
-from tkge.data.dataset import DatasetProcessor
 
 
-class Task:
+class Task(Registrable):
     @staticmethod
-
     def parse_arguments(parser: argparse._SubParsersAction) -> argparse.ArgumentParser:
         raise NotImplementedError
 
     def __init__(self, config: Config):
-        self.config = config
+        super().__init__(config)
+
+
+# the task modules import torch and all the models, they are imported when a task is run, see tkge.py
+Task.register_lazy("train", "tkge.task.trainer")
+Task.register_lazy("eval", "tkge.task.tester")
 
     # @staticmethod
     # def create(task_type: str,
@@ -3,18 +3,24 @@ import torch
 import time
 import os
 from collections import defaultdict
+from typing import Dict, List
 import argparse
 
 from tkge.task.task import Task
 from tkge.data.dataset import DatasetProcessor, SplitDataset
+from tkge.data.batch import Batch
 from tkge.train.sampling import NegativeSampler, NonNegativeSampler
 from tkge.train.regularization import Regularizer, InplaceRegularizer
 from tkge.common.config import Config
+from tkge.common.error import ConfigurationError
 from tkge.models.model import BaseModel
 from tkge.models.loss import Loss
 from tkge.eval.metrics import Evaluation
+from tkge.train.checkpoint import load_model_state, expand_checkpoints
+from tkge.train.distributed import run_hogwild
 
 
+@Task.register(name="eval")
 class TestTask(Task):
     @staticmethod
     def parse_arguments(parser: argparse._SubParsersAction) -> argparse.ArgumentParser:
@@ -28,9 +34,18 @@ class TestTask(Task):
             help="specify configuration file path"
         )
 
+        subparser.add_argument(
+            "--num-processes",
+            type=int,
+            default=None,
+            help="number of processes evaluating checkpoints in parallel, overrides test.num_processes"
+        )
+
         return subparser
 
     def __init__(self, config: Config):
+        super().__init__(config)
+
         self.dataset = self.config.get("dataset.name")
         self.test_loader = None
         self.sampler = None
@@ -44,9 +59,32 @@ class TestTask(Task):
         # TODO(gengyuan): passed to all modules
         self.device = self.config.get("task.device")
 
+        # test.model_path is a checkpoint, a glob pattern or a list of them
+        model_path = self.config.get("test.model_path")
+        if not model_path:
+            raise ConfigurationError("test.model_path should name the checkpoints to evaluate")
+        self.checkpoints = expand_checkpoints(model_path)
+        self.num_processes = min(self.config.get("test.num_processes"), len(self.checkpoints))
+        if self.num_processes > 1 and self.device != "cpu":
+            raise ConfigurationError(f"test.num_processes > 1 requires task.device cpu, not {self.device}")
+
         self._prepare()
 
-        self.test()
+    def main(self):
+        """
+        Evaluates every checkpoint of test.model_path with the dataset, filter index and model built once, and logs a
+        table of the metrics averaged over head and tail prediction.
+
+        With test.num_processes > 1, the checkpoints are split among processes forked from this one, which share the
+        read-only dataset and filter index (copy-on-write) instead of building them again.
+        """
+        if self.num_processes > 1:
+            metrics = self._test_parallel()
+        else:
+            metrics = [self.test(path) for path in self.checkpoints]
+
+        if len(self.checkpoints) > 1:
+            self.config.log("Metrics averaged over head and tail prediction:\n" + self.metrics_table(metrics))
 
     def _prepare(self):
         self.config.log(f"Preparing datasets {self.dataset} in folder {self.config.get('dataset.folder')}")
@@ -61,58 +99,84 @@ class TestTask(Task):
             num_workers=self.config.get("test.loader.num_workers"),
             pin_memory=self.config.get("test.loader.pin_memory"),
             drop_last=self.config.get("test.loader.drop_last"),
-            timeout=self.config.get("test.loader.timeout")
+            timeout=self.config.get("test.loader.timeout"),
+            collate_fn=Batch.collate
         )
 
         self.onevsall_sampler = NonNegativeSampler(config=self.config, dataset=self.dataset, as_matrix=True)
 
-        self.config.log(f"Loading model {self.config.get('model.name')}")
-        self.model = BaseModel.create(config=self.config, dataset=self.dataset, device=self.device)
-        model_path = self.config.get("test.model_path")
-        model_state_dict = torch.load(model_path)
-
-        self.model.load_state_dict(model_state_dict['state_dict'])
+        # the parameters of every checkpoint are loaded into this model by `test`
+        self.config.log(f"Creating model {self.config.get('model.name')}")
+        self.model = BaseModel.create(config=self.config, dataset=self.dataset)
 
         self.config.log(f"Initializing evaluation")
         self.evaluation = Evaluation(config=self.config, dataset=self.dataset)
 
-    def test(self):
+    def load_model(self, model_path: str):
+        """Loads the parameters of a checkpoint into the model."""
+        self.config.log(f"Loading model {self.config.get('model.name')} from {model_path}")
+
+        # the parameters are memory-mapped from the checkpoint, its optimizer state is not loaded
+        self.model.load_state_dict(load_model_state(model_path), assign=True)
+        self.model.to(self.device)
+
+    def test(self, model_path: str) -> Dict[str, Dict[str, float]]:
+        """
+        Evaluates the checkpoint at `model_path` on the test split and returns the metrics of head and tail
+        prediction.
+        """
+        self.load_model(model_path)
+
         self.config.log("BEGIN TESTING")
 
-        with torch.no_grad():
-            self.model.eval()
+        ranks = self.evaluation.rank_facts(self.model, self.test_loader)
+        metrics = self.evaluation.summary(ranks)
+
+        self.config.log(f"Metrics(head prediction) : {metrics['head'].items()}")
+        self.config.log(f"Metrics(tail prediction) : {metrics['tail'].items()}")
+        self.config.trace(job="eval", type="checkpoint", model_path=model_path, head=metrics['head'],
+                          tail=metrics['tail'])
+
+        name = os.path.splitext(os.path.basename(os.path.normpath(model_path)))[0]
+        self.evaluation.report(ranks, f"test_{name}", job="eval", model_path=model_path)
 
-            l = 0
+        return metrics
 
-            metrics = dict()
-            metrics['head'] = defaultdict(float)
-            metrics['tail'] = defaultdict(float)
+    def metric_names(self) -> List[str]:
+        return ["mean_ranking", "mean_reciprocal_ranking"] + [f"hits_at_{k}" for k in self.config.get("eval.k")]
 
-            for batch in self.test_loader:
-                bs = batch.size(0)
-                dim = batch.size(1)
-                l += bs
+    def _test_parallel(self) -> List[Dict[str, Dict[str, float]]]:
+        """
+        Runs `test` on the checkpoints in test.num_processes processes, the process of rank r evaluating every
+        num_processes-th checkpoint from the r-th one. The metrics are gathered in a tensor in shared memory.
+        """
+        names = self.metric_names()
+        gathered = torch.zeros(len(self.checkpoints), 2, len(names), dtype=torch.float64).share_memory_()
 
-                samples_head, _ = self.onevsall_sampler.sample(batch, "head")
-                samples_tail, _ = self.onevsall_sampler.sample(batch, "tail")
+        def run(rank: int):
+            if rank > 0:
+                self.config.log_prefix = f"[rank {rank}] "
 
-                samples_head = samples_head.to(self.device)
-                samples_tail = samples_tail.to(self.device)
+            for index in range(rank, len(self.checkpoints), self.num_processes):
+                metrics = self.test(self.checkpoints[index])
+                for i, pos in enumerate(['head', 'tail']):
+                    gathered[index, i] = torch.tensor([metrics[pos][name] for name in names], dtype=torch.float64)
 
-                batch_scores_head, _ = self.model.predict(samples_head)
-                batch_scores_tail, _ = self.model.predict(samples_tail)
+        run_hogwild(run, self.num_processes)
 
-                batch_metrics = dict()
-                batch_metrics['head'] = self.evaluation.eval(batch, batch_scores_head, miss='s')
-                batch_metrics['tail'] = self.evaluation.eval(batch, batch_scores_tail, miss='o')
+        return [{pos: dict(zip(names, gathered[index, i].tolist())) for i, pos in enumerate(['head', 'tail'])}
+                for index in range(len(self.checkpoints))]
 
-                for pos in ['head', 'tail']:
-                    for key in batch_metrics[pos].keys():
-                        metrics[pos][key] += batch_metrics[pos][key] * bs
+    def metrics_table(self, metrics: List[Dict[str, Dict[str, float]]]) -> str:
+        """One row per checkpoint with its metrics averaged over head and tail prediction."""
+        names = self.metric_names()
+        widths = [max(len(name), 10) for name in names]
+        width = max(len("checkpoint"), *map(len, self.checkpoints))
 
-            for pos in ['head', 'tail']:
-                for key in metrics[pos].keys():
-                    metrics[pos][key] /= l
+        rows = ["checkpoint".ljust(width) + "".join(f"  {name:>{w}}" for name, w in zip(names, widths))]
+        for path, checkpoint_metrics in zip(self.checkpoints, metrics):
+            rows.append(path.ljust(width) + "".join(
+                f"  {(checkpoint_metrics['head'][name] + checkpoint_metrics['tail'][name]) / 2:>{w}.4f}"
+                for name, w in zip(names, widths)))
 
-            self.config.log(f"Metrics(head prediction) : {metrics['head'].items()}")
-            self.config.log(f"Metrics(tail prediction) : {metrics['tail'].items()}")
+        return "\n".join(rows)
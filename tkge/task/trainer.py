@@ -1,23 +1,35 @@
 import torch
 
 import time
-import os
 import argparse
 
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from collections import defaultdict
 
 from tkge.task.task import Task
-from tkge.data.dataset import DatasetProcessor, SplitDataset
+from tkge.data.dataset import DatasetProcessor, SplitDataset, KvsAllDataset
+from tkge.data.batch import Batch
+from tkge.data.dataloader import NegativeSamplingCollator, worker_init_fn
 from tkge.train.sampling import NegativeSampler, NonNegativeSampler
-from tkge.train.regularization import Regularizer, InplaceRegularizer
+from tkge.train import distributed
+from tkge.train.regularization import Regularizer, InplaceRegularizer, merge_row_subsets, penalty_reduction
+from tkge.train.statistics import LossStatistics
+from tkge.train.checkpoint import CheckpointWriter, snapshot, rng_state, set_rng_state, latest_checkpoint, \
+    load_checkpoint
+from tkge.train.instrumentation import Instrumentation
+from tkge.train.async_eval import AsyncEvaluator
 from tkge.train.optim import get_optimizer, get_scheduler
 from tkge.common.config import Config
+from tkge.common.error import ConfigurationError
+from tkge.common.misc import get_seed, seed_from_config
 from tkge.models.model import BaseModel
 from tkge.models.loss import Loss
 from tkge.eval.metrics import Evaluation
+from tkge.eval.breakdown import Ranks
+from tkge.eval.subsample import query_strata, stratified_subsample, estimate_mean
 
 
+@Task.register(name="train")
 class TrainTask(Task):
     @staticmethod
     def parse_arguments(parser: argparse._SubParsersAction) -> argparse.ArgumentParser:
@@ -35,7 +47,14 @@ class TrainTask(Task):
             "--resume",
             action="store_true",
             default=False,
-            help="resume training from checkpoint in config file"
+            help="resume training from the latest checkpoint in train.checkpoint.folder"
+        )
+
+        subparser.add_argument(
+            "--num-processes",
+            type=int,
+            default=None,
+            help="number of data-parallel training processes, overrides train.distributed.num_processes"
         )
 
         subparser.add_argument(
@@ -47,30 +66,71 @@ class TrainTask(Task):
 
         return subparser
 
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, rank: int = 0, world_size: int = 1):
         super().__init__(config)
 
+        # data-parallel or hogwild training, see tkge.train.distributed. Rank 0 logs, saves checkpoints and evaluates
+        self.rank = rank
+        self.world_size = world_size
+        self.parallel_mode = self.config.get("train.distributed.mode")
+        self.hogwild_barrier = None
+        self.hogwild_statistics: torch.Tensor = None
+        self.hogwild_validation: torch.Tensor = None
+
         self.dataset: DatasetProcessor = self.config.get("dataset.name")
         self.train_loader: torch.utils.data.DataLoader = None
         self.valid_loader: torch.utils.data.DataLoader = None
+        # a fixed stratified subsample of the validation queries, see train.valid.subsample
+        self.valid_subsample_loader: torch.utils.data.DataLoader = None
         # self.test_loader = None
         self.sampler: NegativeSampler = None
         self.model: BaseModel = None
         self.loss: Loss = None
-        self.optimizer: torch.optim.optimizer.Optimizer = None
+        self.optimizer: torch.optim.Optimizer = None
         self.lr_scheduler = None
         self.evaluation: Evaluation = None
 
+        self.train_type = self.config.get("train.type")
         self.train_bs = self.config.get("train.batch_size")
+        self.subbatch_size = self.config.get("train.subbatch_size")
+        self.subbatch_auto_tune = self.config.get("train.subbatch_auto_tune")
         self.valid_bs = self.config.get("train.valid.batch_size")
+        self.valid_metric = self.config.get("train.valid.metric")
+        if self.valid_metric not in ["mean_ranking", "mean_reciprocal_ranking"] + [f"hits_at_{k}" for k in
+                                                                                   self.config.get("eval.k")]:
+            raise ConfigurationError(f"train.valid.metric {self.valid_metric} should be mean_ranking, "
+                                     f"mean_reciprocal_ranking or hits_at_k for k in eval.k")
         self.datatype = (['timestamp_id'] if self.config.get("dataset.temporal.index") else []) + (
             ['timestamp_float'] if self.config.get("dataset.temporal.float") else [])
 
         # TODO(gengyuan): passed to all modules
         self.device = self.config.get("task.device")
 
+        seed_from_config(self.config)
+
+        # times the stages of training and evaluation, see train.instrumentation
+        self.instrumentation = Instrumentation.create(self.config, self.rank)
+
+        # the first epoch to train, the best validation metric so far and the number of validations since it
+        # improved, restored by load_ckpt
+        self.start_epoch = 1
+        self.best_metric: Optional[float] = None
+        self.validations_without_improvement = 0
+        self.checkpoint_writer = CheckpointWriter(self.config.get("train.checkpoint.folder"),
+                                                  self.config.get("model.name"), self.config.get("dataset.name"),
+                                                  self.config.get("train.checkpoint.keep"),
+                                                  self.config.get("train.checkpoint.background"), self.config.log,
+                                                  self.config.get("train.checkpoint.format"))
+
         self._prepare()
 
+        resume = self.config.get("train.checkpoint.resume")
+        if resume:
+            self.load_ckpt(resume)
+
+        # the modules hold snapshots of their options, see Config.snapshot
+        self.config.freeze()
+
         # TODO optimizer should be added into modules
 
     def _prepare(self):
@@ -78,35 +138,105 @@ class TrainTask(Task):
         self.dataset = DatasetProcessor.create(config=self.config)
         self.dataset.info()
 
+        self.config.log(f"Initializing negative sampling")
+        self.sampler = NegativeSampler.create(config=self.config, dataset=self.dataset)
+        self.onevsall_sampler = NonNegativeSampler(config=self.config, dataset=self.dataset, as_matrix=True)
+
         self.config.log(f"Loading training split data for loading")
+        # negative sampling runs in the loader workers, which receive a copy of the sampler; samplers scoring with
+        # the model being trained have to stay on the main process
+        num_workers = self.config.get("train.loader.num_workers")
+        if self.sampler.requires_model and num_workers > 0:
+            self.config.log(f"Negative sampler {self.config.get('negative_sampling.name')} scores with the model, "
+                            f"sampling on the main process instead of {num_workers} loader workers")
+            num_workers = 0
+
+        loader_kwargs = {}
+        if num_workers > 0:
+            loader_kwargs['prefetch_factor'] = self.config.get("train.loader.prefetch_factor")
+
+        if self.train_type == "KvsAll":
+            query_types = [k for k, v in self.config.get("KvsAll.query_types").items() if v]
+            if "s_o" in query_types:
+                raise ConfigurationError("KvsAll training only supports sp_ and _po queries")
+
+            train_set = KvsAllDataset(self.dataset.get("train"), self.datatype, query_types,
+                                      self.dataset.num_entities())
+            collate_fn = train_set.collate
+            self.config.log(f"{len(train_set)} distinct KvsAll queries of types {query_types}")
+        else:
+            train_set = SplitDataset(self.dataset.get("train"), self.datatype)
+            # sampling in loader workers is measured as part of waiting for the loader
+            collate_fn = NegativeSamplingCollator(self.sampler, self.config.get("negative_sampling.target"),
+                                                  self.instrumentation if num_workers == 0 else None)
+
+        # every rank trains on its shard of the permutation, in data-parallel mode with an equal share of the batch
+        train_sampler = None
+        train_bs = self.train_bs
+        if self.world_size > 1:
+            if self.parallel_mode not in ["data_parallel", "hogwild"]:
+                raise ConfigurationError(f"train.distributed.mode {self.parallel_mode} should be data_parallel or "
+                                         f"hogwild")
+
+            if self.parallel_mode == "data_parallel" and self.train_bs % self.world_size != 0:
+                raise ConfigurationError(f"train.batch_size {self.train_bs} should be divisible by the number of "
+                                         f"processes {self.world_size}")
+
+            train_sampler = torch.utils.data.DistributedSampler(
+                train_set, num_replicas=self.world_size, rank=self.rank, shuffle=True,
+                seed=max(get_seed(self.config, "torch"), 0))
+
+            if self.parallel_mode == "data_parallel":
+                train_bs = self.train_bs // self.world_size
+
         # TODO(gengyuan) load params
         self.train_loader = torch.utils.data.DataLoader(
-            SplitDataset(self.dataset.get("train"), self.datatype),
-            shuffle=True,
-            batch_size=self.train_bs,
-            num_workers=self.config.get("train.loader.num_workers"),
+            train_set,
+            shuffle=train_sampler is None,
+            sampler=train_sampler,
+            batch_size=train_bs,
+            num_workers=num_workers,
             pin_memory=self.config.get("train.loader.pin_memory"),
             drop_last=self.config.get("train.loader.drop_last"),
-            timeout=self.config.get("train.loader.timeout")
+            timeout=self.config.get("train.loader.timeout"),
+            collate_fn=collate_fn,
+            worker_init_fn=worker_init_fn,
+            **loader_kwargs
         )
 
-        self.valid_loader = torch.utils.data.DataLoader(
-            SplitDataset(self.dataset.get("test"), self.datatype + ['timestamp_id']),
+        valid_set = SplitDataset(self.dataset.get(self.config.get("train.valid.split")),
+                                 self.datatype + ['timestamp_id'])
+        valid_loader_kwargs = dict(
             shuffle=False,
             batch_size=self.valid_bs,
             num_workers=self.config.get("train.loader.num_workers"),
             pin_memory=self.config.get("train.loader.pin_memory"),
-            drop_last=self.config.get("train.loader.drop_last"),
-            timeout=self.config.get("train.loader.timeout")
+            # every query is evaluated
+            drop_last=False,
+            timeout=self.config.get("train.loader.timeout"),
+            collate_fn=Batch.collate
         )
+        self.valid_loader = torch.utils.data.DataLoader(valid_set, **valid_loader_kwargs)
 
-        self.config.log(f"Initializing negative sampling")
-        self.sampler = NegativeSampler.create(config=self.config, dataset=self.dataset)
-        self.onevsall_sampler = NonNegativeSampler(config=self.config, dataset=self.dataset, as_matrix=True)
+        subsample_size = self.config.get("train.valid.subsample.size")
+        if 0 < subsample_size < len(valid_set):
+            strata = query_strata(valid_set.ids, self.dataset.num_timestamps(),
+                                  self.config.get("train.valid.subsample.time_buckets"))
+            indices = stratified_subsample(strata, subsample_size, seed=max(get_seed(self.config, "torch"), 0))
+            self.config.log(f"Validating on a subsample of {subsample_size} of {len(valid_set)} queries from "
+                            f"{len(torch.unique(strata[indices]))} of {len(torch.unique(strata))} strata")
+
+            self.valid_subsample_loader = torch.utils.data.DataLoader(
+                torch.utils.data.Subset(valid_set, indices.tolist()), **valid_loader_kwargs)
 
         self.config.log(f"Creating model {self.config.get('model.name')}")
         self.model = BaseModel.create(config=self.config, dataset=self.dataset)
         self.model.to(self.device)
+        self.sampler.set_model(self.model)
+
+        if self.world_size > 1 and self.parallel_mode == "data_parallel":
+            distributed.broadcast_parameters(self.model)
+            distributed.seed_rank(self.rank)
 
         self.config.log(f"Initializing loss function")
         self.loss = Loss.create(config=self.config)
@@ -114,12 +244,20 @@ class TrainTask(Task):
         self.config.log(f"Initializing optimizer")
         optimizer_type = self.config.get("train.optimizer.type")
         optimizer_args = self.config.get("train.optimizer.args")
-        self.optimizer = get_optimizer(optimizer_type, optimizer_args)
+        optimizer_groups = {name: group for name, group in self.config.get("train.optimizer").items()
+                            if isinstance(group, dict) and "regex" in group}
+        self.optimizer = get_optimizer(self.model, optimizer_type, optimizer_args, optimizer_groups)
+        self.config.log(f"Using optimizer {type(self.optimizer).__name__} with parameter groups "
+                        f"{[group['name'] for group in self.optimizer.param_groups]}")
 
         self.config.log(f"Initializing lr scheduler")
         if self.config.get("train.lr_scheduler"):
             scheduler_type = self.config.get("train.lr_scheduler.type")
             scheduler_args = self.config.get("train.lr_scheduler.args")
+            if scheduler_type == "ReduceLROnPlateau" and self.config.get("train.valid.every") > 0:
+                # the scheduler is stepped with the validation metric, see _step_scheduler
+                scheduler_args = {"mode": "min" if self.valid_metric == "mean_ranking" else "max",
+                                  **(scheduler_args or {})}
             self.lr_scheduler = get_scheduler(self.optimizer, scheduler_type, scheduler_args)
 
         self.config.log((f"Initializeing regularizer"))
@@ -140,67 +278,47 @@ class TrainTask(Task):
     def main(self):
         self.config.log("BEGIN TRANING")
 
-        save_freq = self.config.get("train.checkpoint.every")
         eval_freq = self.config.get("train.valid.every")
 
-        sample_target = self.config.get("negative_sampling.target")
-
-        for epoch in range(1, self.config.get("train.max_epochs") + 1):
+        # validates in a separate process while training goes on, see train.valid.async
+        evaluator = AsyncEvaluator(self) if self.rank == 0 and eval_freq > 0 and \
+            self.config.get("train.valid.async") else None
+
+        try:
+            self._train_epochs(eval_freq, evaluator)
+
+            if evaluator is not None:
+                for valid_epoch, value in evaluator.wait():
+                    self._track_validation(value)
+        finally:
+            if evaluator is not None:
+                evaluator.terminate()
+
+        # the last checkpoint is complete once training returns
+        self.checkpoint_writer.wait()
+
+    def _train_epochs(self, eval_freq: int, evaluator: Optional[AsyncEvaluator] = None):
+        """
+        Trains from start_epoch up to train.max_epochs or until stopped early, validating every `eval_freq` epochs,
+        in the background by `evaluator` if given.
+        """
+        for epoch in range(self.start_epoch, self.config.get("train.max_epochs") + 1):
             self.model.train()
 
-            # TODO early stopping conditions
-            # 1. metrics 变化小
-            # 2. epoch
-            # 3. valid koss
-            total_loss = 0.0
-            train_size = self.dataset.train_size
+            statistics = LossStatistics(self.loss_terms(), self.device)
 
             start = time.time()
 
-            for pos_batch in self.train_loader:
-                self.optimizer.zero_grad()
-
-                samples, labels = self.sampler.sample(pos_batch, sample_target)
-
-                samples = samples.to(self.device)
-                labels = labels.to(self.device)
-
-                scores, factors = self.model.fit(samples)
-
-                # TODO (gengyuan) assertion: size of scores and labels should be matched
-                assert scores.size() == labels.size(), f"Score's size {scores.shape} should match label's size {labels.shape}"
-                loss = self.loss(scores, labels)
-
-                # TODO (gengyuan) assert that regularizer and inplace-regularizer don't share same name
-                assert not (factors and set(factors.keys()) - (set(self.regularizer) | set(
-                    self.inplace_regularizer))), f"Regularizer name defined in model {set(factors.keys())} should correspond to that in config file"
-
-                if factors:
-                    for name, tensors in factors.items():
-                        if name not in self.regularizer:
-                            continue
-
-                        if not isinstance(tensors, (tuple, list)):
-                            tensors = [tensors]
+            if self.world_size > 1:
+                self.train_loader.sampler.set_epoch(epoch)
 
-                        reg_loss = self.regularizer[name](tensors)
-                        loss += reg_loss
+            for samples, labels in self.instrumentation.iterate("load", self.train_loader):
+                with self.instrumentation.stage("to_device", samples.size(0)):
+                    samples = samples.to(self.device, non_blocking=True)
+                    labels = labels.to(self.device, non_blocking=True)
 
-                loss.backward()
-                self.optimizer.step()
-
-                total_loss += loss.cpu().item()
-
-                # TODO(gengyuan) inplace regularize
-                if factors:
-                    for name, tensors in factors.items():
-                        if name not in self.inplace_regularizer:
-                            continue
-
-                        if not isinstance(tensors, (tuple, list)):
-                            tensors = [tensors]
-
-                        self.inplace_regularizer[name](tensors)
+                with self.instrumentation.stage("step", samples.size(0)):
+                    statistics.add(self._train_batch(samples, labels), samples.size(0))
 
                 # empty caches
                 # del samples, labels, scores, factors
@@ -208,120 +326,402 @@ class TrainTask(Task):
                 #     torch.cuda.empty_cache()
 
             stop = time.time()
-            avg_loss = total_loss / train_size
-
-            if not self.lr_scheduler:
-                if isinstance(self.lr_scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau):
-                    self.lr_scheduler.step(avg_loss)
-                else:
-                    self.lr_scheduler.step()
-
-            self.config.log(f"Loss in iteration {epoch} : {avg_loss} comsuming {stop - start}s")
-
-            if epoch % save_freq == 0:
-                self.save_ckpt(epoch)
-
-            if epoch % eval_freq == 0:
-                with torch.no_grad():
-                    self.model.eval()
-
-                    counter = 0
-
-                    metrics = dict()
-                    metrics['head'] = defaultdict(float)
-                    metrics['tail'] = defaultdict(float)
-
-                    for batch in self.valid_loader:
-                        bs = batch.size(0)
-                        dim = batch.size(1)
-
-
-                        batch = batch.to(self.device)
-
-                        counter += bs
-
-                        queries_head = batch.clone()[:, :-1]
-                        queries_tail = batch.clone()[:, :-1]
-
 
-                        # samples_head, _ = self.onevsall_sampler.sample(queries, "head")
-                        # samples_tail, _ = self.onevsall_sampler.sample(queries, "tail")
-
-                        # samples_head = samples_head.to(self.device)
-                        # samples_tail = samples_tail.to(self.device)
-
-                        queries_head[:, 0] = float('nan')
-                        queries_tail[:, 2] = float('nan')
-
-                        batch_scores_head = self.model.predict(queries_head)
-                        assert list(batch_scores_head.shape) == [bs,
-                                                           self.dataset.num_entities()], f"Scores {batch_scores_head.shape} should be in shape [{bs}, {self.dataset.num_entities()}]"
-
-                        batch_scores_tail = self.model.predict(queries_tail)
-                        assert list(batch_scores_tail.shape) == [bs,
-                                                           self.dataset.num_entities()], f"Scores {batch_scores_head.shape} should be in shape [{bs}, {self.dataset.num_entities()}]"
-
-                        # TODO (gengyuan): reimplement ATISE eval
+            # the statistics of all processes together cover the epoch
+            if self.world_size > 1 and self.parallel_mode == "data_parallel":
+                statistics = LossStatistics.from_tensor(statistics.names,
+                                                        distributed.all_reduce_sum(statistics.to_tensor().cpu()))
+            elif self.hogwild_barrier is not None:
+                self.hogwild_statistics[self.rank] = statistics.to_tensor()
+                self.hogwild_barrier.wait()
+                statistics = LossStatistics.from_tensor(statistics.names, self.hogwild_statistics.sum(0))
+
+            summary = statistics.summary()
+            avg_loss = summary["avg_loss"]
+
+            # rank 0 validates and decides on early stopping, the checkpoint includes the scheduler's step
+            value, early_stop = None, False
+            if self.rank == 0:
+                penalties = {name: summary[f"avg_{name}"] for name in self.regularizer}
+                self.config.log(f"Loss in iteration {epoch} : {avg_loss} per sample, {summary['avg_loss_per_batch']} "
+                                f"per batch (data {summary['avg_data']}, penalties {penalties}) comsuming "
+                                f"{stop - start}s")
+
+                improved = False
+                if evaluator is not None:
+                    # the metrics of earlier epochs arrive while training goes on, the evaluator saves the best model
+                    results = evaluator.submit(epoch) if epoch % eval_freq == 0 else evaluator.poll()
+                    for valid_epoch, value in results:
+                        self._track_validation(value)
+                        early_stop = self._should_stop_early(valid_epoch)
+                elif eval_freq > 0 and epoch % eval_freq == 0:
+                    value = self.validate(epoch)
+                    improved = self._track_validation(value)
+                    early_stop = self._should_stop_early(epoch)
+
+                self._step_scheduler(avg_loss, value)
+
+                with self.instrumentation.stage("checkpoint"):
+                    self._checkpoint(epoch, improved, last=early_stop)
+
+            stages = self.instrumentation.end_epoch(epoch)
+            if self.rank == 0 and stages:
+                self.config.log(f"Stages in iteration {epoch} : " + ", ".join(
+                    f"{name} {stage['seconds']:.3f}s" for name, stage in stages.items()))
+
+            value, early_stop = self._share_validation(value, early_stop)
+            if self.rank > 0:
+                self._step_scheduler(avg_loss, value)
+
+            if early_stop:
+                break
+
+    def loss_terms(self) -> List[str]:
+        """Names of the loss terms of a step: the total loss, the loss function's data term and the penalties."""
+        return ["loss", "data"] + list(self.regularizer.keys())
+
+    def _train_batch(self, samples: Batch, labels: torch.Tensor) -> Dict[str, torch.Tensor]:
+        """
+        Runs one optimization step on a batch and returns its loss terms (see `loss_terms`) as 0-dim tensors on the
+        device, without waiting for the step to finish.
+
+        With train.subbatch_size set, forward and backward passes run on sub-batches whose gradients are
+        accumulated, scaled such that the step equals the one on the full batch (see `_subbatch_loss`). With train.subbatch_auto_tune on,
+        a batch running out of memory is retried with half the sub-batch size, which is kept for the rest of the run.
+        """
+        batch_size = samples.size(0)
+
+        while True:
+            subbatch_size = self.subbatch_size if 0 < self.subbatch_size < batch_size else batch_size
+
+            try:
+                self.optimizer.zero_grad()
 
-                        # if self.config.get("task.reciprocal_relation"):
-                        #     samples_head_reciprocal = samples_head.clone().view(-1, dim)
-                        #     samples_tail_reciprocal = samples_tail.clone().view(-1, dim)
-                        #
-                        #     samples_head_reciprocal[:, 1] += 1
-                        #     samples_head_reciprocal[:, [0, 2]] = samples_head_reciprocal.index_select(1, torch.Tensor(
-                        #         [2, 0]).long().to(self.device))
-                        #
-                        #     samples_tail_reciprocal[:, 1] += 1
-                        #     samples_tail_reciprocal[:, [0, 2]] = samples_tail_reciprocal.index_select(1, torch.Tensor(
-                        #         [2, 0]).long().to(self.device))
-                        #
-                        #     samples_head_reciprocal = samples_head_reciprocal.view(bs, -1)
-                        #     samples_tail_reciprocal = samples_tail_reciprocal.view(bs, -1)
-                        #
-                        #     batch_scores_head_reci, _ = self.model.predict(samples_head_reciprocal)
-                        #     batch_scores_tail_reci, _ = self.model.predict(samples_tail_reciprocal)
-                        #
-                        #     batch_scores_head += batch_scores_head_reci
-                        #     batch_scores_tail += batch_scores_tail_reci
+                terms, inplace_factors = defaultdict(float), defaultdict(list)
+                for start in range(0, batch_size, subbatch_size):
+                    stop = min(start + subbatch_size, batch_size)
+
+                    subbatch_loss, subbatch_terms, factors = self._subbatch_loss(samples, labels, start, stop)
+                    with self.instrumentation.stage("backward", stop - start):
+                        subbatch_loss.backward()
+
+                    for name, value in subbatch_terms.items():
+                        terms[name] += value
+
+                    for name, tensors in (factors or {}).items():
+                        if name in self.inplace_regularizer:
+                            inplace_factors[name].append(tensors if isinstance(tensors, (tuple, list)) else [tensors])
+
+                break
+
+            except RuntimeError as e:
+                if not (self.subbatch_auto_tune and _is_out_of_memory(e)) or subbatch_size == 1:
+                    raise
+
+            self.subbatch_size = subbatch_size // 2
+            self.config.log(f"Batch of size {batch_size} ran out of memory with sub-batches of size {subbatch_size}, "
+                            f"reducing the sub-batch size to {self.subbatch_size}")
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+        if self.world_size > 1 and self.parallel_mode == "data_parallel":
+            with self.instrumentation.stage("all_reduce", batch_size):
+                distributed.all_reduce_gradients(self.model.parameters(), self.world_size)
+
+        with self.instrumentation.stage("optimizer", batch_size):
+            self.optimizer.step()
+
+        for regularizer in self.regularizer.values():
+            regularizer.step()
+
+        # TODO(gengyuan) inplace regularize
+        with self.instrumentation.stage("inplace_regularize", batch_size):
+            for name, tensors in inplace_factors.items():
+                # row subsets cover the rows used by any of the sub-batches
+                self.inplace_regularizer[name](merge_row_subsets(tensors))
+
+        return terms
+
+    def _share_validation(self, value: Optional[float], early_stop: bool):
+        """
+        Hands the validation metric of the epoch (None if not validated) and the early stopping decision of rank 0 to
+        all ranks. In hogwild mode, this holds back all processes until rank 0 has evaluated and checkpointed the
+        epoch.
+        """
+        if self.world_size == 1:
+            return value, early_stop
+
+        if self.parallel_mode == "data_parallel":
+            shared = distributed.broadcast(torch.tensor([float("nan") if value is None else value, early_stop],
+                                                        dtype=torch.float64))
+        else:
+            if self.rank == 0:
+                self.hogwild_validation[0] = float("nan") if value is None else value
+                self.hogwild_validation[1] = early_stop
+            self.hogwild_barrier.wait()
+            shared = self.hogwild_validation.clone()
+
+        value = shared[0].item()
+
+        return None if value != value else value, bool(shared[1].item())
+
+    def _step_scheduler(self, avg_loss: float, value: Optional[float]):
+        """
+        Steps the lr scheduler once per epoch. ReduceLROnPlateau is stepped with the validation metric whenever the
+        model is validated, or with the training loss if validation is disabled.
+        """
+        if not self.lr_scheduler:
+            return
+
+        if isinstance(self.lr_scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau):
+            if self.config.get("train.valid.every") <= 0:
+                self.lr_scheduler.step(avg_loss)
+            elif value is not None:
+                self.lr_scheduler.step(value)
+        else:
+            self.lr_scheduler.step()
+
+    def _subbatch_loss(self, samples: Batch, labels: torch.Tensor, start: int, stop: int):
+        """
+        Loss of samples[start:stop] including the regularization terms, its (detached) loss terms and the model's
+        factors. The terms are scaled to add up to the ones of the batch over its sub-batches: terms reduced by their
+        mean over the samples (see Loss.reduction and penalty_reduction) are weighted by the sub-batch's share of the
+        batch, summed ones are not.
+        """
+        share = (stop - start) / samples.size(0)
+
+        def scale(reduction: str) -> float:
+            return share if reduction == "mean" else 1.
+
+        if stop - start < samples.size(0):
+            samples = samples[start:stop]
+            labels = labels.index_select(0, torch.arange(start, stop, device=labels.device)) if labels.is_sparse \
+                else labels[start:stop]
+
+        with self.instrumentation.stage("forward", stop - start):
+            if self.train_type == "KvsAll":
+                scores, factors = self.model.score_queries(samples)
+            else:
+                scores, factors = self.model.fit(samples)
 
-                        batch_metrics = dict()
+            # TODO (gengyuan) assertion: size of scores and labels should be matched
+            assert scores.size() == labels.size(), f"Score's size {scores.shape} should match label's size {labels.shape}"
+            loss = self.loss(scores, labels) * scale(self.loss.reduction)
+            terms = {"data": loss.detach()}
+
+        # TODO (gengyuan) assert that regularizer and inplace-regularizer don't share same name
+        assert not (factors and set(factors.keys()) - (set(self.regularizer) | set(
+            self.inplace_regularizer))), f"Regularizer name defined in model {set(factors.keys())} should correspond to that in config file"
+
+        if factors:
+            for name, tensors in factors.items():
+                if name not in self.regularizer:
+                    continue
+
+                if not isinstance(tensors, (tuple, list)):
+                    tensors = [tensors]
+
+                with self.instrumentation.stage("regularize", stop - start):
+                    reg_loss = self.regularizer[name](tensors)
+                reg_loss = reg_loss * scale(penalty_reduction(self.regularizer[name], tensors))
+                loss = loss + reg_loss
+                terms[name] = reg_loss.detach() if isinstance(reg_loss, torch.Tensor) else reg_loss
+
+        terms["loss"] = loss.detach()
+
+        return loss, terms, factors
+
+    def validate(self, epoch: int) -> float:
+        """
+        Evaluates the model after `epoch` and returns the validation metric, see train.valid.metric.
+
+        With train.valid.subsample.size set, the metric is estimated on the subsample. All queries are evaluated in
+        addition every train.valid.subsample.full_every epochs, after the last epoch and whenever the estimate
+        improves.
+        """
+        if self.valid_subsample_loader is None:
+            return self.valid_metric_value(self.eval(epoch))
+
+        value, _ = self.eval_subsample(epoch)
+
+        full_every = self.config.get("train.valid.subsample.full_every")
+        if (full_every > 0 and epoch % full_every == 0) or epoch == self.config.get("train.max_epochs") or \
+                self.is_improvement(value):
+            self.eval(epoch)
+
+        return value
+
+    def eval(self, epoch: int) -> Dict[str, Dict[str, float]]:
+        """
+        Evaluates the model on the validation split and returns the metrics of head and tail prediction. Reports the
+        breakdowns of entity_ranking.metrics_per, see Evaluation.report.
+        """
+        with self.instrumentation.stage("eval", len(self.valid_loader.dataset)):
+            ranks = self.evaluation.rank_facts(self.model, self.valid_loader, self.instrumentation)
+            metrics = self.evaluation.summary(ranks)
+
+        self.config.log(f"Metrics(head prediction) in iteration {epoch} : {metrics['head'].items()}")
+        self.config.log(f"Metrics(tail prediction) in iteration {epoch} : {metrics['tail'].items()}")
+        self.evaluation.report(ranks, f"valid_epoch_{epoch}", job="train", epoch=epoch)
+
+        return metrics
+
+    def eval_subsample(self, epoch: int) -> Tuple[float, float]:
+        """
+        Estimates the validation metric on the subsample of the validation queries and returns it with the half width
+        of its 95% confidence interval.
+        """
+        with self.instrumentation.stage("eval_subsample", len(self.valid_subsample_loader.dataset)):
+            ranks = self.evaluation.rank_facts(self.model, self.valid_subsample_loader, self.instrumentation)
+            metrics = self.evaluation.summary(ranks)
+            values = self.valid_metric_values(ranks)
+
+        value, half_width = estimate_mean(values, len(self.valid_loader.dataset))
+
+        self.config.log(f"Metrics(head prediction) on the subsample in iteration {epoch} : {metrics['head'].items()}")
+        self.config.log(f"Metrics(tail prediction) on the subsample in iteration {epoch} : {metrics['tail'].items()}")
+        self.config.log(f"{self.valid_metric} estimated on the subsample in iteration {epoch} : {value:.4f} +- "
+                        f"{half_width:.4f} (95% confidence interval)")
+        self.config.trace(job="train", type="valid_subsample", epoch=epoch, metric=self.valid_metric, value=value,
+                          half_width=half_width, size=len(values), population=len(self.valid_loader.dataset))
+
+        return value, half_width
+
+    def valid_metric_values(self, ranks: Ranks) -> torch.Tensor:
+        """The validation metric of every fact, averaged over its head and tail query."""
+        return (self.evaluation.query_metric(ranks.head, self.valid_metric) +
+                self.evaluation.query_metric(ranks.tail, self.valid_metric)) / 2
+
+    def valid_metric_value(self, metrics: Dict[str, Dict[str, float]]) -> float:
+        """The validation metric, see train.valid.metric, averaged over head and tail prediction."""
+        return (metrics['head'][self.valid_metric] + metrics['tail'][self.valid_metric]) / 2
+
+    def is_improvement(self, value: float) -> bool:
+        """Whether the validation metric `value` is better than the best one so far."""
+        if self.best_metric is None:
+            return True
+
+        # the mean rank is the only metric for which lower is better
+        return value < self.best_metric if self.valid_metric == "mean_ranking" else value > self.best_metric
+
+    def _track_validation(self, value: float) -> bool:
+        """Records the validation metric `value` of an epoch and returns whether it is the best so far."""
+        improved = self.is_improvement(value)
+
+        if improved:
+            self.best_metric = value
+            self.validations_without_improvement = 0
+        else:
+            self.validations_without_improvement += 1
+
+        return improved
+
+    def _should_stop_early(self, epoch: int) -> bool:
+        """
+        Whether training stops after `epoch`, see train.valid.early_stopping: once the validation metric has not
+        improved for `patience` validations, or if it has not reached `threshold.metric_value` after
+        `threshold.epochs` epochs.
+        """
+        patience = self.config.get("train.valid.early_stopping.patience")
+        if 0 < patience <= self.validations_without_improvement:
+            self.config.log(f"Stopping early after epoch {epoch}: {self.valid_metric} has not improved on "
+                            f"{self.best_metric} in the last {patience} validations")
+            return True
+
+        threshold_epochs = self.config.get("train.valid.early_stopping.threshold.epochs")
+        threshold = self.config.get("train.valid.early_stopping.threshold.metric_value")
+        if 0 < threshold_epochs <= epoch and self.is_improvement(threshold):
+            self.config.log(f"Stopping early after epoch {epoch}: {self.valid_metric} {self.best_metric} has not "
+                            f"reached {threshold} after {threshold_epochs} epochs")
+            return True
+
+        return False
+
+    def _checkpoint(self, epoch: int, improved: bool, last: bool = False):
+        """
+        Saves a checkpoint after every train.checkpoint.every epochs and after the `last` one, and, with
+        train.checkpoint.keep_best, whenever the validation metric has `improved`.
+        """
+        save_freq = self.config.get("train.checkpoint.every")
 
-                        batch_metrics['head'] = self.evaluation.eval(batch, batch_scores_head, miss='s')
-                        batch_metrics['tail'] = self.evaluation.eval(batch, batch_scores_tail, miss='o')
+        best = improved and self.config.get("train.checkpoint.keep_best")
+        regular = save_freq > 0 and (epoch % save_freq == 0 or last or epoch == self.config.get("train.max_epochs"))
 
-                        # TODO(gengyuan) refactor
-                        for pos in ['head', 'tail']:
-                            for key in batch_metrics[pos].keys():
-                                metrics[pos][key] += batch_metrics[pos][key] * bs
+        if regular or best:
+            self.save_ckpt(epoch, regular, best)
 
-                    for pos in ['head', 'tail']:
-                        for key in metrics[pos].keys():
-                            metrics[pos][key] /= counter
+    def save_ckpt(self, epoch: int, regular: bool = True, best: bool = False):
+        """
+        Saves the state of training after `epoch` as the checkpoint of the epoch if `regular` and as the best
+        checkpoint if `best`, see CheckpointWriter. The state is copied right away and written in the background.
+        """
+        self.config.log(f"Save the model after epoch {epoch} to {self.config.get('train.checkpoint.folder')}" +
+                        (" as best model" if best else ""))
 
-                    self.config.log(f"Metrics(head prediction) in iteration {epoch} : {metrics['head'].items()}")
-                    self.config.log(f"Metrics(tail prediction) in iteration {epoch} : {metrics['tail'].items()}")
+        checkpoint = snapshot({
+            'last_epoch': epoch,
+            'state_dict': self.model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'lr_scheduler': self.lr_scheduler.state_dict() if self.lr_scheduler else None,
+            'sampler': self.sampler.state_dict(),
+            'regularizer': {name: regularizer.state_dict() for name, regularizer in self.regularizer.items()},
+            'subbatch_size': self.subbatch_size,
+            'best_metric': self.best_metric,
+            'validations_without_improvement': self.validations_without_improvement,
+            'rng': rng_state(),
+            'config': self.config.options
+        })
+
+        self.checkpoint_writer.save(checkpoint, epoch if regular else None, best)
+
+    def load_ckpt(self, ckpt_path: str):
+        """Restores the state of training saved by `save_ckpt`, training continues with the following epoch."""
+        self.config.log(f"Resuming training from checkpoint {ckpt_path}")
+
+        checkpoint = load_checkpoint(ckpt_path)
+
+        self.model.load_state_dict(checkpoint['state_dict'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        if self.lr_scheduler and checkpoint['lr_scheduler'] is not None:
+            self.lr_scheduler.load_state_dict(checkpoint['lr_scheduler'])
+        self.sampler.load_state_dict(checkpoint['sampler'])
+        for name, state in checkpoint.get('regularizer', {}).items():
+            self.regularizer[name].load_state_dict(state)
+
+        self.subbatch_size = checkpoint['subbatch_size']
+        self.best_metric = checkpoint['best_metric']
+        self.validations_without_improvement = checkpoint.get('validations_without_improvement', 0)
+        self.start_epoch = checkpoint['last_epoch'] + 1
+
+        # the saved PRNG states are those of rank 0, the other ranks draw their own samples
+        if self.rank == 0:
+            set_rng_state(checkpoint['rng'])
+        elif self.parallel_mode == "data_parallel":
+            distributed.seed_rank(self.rank, checkpoint['last_epoch'])
 
-    def eval(self):
-        # TODO early stopping
+    @staticmethod
+    def resume_config(config: Config, overrides: bool = False) -> Config:
+        """
+        Sets train.checkpoint.resume to the latest checkpoint in train.checkpoint.folder. Unless `overrides` is set,
+        the options stored in the checkpoint replace those of `config`.
+        """
+        folder = config.get("train.checkpoint.folder")
+        path = latest_checkpoint(folder, config.get("model.name"), config.get("dataset.name"))
+        if path is None:
+            raise ConfigurationError(f"No checkpoint of model {config.get('model.name')} on dataset "
+                                     f"{config.get('dataset.name')} in {folder} to resume from")
 
-        raise NotImplementedError
+        if not overrides:
+            config.options = load_checkpoint(path)['config']
 
-    def save_ckpt(self, epoch):
-        model = self.config.get("model.name")
-        dataset = self.config.get("dataset.name")
-        folder = self.config.get("train.checkpoint.folder")
-        filename = f"epoch_{epoch}_model_{model}_dataset_{dataset}.ckpt"
+        config.set("train.checkpoint.resume", path)
 
-        self.config.log(f"Save the model to {folder} as file {filename}")
+        return config
 
-        checkpoint = {
-            'last_epoch': epoch,
-            'state_dict': self.model.state_dict(),
-            'optimizer': self.optimizer.state_dict(),
-            'lr_scheduler': self.lr_scheduler.state_dict()
-        }
 
-        torch.save(checkpoint, os.path.join(folder, filename))  # os.path.join(model, dataset, folder, filename))
+def _is_out_of_memory(e: RuntimeError) -> bool:
+    """Whether the error reports a failed (CPU or CUDA) allocation. A process killed by the OS cannot recover."""
+    message = str(e)
 
-    def load_ckpt(self, ckpt_path):
-        raise NotImplementedError
+    return "out of memory" in message or "can't allocate memory" in message or "not enough memory" in message
@@ -0,0 +1,138 @@
+import torch
+import torch.multiprocessing as mp
+
+import queue
+import traceback
+from typing import List, Optional, Tuple
+
+from tkge.common.error import ConfigurationError
+from tkge.train.checkpoint import CheckpointWriter
+
+
+class AsyncEvaluator:
+    """
+    Validates snapshots of the model of a TrainTask in a long-lived process while training goes on, see
+    train.valid.async.
+
+    The evaluator process is forked from the trainer before training starts and thus owns a copy of the datasets,
+    the validation loaders and the filter index of the task's Evaluation without building them again. Its model
+    works on a snapshot of the parameters in shared memory: `submit` copies the trainer's parameters into it and
+    hands over the epoch, the evaluator runs `task.validate` on it, logs and traces the metrics and sends the
+    validation metric back. At most one validation is in flight: `submit` first waits for the previous one, whose
+    result it returns, such that training runs at most one validation ahead.
+
+    With train.checkpoint.keep_best, the evaluator writes the snapshot of an improving epoch as best checkpoint
+    itself, since the trainer has moved on by the time the metric is known. It holds the model only and is meant
+    for evaluation, training is resumed from the regular checkpoints.
+
+    The intra-op threads of the trainer are split evenly between it and the evaluator. The evaluator is forked and
+    thus needs task.device cpu.
+    """
+
+    def __init__(self, task):
+        if task.device != "cpu":
+            raise ConfigurationError(f"train.valid.async requires task.device cpu, not {task.device}")
+
+        self.task = task
+
+        context = mp.get_context("fork")
+        self.snapshot = {name: tensor.detach().to("cpu", copy=True).share_memory_()
+                         for name, tensor in task.model.state_dict().items()}
+        self.requests = context.SimpleQueue()
+        self.results = context.Queue()
+        # the epoch being validated, if any
+        self.pending: Optional[int] = None
+
+        self.threads = torch.get_num_threads()
+        self.process = context.Process(target=self._run, args=(max(1, self.threads // 2),), name="async eval")
+        self.process.start()
+
+        torch.set_num_threads(max(1, self.threads - self.threads // 2))
+
+    def submit(self, epoch: int) -> List[Tuple[int, float]]:
+        """
+        Hands a snapshot of the model after `epoch` to the evaluator. Returns the (epoch, metric) of the previous
+        validation, which is waited for first.
+        """
+        results = self.wait()
+
+        with torch.no_grad():
+            for name, tensor in self.task.model.state_dict().items():
+                self.snapshot[name].copy_(tensor)
+
+        self.requests.put((epoch, self.task.best_metric))
+        self.pending = epoch
+
+        return results
+
+    def poll(self) -> List[Tuple[int, float]]:
+        """The (epoch, metric) of the pending validation if it has finished, without waiting."""
+        return self._receive(block=False)
+
+    def wait(self) -> List[Tuple[int, float]]:
+        """Waits for the pending validation and returns its (epoch, metric)."""
+        return self._receive(block=True)
+
+    def terminate(self):
+        """Stops the evaluator after its current validation, if any."""
+        if self.process.is_alive():
+            self.requests.put(None)
+        self.process.join()
+
+        torch.set_num_threads(self.threads)
+
+    def _receive(self, block: bool) -> List[Tuple[int, float]]:
+        while self.pending is not None:
+            try:
+                result = self.results.get(timeout=1.)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"Evaluator process exited with code {self.process.exitcode} while "
+                                       f"validating epoch {self.pending}")
+                if not block:
+                    return []
+                continue
+
+            self.pending = None
+            if isinstance(result, str):
+                raise RuntimeError(f"Evaluator process failed:\n{result}")
+
+            return [result]
+
+        return []
+
+    def _run(self, num_threads: int):
+        torch.set_num_threads(num_threads)
+
+        task, config = self.task, self.task.config
+        config.log_prefix = "[async eval] "
+
+        # the evaluator's model works on the snapshot
+        task.model.load_state_dict(self.snapshot, assign=True)
+
+        keep_best = config.get("train.checkpoint.keep_best")
+        # retention of the regular checkpoints is left to the trainer
+        writer = CheckpointWriter(config.get("train.checkpoint.folder"), config.get("model.name"),
+                                  config.get("dataset.name"), keep=0, background=False, log=config.log,
+                                  format=config.get("train.checkpoint.format"))
+
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+
+            epoch, task.best_metric = request
+
+            try:
+                value = task.validate(epoch)
+
+                if keep_best and task.is_improvement(value):
+                    config.log(f"Save the model after epoch {epoch} to {config.get('train.checkpoint.folder')} as "
+                               f"best model")
+                    writer.save({'last_epoch': epoch, 'state_dict': self.snapshot}, None, best=True)
+                    writer.wait()
+
+                config.trace(job="train", type="valid_async", epoch=epoch, metric=task.valid_metric, value=value)
+                self.results.put((epoch, value))
+            except Exception:
+                self.results.put(traceback.format_exc())
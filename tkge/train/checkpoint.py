@@ -0,0 +1,323 @@
+import torch
+import numpy as np
+
+import glob
+import json
+import os
+import random
+import re
+import shutil
+import threading
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from tkge.common.error import ConfigurationError
+
+# layout of sharded checkpoints, see save_sharded
+MANIFEST = "manifest.json"
+TRAINING_STATE = "training_state.ckpt"
+SHARDED_FORMAT = "tkge-sharded"
+SHARDED_VERSION = 1
+
+
+def snapshot(obj: Any) -> Any:
+    """
+    Copy of a (nested) state dict with every tensor cloned to the cpu, such that it can be written while training
+    goes on updating the original tensors.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, snapshot(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+
+    return obj
+
+
+def rng_state() -> Dict[str, Any]:
+    """States of the torch, CUDA, numpy and python PRNGs of the current process."""
+    return {
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+        'numpy': np.random.get_state(),
+        'random': random.getstate()
+    }
+
+
+def set_rng_state(state: Dict[str, Any]):
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+
+
+def checkpoint_filename(epoch: int, model: str, dataset: str) -> str:
+    return f"epoch_{epoch}_model_{model}_dataset_{dataset}.ckpt"
+
+
+def best_checkpoint_filename(model: str, dataset: str) -> str:
+    return f"best_model_{model}_dataset_{dataset}.ckpt"
+
+
+def checkpoint_epochs(folder: str, model: str, dataset: str) -> Dict[int, str]:
+    """Paths of the epoch checkpoints of a model and dataset in `folder` by epoch."""
+    pattern = re.compile(re.escape(checkpoint_filename(0, model, dataset)).replace("_0_", r"_(\d+)_", 1))
+
+    if not os.path.isdir(folder):
+        return {}
+
+    return {int(match.group(1)): os.path.join(folder, filename)
+            for filename, match in ((f, pattern.fullmatch(f)) for f in os.listdir(folder)) if match}
+
+
+def latest_checkpoint(folder: str, model: str, dataset: str) -> Optional[str]:
+    epochs = checkpoint_epochs(folder, model, dataset)
+
+    return epochs[max(epochs)] if epochs else None
+
+
+def expand_checkpoints(patterns: Union[str, List[str]]) -> List[str]:
+    """
+    Paths of the checkpoints matched by a path or glob pattern, or a list of them, in order of the patterns and, for
+    a pattern, in natural order (such that epoch_2 comes before epoch_10).
+    """
+    paths = []
+    for pattern in [patterns] if isinstance(patterns, str) else patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise ConfigurationError(f"No checkpoint matches {pattern}")
+
+        paths += sorted(matches, key=lambda path: [int(part) if part.isdigit() else part
+                                                   for part in re.split(r"(\d+)", path)])
+
+    return paths
+
+
+def is_sharded(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def save_sharded(checkpoint: Dict[str, Any], path: str):
+    """
+    Writes a checkpoint as a folder `path` holding every tensor of its model state dict as a raw array in a file of
+    its own, described by a JSON manifest, and the rest of the checkpoint (optimizer, scheduler, PRNG states, ...)
+    in `training_state.ckpt`.
+
+    Every array starts a file and is thus page aligned, such that `load_sharded_state_dict` can map it into memory.
+    """
+    os.makedirs(path)
+
+    tensors = dict()
+    for i, (name, tensor) in enumerate(checkpoint['state_dict'].items()):
+        tensor = tensor.detach().cpu().contiguous()
+        filename = f"{i:04d}_{name}.bin"
+
+        with open(os.path.join(path, filename), "wb") as file:
+            # viewed as bytes, which numpy supports for every dtype, and written without a copy
+            file.write(tensor.view(-1).view(torch.uint8).numpy())
+            file.flush()
+            os.fsync(file.fileno())
+
+        tensors[name] = {'file': filename, 'dtype': str(tensor.dtype).replace("torch.", ""),
+                         'shape': list(tensor.shape)}
+
+    with open(os.path.join(path, TRAINING_STATE), "wb") as file:
+        torch.save({k: v for k, v in checkpoint.items() if k != 'state_dict'}, file)
+        file.flush()
+        os.fsync(file.fileno())
+
+    manifest = {'format': SHARDED_FORMAT, 'version': SHARDED_VERSION, 'last_epoch': checkpoint.get('last_epoch'),
+                'tensors': tensors}
+    with open(os.path.join(path, MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=1)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def load_sharded_state_dict(path: str, mmap: bool = True) -> Dict[str, torch.Tensor]:
+    """
+    The model state dict of a sharded checkpoint. With `mmap`, the tensors are private memory maps of their files:
+    nothing is read until a tensor is used, and pages are copied only when written to.
+    """
+    with open(os.path.join(path, MANIFEST), "r") as file:
+        manifest = json.load(file)
+
+    if manifest.get('format') != SHARDED_FORMAT or manifest.get('version') != SHARDED_VERSION:
+        raise ValueError(f"{path} is not a sharded checkpoint of version {SHARDED_VERSION}")
+
+    state_dict = dict()
+    for name, entry in manifest['tensors'].items():
+        dtype = getattr(torch, entry['dtype'])
+        numel = 1
+        for size in entry['shape']:
+            numel *= size
+
+        filename = os.path.join(path, entry['file'])
+        if numel == 0:
+            tensor = torch.empty(entry['shape'], dtype=dtype)
+        elif mmap:
+            tensor = torch.from_file(filename, shared=False, size=numel, dtype=dtype).view(entry['shape'])
+        else:
+            with open(filename, "rb") as file:
+                tensor = torch.frombuffer(bytearray(file.read()), dtype=dtype).view(entry['shape'])
+
+        state_dict[name] = tensor
+
+    return state_dict
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    """Loads a checkpoint of either format (see CheckpointWriter) with all its tensors on the cpu."""
+    if is_sharded(path):
+        checkpoint = torch.load(os.path.join(path, TRAINING_STATE), map_location="cpu", weights_only=False)
+        checkpoint['state_dict'] = load_sharded_state_dict(path, mmap=False)
+
+        return checkpoint
+
+    # the checkpoint holds numpy and python RNG states besides tensors
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def load_model_state(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Only the model state dict of a checkpoint of either format, for evaluation and serving.
+
+    The tensors are memory-mapped, the rest of the checkpoint such as the optimizer state is never read from a
+    sharded checkpoint. Load it with `model.load_state_dict(state_dict, assign=True)` to use the mapped tensors as
+    parameters instead of copying them.
+    """
+    if is_sharded(path):
+        return load_sharded_state_dict(path, mmap=True)
+
+    # torch.save files map their tensors, but unpickle the whole checkpoint
+    return torch.load(path, map_location="cpu", mmap=True, weights_only=False)['state_dict']
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints of a model and dataset to `folder`, by default from a background thread.
+
+    `save` takes a checkpoint whose tensors were already copied with `snapshot` and returns right away, training goes
+    on while the checkpoint is written. At most one checkpoint is written at a time: `save` first waits for the
+    previous one, so at most one snapshot is held in memory besides the training state. A checkpoint is written to a
+    temporary file which is renamed once complete, a crash never leaves a truncated checkpoint behind.
+
+    Of the epoch checkpoints, the `keep` most recent ones are retained (all for `keep` <= 0). The best checkpoint
+    (see `save`) is kept in a separate file, independently of the retention.
+
+    With `format` torch, a checkpoint is a single `torch.save` file. With `format` sharded, it is a folder of the same
+    name from which the model parameters can be memory-mapped, see `save_sharded`.
+    """
+
+    formats = ["torch", "sharded"]
+
+    def __init__(self, folder: str, model: str, dataset: str, keep: int, background: bool = True,
+                 log: Callable[[str], None] = print, format: str = "torch"):
+        if format not in self.formats:
+            raise ConfigurationError(f"Checkpoint format {format} should be one of {self.formats}")
+
+        self.folder = folder
+        self.model = model
+        self.dataset = dataset
+        self.keep = keep
+        self.background = background
+        self.format = format
+        self.log = log
+
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def save(self, checkpoint: Dict[str, Any], epoch: Optional[int], best: bool = False):
+        """
+        Writes the checkpoint as the one of `epoch` (None for no epoch checkpoint) and, with `best`, as the best
+        checkpoint.
+        """
+        self.wait()
+
+        if self.background:
+            self._thread = threading.Thread(target=self._write, args=(checkpoint, epoch, best),
+                                            name="checkpoint writer")
+            self._thread.start()
+        else:
+            self._write(checkpoint, epoch, best)
+            self._raise()
+
+    def wait(self):
+        """Waits for the checkpoint being written and raises the error writing it, if any."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        self._raise()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing the checkpoint failed") from error
+
+    def _write(self, checkpoint: Dict[str, Any], epoch: Optional[int], best: bool):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+
+            path = None
+            if epoch is not None:
+                path = os.path.join(self.folder, checkpoint_filename(epoch, self.model, self.dataset))
+                self._write_atomic(checkpoint, path)
+                self.log(f"Saved checkpoint {path}")
+
+            if best:
+                best_path = os.path.join(self.folder, best_checkpoint_filename(self.model, self.dataset))
+                self._write_atomic(checkpoint, best_path, link=path)
+                self.log(f"Saved best checkpoint {best_path}")
+
+            self._retain()
+        except BaseException as e:
+            self._error = e
+
+    def _write_atomic(self, checkpoint: Dict[str, Any], path: str, link: Optional[str] = None):
+        tmp_path = path + ".tmp"
+        _remove(tmp_path)
+
+        if link is not None:
+            # the same content is on disk already
+            try:
+                if os.path.isdir(link):
+                    os.makedirs(tmp_path)
+                    for filename in os.listdir(link):
+                        os.link(os.path.join(link, filename), os.path.join(tmp_path, filename))
+                else:
+                    os.link(link, tmp_path)
+            except OSError:
+                _remove(tmp_path)
+                link = None
+
+        if link is None:
+            if self.format == "sharded":
+                save_sharded(checkpoint, tmp_path)
+            else:
+                with open(tmp_path, "wb") as file:
+                    torch.save(checkpoint, file)
+                    file.flush()
+                    os.fsync(file.fileno())
+
+        if os.path.isdir(tmp_path):
+            # a folder cannot replace another one, the previous checkpoint is removed first
+            _remove(path)
+
+        os.replace(tmp_path, path)
+
+    def _retain(self):
+        if self.keep <= 0:
+            return
+
+        epochs = checkpoint_epochs(self.folder, self.model, self.dataset)
+        for epoch in sorted(epochs)[:-self.keep]:
+            _remove(epochs[epoch])
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,199 @@
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import numpy as np
+
+import random
+from typing import Callable, Iterable, Union
+
+from tkge.common.config import Config
+from tkge.common.error import ConfigurationError
+
+
+def launch(task_type: type, config: Config, num_processes: int):
+    """
+    Runs `task_type(config, rank, world_size).main()` in `num_processes` processes as set in
+    `train.distributed.mode`:
+
+    - data_parallel: the processes form a gloo process group communicating over TCP at
+      `train.distributed.master_addr:master_port` on the local machine and average their gradients every step.
+    - hogwild: the task is created once, its model is moved to shared memory and forked processes update it without
+      locks, see `launch_hogwild`.
+
+    Rank 0 takes the role of a single-process run: it logs, saves checkpoints and evaluates.
+    """
+    mode = config.get("train.distributed.mode")
+
+    if mode == "data_parallel":
+        mp.spawn(_run, args=(task_type, config, num_processes), nprocs=num_processes, join=True)
+    elif mode == "hogwild":
+        launch_hogwild(task_type(config, rank=0, world_size=num_processes))
+    else:
+        raise ConfigurationError(f"train.distributed.mode {mode} should be data_parallel or hogwild")
+
+
+def _run(rank: int, task_type: type, config: Config, world_size: int):
+    init_process_group(rank, world_size,
+                       config.get("train.distributed.master_addr"), config.get("train.distributed.master_port"))
+
+    if rank > 0:
+        config.log_prefix = f"[rank {rank}] "
+
+    try:
+        task = task_type(config, rank=rank, world_size=world_size)
+        task.main()
+
+        # rank 0 evaluates after the last epoch while the other ranks wait
+        dist.barrier()
+    finally:
+        dist.destroy_process_group()
+
+
+def init_process_group(rank: int, world_size: int, master_addr: str = "localhost", master_port: int = 29500):
+    dist.init_process_group("gloo", init_method=f"tcp://{master_addr}:{master_port}", rank=rank,
+                            world_size=world_size)
+
+
+def seed_rank(rank: int, epoch: int = 0):
+    """
+    Offsets the PRNGs of the calling process by its rank, such that the ranks draw different negative samples.
+
+    Called after the model is initialized, whose parameters have to match on all ranks. A run resumed after `epoch`
+    draws different samples than the epochs before.
+    """
+    seed = (torch.initial_seed() + rank + 1000003 * epoch) % 2 ** 32
+
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def broadcast_parameters(module: torch.nn.Module, src: int = 0):
+    """Overwrites the parameters and buffers of `module` on every rank by those of rank `src`."""
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        dist.broadcast(tensor.data, src=src)
+
+
+def all_reduce_gradients(parameters: Iterable[torch.nn.Parameter], world_size: int):
+    """
+    Averages the gradients of `parameters` over all ranks.
+
+    Dense gradients are reduced as a single flat buffer. Sparse gradients, e.g. of embeddings with sparse=True, are
+    reduced as sparse tensors, so only the rows touched by some rank are communicated.
+    """
+    dense, sparse = [], []
+    for p in parameters:
+        if p.grad is None:
+            continue
+
+        (sparse if p.grad.is_sparse else dense).append(p)
+
+    if dense:
+        buffer = torch.cat([p.grad.view(-1) for p in dense])
+        dist.all_reduce(buffer)
+        buffer /= world_size
+
+        offset = 0
+        for p in dense:
+            numel = p.grad.numel()
+            p.grad.copy_(buffer[offset:offset + numel].view_as(p.grad))
+            offset += numel
+
+    for p in sparse:
+        grad = p.grad.coalesce()
+        dist.all_reduce(grad)
+        p.grad = grad / world_size
+
+
+def broadcast(tensor: torch.Tensor, src: int = 0) -> torch.Tensor:
+    """Overwrites the (cpu) tensor on every rank by the one of rank `src`."""
+    dist.broadcast(tensor, src=src)
+
+    return tensor
+
+
+def all_reduce_sum(value: Union[float, torch.Tensor]) -> Union[float, torch.Tensor]:
+    """Sum of a python scalar or a (cpu) tensor over all ranks."""
+    if isinstance(value, torch.Tensor):
+        dist.all_reduce(value)
+        return value
+
+    tensor = torch.tensor([value], dtype=torch.float64)
+    dist.all_reduce(tensor)
+
+    return tensor.item()
+
+
+def launch_hogwild(task):
+    """
+    Trains the model of a TrainTask created with world_size > 1 in world_size processes sharing its parameters.
+
+    Every process runs `task.main()` on its shard of the training data with a private copy of the optimizer (and its
+    state) and writes its updates into the shared parameters without locking. With sparse embeddings, e.g. of
+    TComplEx, a step only touches the rows of its batch, so concurrent steps rarely collide. At the end of every epoch
+    the processes meet at `task.hogwild_barrier`, such that rank 0 logs, checkpoints and evaluates a consistent
+    snapshot of the parameters.
+    """
+    world_size = task.world_size
+
+    task.model.share_memory()
+    # LossStatistics.to_tensor of every process
+    num_terms = len(task.loss_terms())
+    task.hogwild_statistics = torch.zeros(world_size, 2 * num_terms + 2, dtype=torch.float64).share_memory_()
+    # the validation metric and early stopping decision of rank 0, see TrainTask._share_validation
+    task.hogwild_validation = torch.zeros(2, dtype=torch.float64).share_memory_()
+
+    def run(rank: int):
+        task.rank = rank
+        task.instrumentation.rank = rank
+        task.train_loader.sampler.rank = rank
+
+        if rank > 0:
+            task.config.log_prefix = f"[rank {rank}] "
+            seed_rank(rank, task.start_epoch - 1)
+
+        task.main()
+
+    run_hogwild(run, world_size, task)
+
+
+def run_hogwild(fn: Callable[[int], None], num_processes: int, task=None):
+    """
+    Runs `fn(rank)` in `num_processes` processes, rank 0 in the calling one and the others forked from it.
+
+    Tensors moved to shared memory with `share_memory_` before the call are shared by all processes, everything else
+    is copied on fork. The intra-op threads are split evenly among the processes. If `task` is given, a barrier is
+    stored as `task.hogwild_barrier`; it is aborted as soon as a process fails, so the others don't wait forever.
+    """
+    context = mp.get_context("fork")
+    barrier = context.Barrier(num_processes)
+    if task is not None:
+        task.hogwild_barrier = barrier
+
+    num_threads = max(1, torch.get_num_threads() // num_processes)
+
+    def target(rank: int):
+        torch.set_num_threads(num_threads)
+
+        try:
+            fn(rank)
+        except BaseException:
+            barrier.abort()
+            raise
+
+    processes = [context.Process(target=target, args=(rank,)) for rank in range(1, num_processes)]
+    for process in processes:
+        process.start()
+
+    threads = torch.get_num_threads()
+    try:
+        target(0)
+    finally:
+        for process in processes:
+            process.join()
+
+        torch.set_num_threads(threads)
+
+    failed = [rank for rank, process in enumerate(processes, start=1) if process.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Hogwild processes of ranks {failed} failed")
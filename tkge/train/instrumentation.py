@@ -0,0 +1,191 @@
+import torch
+
+import time
+from contextlib import nullcontext
+from typing import Dict, Iterable, Iterator, Optional
+
+from tkge.common.config import Config
+from tkge.common.registry import Registrable
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_NULL_STAGE = nullcontext()
+
+
+def peak_rss() -> Optional[int]:
+    """Peak resident set size of the calling process in bytes, None where it can't be queried."""
+    if resource is None:
+        return None
+
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Instrumentation(Registrable):
+    """
+    Measures the stages of the training step and the evaluation loop, e.g.
+
+        with self.instrumentation.stage("forward", num_samples=samples.size(0)):
+            scores, factors = self.model.fit(samples)
+
+    and writes their statistics of every epoch to the trace file with `Config.trace`, see `end_epoch`.
+
+    This base class measures nothing: `stage` returns a shared no-op context manager and `iterate` the iterable
+    itself, so instrumented code costs a method call per stage when instrumentation is off.
+    """
+
+    def __init__(self, config: Config, rank: int = 0):
+        super().__init__(config)
+
+        self.rank = rank
+
+    def stage(self, name: str, num_samples: int = 0):
+        """Context manager measuring a run of stage `name` processing `num_samples` samples."""
+        return _NULL_STAGE
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterable:
+        """Yields the items of `iterable`, measuring the time spent waiting for each of them as stage `name`."""
+        return iterable
+
+    def end_epoch(self, epoch: int) -> Dict[str, Dict]:
+        """Traces the statistics of every stage run in the epoch, returns them by stage and starts a new epoch."""
+        return {}
+
+    @staticmethod
+    def create(config: Config, rank: int = 0):
+        """Instrumentation of type `train.instrumentation.type`, a registered name or the path of a class."""
+        instrumentation_type = config.get("train.instrumentation.type")
+
+        return Instrumentation.by_name(instrumentation_type)(config, rank)
+
+
+Instrumentation.register(name="disabled")(Instrumentation)
+
+
+class _StageStatistics:
+    __slots__ = ["calls", "seconds", "samples", "peak_rss", "rss_growth", "peak_cuda_memory"]
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.
+        self.samples = 0
+        self.peak_rss = 0
+        self.rss_growth = 0
+        self.peak_cuda_memory = 0
+
+
+class _Stage:
+    __slots__ = ["instrumentation", "statistics", "num_samples", "start", "start_rss"]
+
+    def __init__(self, instrumentation: "StageInstrumentation", statistics: _StageStatistics, num_samples: int):
+        self.instrumentation = instrumentation
+        self.statistics = statistics
+        self.num_samples = num_samples
+
+    def __enter__(self):
+        self.instrumentation._synchronize()
+        self.start_rss = peak_rss()
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation._synchronize()
+        seconds = time.perf_counter() - self.start
+
+        statistics = self.statistics
+        statistics.calls += 1
+        statistics.seconds += seconds
+        statistics.samples += self.num_samples
+
+        rss = peak_rss()
+        if rss is not None:
+            statistics.peak_rss = max(statistics.peak_rss, rss)
+            statistics.rss_growth += rss - self.start_rss
+
+        if self.instrumentation.cuda:
+            statistics.peak_cuda_memory = max(statistics.peak_cuda_memory, torch.cuda.max_memory_allocated())
+
+        return False
+
+
+@Instrumentation.register(name="stages")
+class StageInstrumentation(Instrumentation):
+    """
+    Records per stage and epoch the number of runs, the wall time, the samples processed per second and the peak
+    memory of the process.
+
+    The peak resident set size is a high-water mark of the whole process: `peak_rss` is its value after the stage and
+    `rss_growth` how much the stage raised it, which points to the stages allocating the memory. On CUDA devices, the
+    peak of `torch.cuda.max_memory_allocated` is recorded as well.
+
+    CUDA kernels run asynchronously, so with `train.instrumentation.synchronize` the device is synchronized at the
+    boundaries of every stage to attribute the kernel time to the stage launching it. This serializes host and device
+    and slows training down, but without it the time shows up in the next stage waiting for a result.
+    """
+
+    def __init__(self, config: Config, rank: int = 0):
+        super().__init__(config, rank)
+
+        self.cuda = torch.device(self.config.get("task.device")).type == "cuda"
+        self.synchronize = self.cuda and self.config.get("train.instrumentation.synchronize")
+
+        self.statistics: Dict[str, _StageStatistics] = dict()
+
+    def _synchronize(self):
+        if self.synchronize:
+            torch.cuda.synchronize()
+
+    def stage(self, name: str, num_samples: int = 0):
+        statistics = self.statistics.get(name)
+        if statistics is None:
+            statistics = self.statistics[name] = _StageStatistics()
+
+        return _Stage(self, statistics, num_samples)
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterator:
+        iterator = iter(iterable)
+
+        while True:
+            with self.stage(name) as stage:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+
+                stage.num_samples = _num_samples(item)
+
+            yield item
+
+    def end_epoch(self, epoch: int) -> Dict[str, Dict]:
+        records = dict()
+
+        for name, statistics in self.statistics.items():
+            record = {
+                'calls': statistics.calls,
+                'seconds': statistics.seconds,
+                'samples': statistics.samples,
+                'samples_per_second': statistics.samples / statistics.seconds if statistics.seconds > 0 else 0.,
+                'peak_rss': statistics.peak_rss,
+                'rss_growth': statistics.rss_growth
+            }
+            if self.cuda:
+                record['peak_cuda_memory'] = statistics.peak_cuda_memory
+
+            self.config.trace(job="train", type="stage", epoch=epoch, rank=self.rank, stage=name, **record)
+            records[name] = record
+
+        self.statistics = dict()
+
+        return records
+
+
+def _num_samples(item) -> int:
+    """Size of a batch yielded by a loader, i.e. of a Batch or of the first element of a (samples, labels) pair."""
+    if isinstance(item, (tuple, list)):
+        item = item[0]
+
+    return item.size(0) if hasattr(item, "size") else 0
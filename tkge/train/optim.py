@@ -1,25 +1,290 @@
 import torch
 
-from typing import Optional, Dict
+import math
+import re
+from typing import Optional, Dict, List
 
 from tkge.common.error import ConfigurationError
 
 
-def get_optimizer(type: str, args: Optional[Dict]):
+class RowLazyOptimizer(torch.optim.Optimizer):
+    """
+    Base class of optimizers keeping the state of parameters with sparse gradients only for the rows touched so far.
+
+    Parameters with dense gradients get dense state tensors as usual. For a parameter receiving sparse gradients, e.g.
+    the weight of an `nn.Embedding(..., sparse=True)`, the state is stored as
+        slots: int64 tensor [num_rows] mapping each row to its state slot, -1 for rows never touched
+        <name>: tensor [capacity, *row_shape] per state buffer, of which the first `size` slots are in use
+    The buffers double in capacity when full, so their memory grows with the number of rows touched instead of the
+    number of rows. A parameter receiving a dense gradient, e.g. from a penalty on the whole table, switches to dense
+    state for good.
+    """
+
+    # names of the per-row state buffers, set by subclasses
+    buffers: List[str] = []
+
+    def _init_dense_state(self, p: torch.Tensor, group: Dict) -> Dict:
+        raise NotImplementedError
+
+    def _dense_step(self, p: torch.Tensor, grad: torch.Tensor, state: Dict, group: Dict):
+        raise NotImplementedError
+
+    def _sparse_step(self, p: torch.Tensor, rows: torch.Tensor, values: torch.Tensor, state: Dict, group: Dict):
+        """Updates rows `rows` of p and their state, which is `state[name][slots]` per buffer, see `_row_slots`."""
+        raise NotImplementedError
+
+    def load_state_dict(self, state_dict: Dict):
+        # Optimizer.load_state_dict casts the state of floating point parameters to their dtype, slots are indices
+        slots = {i: state['slots'] for i, state in state_dict['state'].items() if 'slots' in state}
+
+        super().load_state_dict(state_dict)
+
+        ids = [i for group in state_dict['param_groups'] for i in group['params']]
+        params = [p for group in self.param_groups for p in group['params']]
+        for i, p in zip(ids, params):
+            if i in slots:
+                self.state[p]['slots'] = slots[i].to(p.device)
+
+    def _row_slots(self, p: torch.Tensor, rows: torch.Tensor, state: Dict, group: Dict) -> torch.Tensor:
+        """Returns the state slots of the (unique) rows, allocating slots for rows touched for the first time."""
+        if self.buffers[0] in state and 'slots' not in state:
+            # dense state
+            return rows
+
+        if 'slots' not in state:
+            state['slots'] = torch.full((p.size(0),), -1, dtype=torch.long, device=p.device)
+            state['size'] = 0
+            for name in self.buffers:
+                state[name] = p.new_zeros((0,) + p.shape[1:])
+
+        slots = state['slots'][rows]
+        new = slots < 0
+
+        if new.any():
+            num_new = int(new.sum())
+            size = state['size']
+
+            capacity = state[self.buffers[0]].size(0)
+            if size + num_new > capacity:
+                capacity = max(size + num_new, 2 * capacity)
+                for name in self.buffers:
+                    buffer = p.new_zeros((capacity,) + p.shape[1:])
+                    buffer[:size] = state[name][:size]
+                    state[name] = buffer
+
+            slots[new] = torch.arange(size, size + num_new, device=p.device)
+            state['slots'][rows[new]] = slots[new]
+            state['size'] = size + num_new
+
+            self._init_row_state(slots[new], state, group)
+
+        return slots
+
+    def _init_row_state(self, slots: torch.Tensor, state: Dict, group: Dict):
+        pass
+
+    def _densify_state(self, p: torch.Tensor, state: Dict, group: Dict):
+        dense = self._init_dense_state(p, group)
+
+        if 'slots' in state:
+            touched = state['slots'] >= 0
+            for name in self.buffers:
+                dense[name][touched] = state[name][state['slots'][touched]]
+
+            del state['slots'], state['size']
+
+        state.update(dense)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+
+                state = self.state[p]
+                if 'step' not in state:
+                    state['step'] = 0
+                state['step'] += 1
+
+                if p.grad.is_sparse:
+                    grad = p.grad.coalesce()
+                    rows, values = grad.indices()[0], grad.values()
+
+                    if group['weight_decay'] != 0:
+                        values = values.add(p[rows], alpha=group['weight_decay'])
+
+                    self._sparse_step(p, rows, values, state, group)
+                else:
+                    if self.buffers[0] not in state or 'slots' in state:
+                        self._densify_state(p, state, group)
+
+                    grad = p.grad
+                    if group['weight_decay'] != 0:
+                        grad = grad.add(p, alpha=group['weight_decay'])
+
+                    self._dense_step(p, grad, state, group)
+
+        return loss
+
+
+class LazyAdam(RowLazyOptimizer):
+    """
+    Adam updating the moments of a sparse-gradient parameter only for the rows in the gradient, like
+    `torch.optim.SparseAdam`, but with row-lazy state and support for dense parameters in the same optimizer.
+    """
+
+    buffers = ['exp_avg', 'exp_avg_sq']
+
+    def __init__(self, params, lr: float = 1e-3, betas=(0.9, 0.999), eps: float = 1e-8, weight_decay: float = 0):
+        super().__init__(params, dict(lr=lr, betas=tuple(betas), eps=eps, weight_decay=weight_decay))
+
+    def _init_dense_state(self, p: torch.Tensor, group: Dict) -> Dict:
+        return {'exp_avg': torch.zeros_like(p), 'exp_avg_sq': torch.zeros_like(p)}
+
+    def _step_size(self, state: Dict, group: Dict) -> float:
+        beta1, beta2 = group['betas']
+
+        return group['lr'] * math.sqrt(1 - beta2 ** state['step']) / (1 - beta1 ** state['step'])
+
+    def _dense_step(self, p: torch.Tensor, grad: torch.Tensor, state: Dict, group: Dict):
+        beta1, beta2 = group['betas']
+
+        state['exp_avg'].mul_(beta1).add_(grad, alpha=1 - beta1)
+        state['exp_avg_sq'].mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+        # eps placed as in torch.optim.Adam
+        bias_correction1 = 1 - beta1 ** state['step']
+        bias_correction2 = 1 - beta2 ** state['step']
+
+        denom = (state['exp_avg_sq'].sqrt() / math.sqrt(bias_correction2)).add_(group['eps'])
+        p.addcdiv_(state['exp_avg'], denom, value=-group['lr'] / bias_correction1)
+
+    def _sparse_step(self, p: torch.Tensor, rows: torch.Tensor, values: torch.Tensor, state: Dict, group: Dict):
+        # eps placed as in torch.optim.SparseAdam
+        beta1, beta2 = group['betas']
+        slots = self._row_slots(p, rows, state, group)
+
+        exp_avg = state['exp_avg'][slots].mul_(beta1).add_(values, alpha=1 - beta1)
+        exp_avg_sq = state['exp_avg_sq'][slots].mul_(beta2).addcmul_(values, values, value=1 - beta2)
+        state['exp_avg'][slots] = exp_avg
+        state['exp_avg_sq'][slots] = exp_avg_sq
+
+        p.index_add_(0, rows, exp_avg.div_(exp_avg_sq.sqrt_().add_(group['eps'])),
+                     alpha=-self._step_size(state, group))
+
+
+class LazyAdagrad(RowLazyOptimizer):
+    """Adagrad accumulating the squared gradients of a sparse-gradient parameter only for the rows touched so far."""
+
+    buffers = ['sum']
+
+    def __init__(self, params, lr: float = 1e-2, lr_decay: float = 0, weight_decay: float = 0,
+                 initial_accumulator_value: float = 0, eps: float = 1e-10):
+        super().__init__(params, dict(lr=lr, lr_decay=lr_decay, weight_decay=weight_decay,
+                                      initial_accumulator_value=initial_accumulator_value, eps=eps))
+
+    def _init_dense_state(self, p: torch.Tensor, group: Dict) -> Dict:
+        return {'sum': torch.full_like(p, group['initial_accumulator_value'])}
+
+    def _init_row_state(self, slots: torch.Tensor, state: Dict, group: Dict):
+        state['sum'][slots] = group['initial_accumulator_value']
+
+    def _lr(self, state: Dict, group: Dict) -> float:
+        return group['lr'] / (1 + (state['step'] - 1) * group['lr_decay'])
+
+    def _dense_step(self, p: torch.Tensor, grad: torch.Tensor, state: Dict, group: Dict):
+        state['sum'].addcmul_(grad, grad, value=1)
+
+        p.addcdiv_(grad, state['sum'].sqrt().add_(group['eps']), value=-self._lr(state, group))
+
+    def _sparse_step(self, p: torch.Tensor, rows: torch.Tensor, values: torch.Tensor, state: Dict, group: Dict):
+        slots = self._row_slots(p, rows, state, group)
+
+        state_sum = state['sum'][slots].addcmul_(values, values, value=1)
+        state['sum'][slots] = state_sum
+
+        p.index_add_(0, rows, values / state_sum.sqrt_().add_(group['eps']), alpha=-self._lr(state, group))
+
+
+def sparse_parameter_names(model: torch.nn.Module) -> List[str]:
+    """Names of the parameters receiving sparse gradients, i.e. of embeddings created with sparse=True."""
+    names = []
+    for module_name, module in model.named_modules():
+        if isinstance(module, (torch.nn.Embedding, torch.nn.EmbeddingBag)) and module.sparse:
+            names.append(f"{module_name}.weight" if module_name else "weight")
+
+    return names
+
+
+def get_optimizer(model: torch.nn.Module, type: str, args: Optional[Dict], groups: Optional[Dict[str, Dict]] = None):
+    """
+    Creates the optimizer `type` for the parameters of `model`.
+
+    args: keyword arguments of the optimizer, e.g. lr
+    groups: parameter groups by name, each with a `regex` matched against the parameter names (see
+        `model.named_parameters()`) and the `args` overriding those of the optimizer for the matched parameters. A
+        parameter belongs to the first matching group, the remaining parameters form the default group.
+
+    If the model has sparse embeddings, Adam and Adagrad are replaced by their row-lazy variants LazyAdam and
+    LazyAdagrad, which handle sparse gradients and keep optimizer state only for the embedding rows touched.
+    """
     optim_dict = {
-        'Adam': torch.optim.Adam,
-        'Adagrad': torch.optim.Adagrad
+        'adam': torch.optim.Adam,
+        'adagrad': torch.optim.Adagrad,
+        'sgd': torch.optim.SGD,
+        'sparseadam': torch.optim.SparseAdam,
+        'lazyadam': LazyAdam,
+        'lazyadagrad': LazyAdagrad
+    }
+
+    lazy_dict = {
+        'adam': LazyAdam,
+        'adagrad': LazyAdagrad
     }
 
     try:
-        optimizer = optim_dict[type](**args)
+        optimizer_class = optim_dict[type.lower()]
     except KeyError:
         raise ConfigurationError(f"Optimizer type {type} specified in config file not supported.")
 
+    if sparse_parameter_names(model):
+        optimizer_class = lazy_dict.get(type.lower(), optimizer_class)
+
+    param_groups = []
+    parameters = dict(model.named_parameters())
+
+    for name, group in (groups or {}).items():
+        try:
+            regex = re.compile(group['regex'])
+        except (KeyError, TypeError, re.error):
+            raise ConfigurationError(f"Optimizer parameter group {name} should specify a valid regex.")
+
+        matched = [p for p_name, p in parameters.items() if regex.fullmatch(p_name)]
+        if not matched:
+            raise ConfigurationError(f"Regex {group['regex']} of optimizer parameter group {name} matches none of "
+                                     f"the parameters {list(parameters.keys())}")
+
+        param_groups.append({'name': name, 'params': matched, **(group.get('args') or {})})
+        parameters = {p_name: p for p_name, p in parameters.items() if not regex.fullmatch(p_name)}
+
+    if parameters:
+        param_groups.append({'name': 'default', 'params': list(parameters.values())})
+
+    try:
+        optimizer = optimizer_class(param_groups, **(args or {}))
+    except TypeError as e:
+        raise ConfigurationError(f"Invalid arguments for optimizer {optimizer_class.__name__}: {e}")
+
     return optimizer
 
 
-def get_scheduler(optimizer: torch.optim.optimizer.Optimizer, type: str, args: Optional[Dict]):
+def get_scheduler(optimizer: torch.optim.Optimizer, type: str, args: Optional[Dict]):
     scheduler_dict = {
         'MultiStepLR': torch.optim.lr_scheduler.MultiStepLR,
         'StepLR': torch.optim.lr_scheduler.StepLR,
@@ -1,13 +1,76 @@
-from typing import Tuple
+from dataclasses import dataclass
+from typing import List, NamedTuple, Tuple, Union
 
 import torch
 from torch import nn
+from torch.nn import functional as F
 
 from tkge.common.config import Config
+from tkge.common.error import ConfigurationError
 from tkge.common.registry import Registrable
 
 
+class RowSubset(NamedTuple):
+    """
+    Factor of a regularizer: the embedding table `weight` together with the `rows` of it used by a batch.
+
+    Inplace regularizers with `row_subset` enabled only renormalize / clamp these rows, Lambda3Reg in batch mode only
+    penalizes the neighbours of these rows, all others regularize the whole table. `sparse` tells whether the table
+    belongs to an embedding with sparse gradients, such that penalties on a few rows keep the gradient sparse.
+    """
+    weight: torch.Tensor
+    rows: torch.Tensor
+    sparse: bool = False
+
+
+def merge_row_subsets(factors: List[Tuple[Union[torch.Tensor, RowSubset], ...]]) -> Tuple:
+    """Merges the factors of an inplace regularizer reported for several sub-batches into the factors of the batch."""
+    merged = []
+    for subbatch_factors in zip(*factors):
+        if isinstance(subbatch_factors[-1], RowSubset):
+            rows = torch.cat([f.rows for f in subbatch_factors])
+            merged.append(RowSubset(subbatch_factors[-1].weight, rows))
+        else:
+            merged.append(subbatch_factors[-1])
+
+    return tuple(merged)
+
+
+@dataclass(frozen=True)
+class RegularizerOptions:
+    """Options of a penalty under train.regularizer.<name>."""
+    type: str
+    weight: float
+
+
+@dataclass(frozen=True)
+class Lambda3Options(RegularizerOptions):
+    mode: str
+    every: int
+
+
+@dataclass(frozen=True)
+class InplaceRenormOptions:
+    """Options of an inplace regularizer under train.inplace_regularizer.<name>."""
+    type: str
+    p: float
+    dim: int
+    maxnorm: float
+    row_subset: bool
+
+
+@dataclass(frozen=True)
+class InplaceClampOptions:
+    type: str
+    min: float
+    max: float
+    row_subset: bool
+
+
 class Regularizer(nn.Module, Registrable):
+    # how a penalty on the factors of a batch combines the ones of its samples, see Loss.reduction
+    reduction = "mean"
+
     def __init__(self, config: Config, name: str):
         Registrable.__init__(self, config)
         nn.Module.__init__(self)
@@ -18,6 +81,10 @@ class Regularizer(nn.Module, Registrable):
     def forward(self, factors: Tuple[torch.Tensor], **kwargs):
         raise NotImplementedError
 
+    def step(self):
+        """Called by the trainer after every optimizer step, however many sub-batches the step was computed on."""
+        pass
+
     @staticmethod
     def create(config: Config, name: str):
         reg_type = config.get(f"train.regularizer.{name}.type")
@@ -47,6 +114,17 @@ class InplaceRegularizer(Regularizer):
             )
 
 
+def penalty_reduction(regularizer: Regularizer, factors: Tuple[Union[torch.Tensor, RowSubset], ...]) -> str:
+    """
+    The reduction of the penalty of `regularizer` on `factors`. A penalty on whole parameter tables does not depend
+    on the samples of the batch and is thus weighted like a "mean" one.
+    """
+    if all(isinstance(f.weight if isinstance(f, RowSubset) else f, nn.Parameter) for f in factors):
+        return "mean"
+
+    return regularizer.reduction
+
+
 # @Regularizer.register(name="lp_regularize")
 # class LpRegularizer(Regularizer):
 #     def __init__(self, config, name):
@@ -89,9 +167,12 @@ class N3Reg(Regularizer):
         super().__init__(config, name)
 
         # TODO(gengyuan) add attribute automatically
-        self.weight = self.config.get(f"train.regularizer.{name}.weight")
+        self.weight = self.config.snapshot(f"train.regularizer.{name}", RegularizerOptions).weight
+
+    def forward(self, factors: Tuple[Union[torch.Tensor, RowSubset]], **kwargs):
+        # penalties regularize the whole table of a RowSubset
+        factors = [f.weight if isinstance(f, RowSubset) else f for f in factors]
 
-    def forward(self, factors: Tuple[torch.Tensor], **kwargs):
         norm = 0.
         for f in factors:
             norm += self.weight * torch.sum(torch.abs(f) ** 3)
@@ -105,9 +186,11 @@ class F2Reg(Regularizer):
     def __init__(self, config: Config, name: str):
         super().__init__(config, name)
 
-        self.weight = self.config.get(f"train.regularizer.{name}.weight")
+        self.weight = self.config.snapshot(f"train.regularizer.{name}", RegularizerOptions).weight
+
+    def forward(self, factors: Tuple[Union[torch.Tensor, RowSubset]], **kwargs):
+        factors = [f.weight if isinstance(f, RowSubset) else f for f in factors]
 
-    def forward(self, factors: Tuple[torch.Tensor], **kwargs):
         norm = 0
         for f in factors:
             norm += self.weight * torch.sum(f ** 2)
@@ -119,32 +202,85 @@ class Lambda3Reg(Regularizer):
     def __init__(self, config: Config, name: str):
         super().__init__(config, name)
 
-        self.weight = self.config.get(f"train.regularizer.{name}.weight")
+        options = self.config.snapshot(f"train.regularizer.{name}", Lambda3Options)
+        self.weight = options.weight
+
+        # full: all consecutive timestamps every step
+        # batch: only the timestamps of the batch and their successors
+        # periodic: all consecutive timestamps every `every` optimizer steps, weighted by `every`
+        self.mode = options.mode
+        self.every = options.every
+        # optimizer steps taken so far, saved in checkpoints as the extra state of the module
+        self.steps = 0
+
+        if self.mode not in ["full", "batch", "periodic"]:
+            raise ConfigurationError(f"Mode {self.mode} of regularizer {name} should be full, batch or periodic")
 
         # TODO(gengyuan): check whether all needed parameters are defined in config file; if not, print logging and load the default number
         # at the moment, throw errors
 
-    def forward(self, factors: Tuple[torch.Tensor], **kwargs):
+    @staticmethod
+    def _smoothness(ddiff: torch.Tensor) -> torch.Tensor:
+        rank = int(ddiff.shape[-1] / 2)
+
+        return torch.sqrt(ddiff[..., :rank] ** 2 + ddiff[..., rank:] ** 2) ** 3
+
+    def step(self):
+        self.steps += 1
+
+    def get_extra_state(self):
+        return {'steps': self.steps}
+
+    def set_extra_state(self, state):
+        self.steps = state['steps']
+
+    def forward(self, factors: Tuple[Union[torch.Tensor, RowSubset]], **kwargs):
+        # all sub-batches of every `every`-th step are penalized
+        if self.mode == "periodic" and (self.steps + 1) % self.every != 0:
+            return 0.
+
         reg_loss = 0.
 
         for factor in factors:
+            if isinstance(factor, RowSubset) and self.mode == "batch":
+                # the mean over the pairs (t, t + 1) of the batch's timestamps estimates the mean over all pairs
+                times = factor.rows.unique()
+                times = times[times < factor.weight.size(0) - 1]
+                if times.numel() == 0:
+                    continue
+
+                pairs = F.embedding(torch.stack([times, times + 1]), factor.weight, sparse=factor.sparse)
+                diff = self._smoothness(pairs[1] - pairs[0])
+
+                reg_loss += self.weight * torch.sum(diff) / times.numel()
+                continue
+
+            factor = factor.weight if isinstance(factor, RowSubset) else factor
+
             ddiff = factor[1:] - factor[:-1]
-            rank = int(ddiff.shape[1] / 2)
-            diff = torch.sqrt(ddiff[:, :rank] ** 2 + ddiff[:, rank:] ** 2) ** 3
+            diff = self._smoothness(ddiff)
 
             reg_loss += self.weight * torch.sum(diff) / (factor.shape[0] - 1)
 
+        if self.mode == "periodic":
+            reg_loss *= self.every
+
         return reg_loss
 
 
 @Regularizer.register(name="norm_regularize")
 class NormReg(Regularizer):
+    # sums over the rows of the factors
+    reduction = "sum"
+
     def __init__(self, config: Config, name: str):
         super().__init__(config, name)
 
-        self.weight = self.config.get(f"train.regularizer.{name}.weight")
+        self.weight = self.config.snapshot(f"train.regularizer.{name}", RegularizerOptions).weight
+
+    def forward(self, factors: Tuple[Union[torch.Tensor, RowSubset]], **kwargs):
+        factors = [f.weight if isinstance(f, RowSubset) else f for f in factors]
 
-    def forward(self, factors: Tuple[torch.Tensor], **kwargs):
         device = factors[0].device
         reg_loss = 0.
 
@@ -161,12 +297,24 @@ class InplaceRenormReg(Regularizer):
     def __init__(self, config: Config, name: str):
         super().__init__(config, name)
 
-        self.p = self.config.get(f"train.inplace_regularizer.{name}.p")
-        self.dim = self.config.get(f"train.inplace_regularizer.{name}.dim")
-        self.maxnorm = self.config.get(f"train.inplace_regularizer.{name}.maxnorm")
+        options = self.config.snapshot(f"train.inplace_regularizer.{name}", InplaceRenormOptions)
+        self.p = options.p
+        self.dim = options.dim
+        self.maxnorm = options.maxnorm
 
-    def forward(self, factors: Tuple[torch.Tensor], **kwargs):
+        self.row_subset = options.row_subset
+        if self.row_subset and self.dim != 0:
+            raise ConfigurationError(f"Inplace regularizer {name} can only renormalize a subset of rows with dim: 0")
+
+    def forward(self, factors: Tuple[Union[torch.Tensor, RowSubset]], **kwargs):
         for f in factors:
+            if isinstance(f, RowSubset) and self.row_subset:
+                # renormalizing along dim 0 treats every row separately
+                weight, rows = f.weight.data, f.rows.unique()
+                weight.index_copy_(0, rows, weight.index_select(0, rows).renorm_(p=self.p, dim=0, maxnorm=self.maxnorm))
+                continue
+
+            f = f.weight if isinstance(f, RowSubset) else f
             f.data.renorm_(p=self.p, dim=self.dim, maxnorm=self.maxnorm)
 
 
@@ -175,11 +323,20 @@ class InplaceClampReg(Regularizer):
     def __init__(self, config: Config, name: str):
         super().__init__(config, name)
 
-        self.min = self.config.get(f"train.inplace_regularizer.{name}.min")
-        self.max = self.config.get(f"train.inplace_regularizer.{name}.max")
+        options = self.config.snapshot(f"train.inplace_regularizer.{name}", InplaceClampOptions)
+        self.min = options.min
+        self.max = options.max
 
-    def forward(self, factors: Tuple[torch.Tensor], **kwargs):
+        self.row_subset = options.row_subset
+
+    def forward(self, factors: Tuple[Union[torch.Tensor, RowSubset]], **kwargs):
         for f in factors:
+            if isinstance(f, RowSubset) and self.row_subset:
+                weight, rows = f.weight.data, f.rows.unique()
+                weight.index_copy_(0, rows, weight.index_select(0, rows).clamp_(max=self.max, min=self.min))
+                continue
+
+            f = f.weight if isinstance(f, RowSubset) else f
             f.data.clamp_(max=self.max, min=self.min)
 
 
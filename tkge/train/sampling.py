@@ -1,15 +1,23 @@
 import logging
-from typing import Optional
+import sys
+from typing import Any, Dict, Optional
+from collections import OrderedDict
 
 from tkge.common.configurable import Configurable
 from tkge.common.registry import Registrable
 from tkge.common.config import Config
 from tkge.common.error import ConfigurationError
 from tkge.data.dataset import DatasetProcessor
-from tkge.indexing import where_in
+from tkge.data.batch import Batch
+from tkge.indexing import where_in, index_bernoulli_probabilities
+from tkge.common.jit import lazy_njit
 
 import torch
-import numba
+import numpy as np
+
+# bytes a query takes in a NSCaching map besides its key, i.e. its dict and linked list entries (about 70 to 140
+# bytes, depending on how full the dict is) and its row index
+_QUERY_OVERHEAD = 160
 
 SLOTS = [0, 1, 2, 3]
 SLOT_STR = ["s", "p", "o", "t"]
@@ -17,6 +25,11 @@ S, P, O, T = SLOTS
 
 
 class NegativeSampler(Registrable):
+    # samplers scoring their candidates with the model being trained cannot run in DataLoader workers
+    requires_model = False
+    # samplers drawing inside numba functions use numba's PRNG, which loader workers then seed as well
+    uses_numba = False
+
     def __init__(self, config: Config, dataset: DatasetProcessor, as_matrix: bool = True):
         super(NegativeSampler, self).__init__(config, configuration_key="negative_sampling")
 
@@ -25,6 +38,7 @@ class NegativeSampler(Registrable):
         self.as_matrix = as_matrix
 
         self.dataset = dataset
+        self.model = None
 
     @staticmethod
     def create(config: Config, dataset: DatasetProcessor):
@@ -42,16 +56,29 @@ class NegativeSampler(Registrable):
                 f"implement your negative samping class with `NegativeSampler.register(name)"
             )
 
-    def _sample(self, pos_batch: torch.Tensor, as_matrix: bool, sample_target: str):
+    def set_model(self, model: torch.nn.Module):
+        """
+        Hands over the model being trained. Only samplers scoring their candidates with the model make use of it.
+        """
+        self.model = model
+
+    def state_dict(self) -> Dict[str, Any]:
+        """State of the sampler carried over from one batch to the next, saved in checkpoints."""
+        return {}
+
+    def load_state_dict(self, state: Dict[str, Any]):
+        pass
+
+    def _sample(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
         raise NotImplementedError
 
-    def _label(self, pos_batch: torch.Tensor, as_matrix: bool, sample_target: str):
+    def _label(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
         raise NotImplementedError
 
     def _filtered_sample(self, neg_sample):
         raise NotImplementedError
 
-    def sample(self, pos_batch: torch.Tensor, sample_target: str = "both"):
+    def sample(self, pos_batch: Batch, sample_target: str = "both"):
         assert sample_target in ["head", "tail", "both"], f"sample_target should be in head, tail, both"
 
         neg_samples = self._sample(pos_batch, self.as_matrix, sample_target)
@@ -76,16 +103,16 @@ class PseudoNegativeSampling(NegativeSampler):
     def __init__(self, config: Config, dataset: DatasetProcessor, as_matrix: bool):
         super().__init__(config, dataset, as_matrix)
 
-    def _sample(self, pos_batch: torch.Tensor, as_matrix: bool, sample_target: str):
+    def _sample(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
         return pos_batch
 
-    def _label(self, pos_batch: torch.Tensor, as_matrix: bool, sample_target: str):
+    def _label(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
         if sample_target == "head":
-            return pos_batch[:, 0]
+            return pos_batch.ids[:, 0]
         elif sample_target == "tail":
-            return pos_batch[:, 2]
+            return pos_batch.ids[:, 2]
         else:
-            return torch.cat((pos_batch[:, 0], pos_batch[:, 2]), 0)
+            return torch.cat((pos_batch.ids[:, 0], pos_batch.ids[:, 2]), 0)
 
     def _filtered_sample(self, neg_sample):
         raise NotImplementedError
@@ -100,46 +127,45 @@ class NonNegativeSampler(NegativeSampler):
     def __init__(self, config: Config, dataset: DatasetProcessor, as_matrix: bool):
         super().__init__(config, dataset, as_matrix)
 
-    def _sample(self, pos_batch, as_matrix, sample_target):
+    def _sample(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
         batch_size = pos_batch.size(0)
-        dim_size = pos_batch.size(1)
 
         vocab_size = self.dataset.num_entities()
 
-        samples = pos_batch.repeat((1, vocab_size)).view(-1, dim_size)
+        samples = pos_batch.repeat_interleave(vocab_size)
 
         if sample_target == "tail":
-            samples[:, 2] = torch.arange(vocab_size).repeat(batch_size)
+            samples.ids[:, 2] = torch.arange(vocab_size).repeat(batch_size)
         elif sample_target == "head":
-            samples[:, 0] = torch.arange(vocab_size).repeat(batch_size)
+            samples.ids[:, 0] = torch.arange(vocab_size).repeat(batch_size)
         else:
             samples_h = samples
             samples_t = samples.clone()
 
-            samples_h[:, 0] = torch.arange(vocab_size).repeat(batch_size)
-            samples_t[:, 2] = torch.arange(vocab_size).repeat(batch_size)
+            samples_h.ids[:, 0] = torch.arange(vocab_size).repeat(batch_size)
+            samples_t.ids[:, 2] = torch.arange(vocab_size).repeat(batch_size)
 
-            samples = torch.cat((samples_h, samples_t), dim=0)
+            samples = Batch.cat((samples_h, samples_t))
 
         if as_matrix:
-            samples = samples.view(-1, dim_size * vocab_size)
+            samples = samples.as_matrix(vocab_size)
 
         return samples
 
-    def _label(self, pos_batch, as_matrix, sample_target):
+    def _label(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
         batch_size = pos_batch.size(0)
         vocab_size = self.dataset.num_entities()
 
         labels = torch.zeros((batch_size, vocab_size))
 
         if sample_target == "tail":
-            labels[range(batch_size), pos_batch[:, 2].long()] = 1.
+            labels[range(batch_size), pos_batch.ids[:, 2]] = 1.
         elif sample_target == "head":
-            labels[range(batch_size), pos_batch[:, 0].long()] = 1.
+            labels[range(batch_size), pos_batch.ids[:, 0]] = 1.
         else:
             labels = labels.repeat((2, 1))
-            labels[:range(batch_size), pos_batch[:, 0].long()] = 1.
-            labels[range(batch_size):, pos_batch[:, 2].long()] = 1.
+            labels[range(batch_size), pos_batch.ids[:, 0]] = 1.
+            labels[range(batch_size, 2 * batch_size), pos_batch.ids[:, 2]] = 1.
 
         if not as_matrix:
             labels = labels.view(-1)
@@ -155,74 +181,62 @@ class BasicNegativeSampler(NegativeSampler):
     def __init__(self, config: Config, dataset: DatasetProcessor, as_matrix: bool):
         super().__init__(config, dataset, as_matrix)
 
-    def _sample(self, pos_batch: torch.Tensor, as_matrix: bool, sample_target: str) -> torch.Tensor:
+    def _sample(self, pos_batch: Batch, as_matrix: bool, sample_target: str) -> Batch:
         # TODO 可不可以用generator 参考torch.RandomSampler
         """
         Sampling method in basic time-agnostic sampler.
 
         Args:
             pos_batch: positive batch to be corrupted which should be batch_size * [head, rel, tail, ...(temporal)]
-            as_matrix: returned tensor will be reshaped as matrix if set True, otherwise all samples will be flatted as sample_size * dims
+            as_matrix: returned batch will be shaped as batch_size * (1 + num_samples) if set True, otherwise all samples will be flatted as sample_size
             sample_target: the target that the sampling applies on. Chosen from ['head', 'tail', 'both']
         """
 
-        batch_size, dim_size = list(pos_batch.size())
-
         num_pos_neg = 1 + self.num_samples
 
         if sample_target == 'head':
-            pos_neg_samples_h = pos_batch.repeat((1, num_pos_neg)).view(-1, dim_size)
+            pos_neg_samples_h = pos_batch.repeat_interleave(num_pos_neg)
             rand_nums_h = torch.randint(low=0, high=self.dataset.num_entities() - 1,
-                                        size=(pos_neg_samples_h.shape[0], 1)).float()
+                                        size=(len(pos_neg_samples_h),))
 
-            # for i in range(pos_neg_samples_h.shape[0] // num_pos_neg):
-            #     rand_nums_h[i * num_pos_neg] = 0
-
-            rand_nums_h[range(0, pos_neg_samples_h.shape[0], num_pos_neg)] = 0
-            pos_neg_samples_h[:, 0] = (pos_neg_samples_h[:, 0] + rand_nums_h.squeeze()) % self.dataset.num_entities()
+            rand_nums_h[range(0, len(pos_neg_samples_h), num_pos_neg)] = 0
+            pos_neg_samples_h.ids[:, 0] = (pos_neg_samples_h.ids[:, 0] + rand_nums_h) % self.dataset.num_entities()
 
             samples = pos_neg_samples_h
 
         elif sample_target == 'tail':
-            pos_neg_samples_t = pos_batch.repeat((1, num_pos_neg)).view(-1, dim_size)
+            pos_neg_samples_t = pos_batch.repeat_interleave(num_pos_neg)
             rand_nums_t = torch.randint(low=0, high=self.dataset.num_entities() - 1,
-                                        size=(pos_neg_samples_t.shape[0], 1)).float()
-
-            # for i in range(pos_neg_samples_t.shape[0] // num_pos_neg):
-            #     rand_nums_t[i * num_pos_neg] = 0
+                                        size=(len(pos_neg_samples_t),))
 
-            rand_nums_t[range(0, pos_neg_samples_t.shape[0], num_pos_neg)] = 0
-            pos_neg_samples_t[:, 2] = (pos_neg_samples_t[:, 2] + rand_nums_t.squeeze()) % self.dataset.num_entities()
+            rand_nums_t[range(0, len(pos_neg_samples_t), num_pos_neg)] = 0
+            pos_neg_samples_t.ids[:, 2] = (pos_neg_samples_t.ids[:, 2] + rand_nums_t) % self.dataset.num_entities()
 
             samples = pos_neg_samples_t
 
         else:
-            pos_batch = pos_batch
-            pos_neg_samples_h = pos_batch.repeat((1, num_pos_neg)).view(-1, dim_size)
+            pos_neg_samples_h = pos_batch.repeat_interleave(num_pos_neg)
             pos_neg_samples_t = pos_neg_samples_h.clone()
 
             rand_nums_h = torch.randint(low=0, high=self.dataset.num_entities() - 1,
-                                        size=(pos_neg_samples_h.shape[0], 1)).float()
+                                        size=(len(pos_neg_samples_h),))
             rand_nums_t = torch.randint(low=0, high=self.dataset.num_entities() - 1,
-                                        size=(pos_neg_samples_t.shape[0], 1)).float()
+                                        size=(len(pos_neg_samples_t),))
 
-            # for i in range(pos_neg_samples_h.shape[0] // num_pos_neg):
-            #     rand_nums_h[i * num_pos_neg] = 0
-            #     rand_nums_t[i * num_pos_neg] = 0
-            rand_nums_h[range(0, pos_neg_samples_h.shape[0], num_pos_neg)] = 0
-            rand_nums_t[range(0, pos_neg_samples_t.shape[0], num_pos_neg)] = 0
+            rand_nums_h[range(0, len(pos_neg_samples_h), num_pos_neg)] = 0
+            rand_nums_t[range(0, len(pos_neg_samples_t), num_pos_neg)] = 0
 
-            pos_neg_samples_h[:, 0] = (pos_neg_samples_h[:, 0] + rand_nums_h.squeeze()) % self.dataset.num_entities()
-            pos_neg_samples_t[:, 2] = (pos_neg_samples_t[:, 2] + rand_nums_t.squeeze()) % self.dataset.num_entities()
+            pos_neg_samples_h.ids[:, 0] = (pos_neg_samples_h.ids[:, 0] + rand_nums_h) % self.dataset.num_entities()
+            pos_neg_samples_t.ids[:, 2] = (pos_neg_samples_t.ids[:, 2] + rand_nums_t) % self.dataset.num_entities()
 
-            samples = torch.cat((pos_neg_samples_h, pos_neg_samples_t), dim=0)
+            samples = Batch.cat((pos_neg_samples_h, pos_neg_samples_t))
 
         if as_matrix:
-            samples = samples.view(-1, dim_size * (self.num_samples + 1))
+            samples = samples.as_matrix(num_pos_neg)
 
         return samples
 
-    def _label(self, pos_batch: torch.Tensor, as_matrix: bool, sample_target: str):
+    def _label(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
         batch_size = pos_batch.size(0)
 
         labels = torch.cat((torch.ones(batch_size, 1), torch.zeros(batch_size, self.num_samples)), dim=1)
@@ -239,28 +253,233 @@ class BasicNegativeSampler(NegativeSampler):
         raise NotImplementedError
 
 
+@NegativeSampler.register(name="bernoulli")
+class BernoulliNegativeSampler(BasicNegativeSampler):
+    """
+    Corrupts either the head or the tail of every positive, chosen per positive with the relation-specific
+    probability tph / (tph + hpt) of Wang et al., "Knowledge Graph Embedding by Translating on Hyperplanes", AAAI14.
+
+    The probabilities are computed once from the training triples and cached with the dataset, so the sample_target
+    passed in by the trainer is ignored and every positive yields a single row of negatives.
+    """
+
+    def __init__(self, config: Config, dataset: DatasetProcessor, as_matrix: bool):
+        super().__init__(config, dataset, as_matrix)
+
+        self.head_probabilities = index_bernoulli_probabilities(dataset)
+
+    def _sample(self, pos_batch: Batch, as_matrix: bool, sample_target: str) -> Batch:
+        num_pos_neg = 1 + self.num_samples
+
+        corrupt_head = torch.rand(len(pos_batch)) < self.head_probabilities[pos_batch.ids[:, 1]]
+        corrupt_head = corrupt_head.repeat_interleave(num_pos_neg)
+
+        samples = pos_batch.repeat_interleave(num_pos_neg)
+        rand_nums = torch.randint(low=0, high=self.dataset.num_entities() - 1, size=(len(samples),))
+        rand_nums[range(0, len(samples), num_pos_neg)] = 0
+
+        samples.ids[:, 0] = torch.where(corrupt_head, (samples.ids[:, 0] + rand_nums) % self.dataset.num_entities(),
+                                        samples.ids[:, 0])
+        samples.ids[:, 2] = torch.where(corrupt_head, samples.ids[:, 2],
+                                        (samples.ids[:, 2] + rand_nums) % self.dataset.num_entities())
+
+        if as_matrix:
+            samples = samples.as_matrix(num_pos_neg)
+
+        return samples
+
+    def _label(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
+        return super()._label(pos_batch, as_matrix, 'tail')
+
+
+@NegativeSampler.register(name="nscaching")
+class NSCachingNegativeSampler(BasicNegativeSampler):
+    """
+    Hard negative sampler following NSCaching (Zhang et al., "NSCaching: Simple and Efficient Negative Sampling for
+    Knowledge Graph Embedding", ICDE19).
+
+    For every query, i.e. a positive with its corrupted slot left out ((s, p, t) for tail and (p, o, t) for head
+    corruption), a bounded cache of high-scoring negative entities is kept. A cache is refreshed lazily whenever its
+    query shows up in a batch by scoring the cached entities together with a small pool of uniformly drawn candidates
+    and keeping the best ones. The negatives of each positive are a mix of cached and uniform candidates.
+
+    The caches of a target are the rows of one int32 table, allocated on the first refresh and sized such that the
+    table and the map from the queries to their rows stay within the memory budget, which is split evenly between
+    the head and the tail caches if both are in use. Once the table is full, a new query takes over the row of the
+    least recently used one.
+    """
+
+    requires_model = True
+
+    def __init__(self, config: Config, dataset: DatasetProcessor, as_matrix: bool):
+        super().__init__(config, dataset, as_matrix)
+
+        self.cache_size = self.config.get("negative_sampling.nscaching.cache_size")
+        self.candidate_size = self.config.get("negative_sampling.nscaching.candidate_size")
+        self.cache_ratio = self.config.get("negative_sampling.nscaching.cache_ratio")
+        self.memory_budget = self.config.get("negative_sampling.nscaching.memory_budget")
+
+        target = self.config.get("negative_sampling.target")
+        self.targets = ['head', 'tail'] if target == 'both' else [target]
+        self.descending = self.config.get("eval.ordering") == "descending"
+        self.device = self.config.get("task.device")
+
+        # the queries of a target map to their row of its table, from the least to the most recently used
+        self.cache = {'head': OrderedDict(), 'tail': OrderedDict()}
+        self.negatives = {'head': None, 'tail': None}
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {target: {'queries': list(cache.keys()),
+                         'negatives': self.negatives[target][list(cache.values())] if cache else
+                         torch.empty((0, self.cache_size), dtype=torch.int32)}
+                for target, cache in self.cache.items()}
+
+    def load_state_dict(self, state: Dict[str, Any]):
+        for target, cache in self.cache.items():
+            cache.clear()
+            self.negatives[target] = None
+
+            queries, negatives = state[target]['queries'], state[target]['negatives']
+            if not queries:
+                continue
+
+            # with a smaller budget, only the most recently used queries are kept
+            table = self._table(target, queries[0])
+            queries, negatives = queries[-len(table):], negatives[-len(table):]
+
+            table[:len(queries)] = negatives
+            cache.update(zip(queries, range(len(queries))))
+
+    def _table(self, target: str, key: bytes) -> torch.Tensor:
+        """
+        Returns the table of the target, allocating it for queries like `key` if needed.
+        """
+        if self.negatives[target] is None:
+            # a query costs its negatives, its key and its entry in the map, estimated by _QUERY_OVERHEAD
+            query_bytes = 4 * self.cache_size + sys.getsizeof(key) + _QUERY_OVERHEAD
+            max_queries = int(self.memory_budget * 2 ** 20) // len(self.targets) // query_bytes
+
+            self.negatives[target] = torch.empty((max(1, max_queries), self.cache_size), dtype=torch.int32)
+
+        return self.negatives[target]
+
+    def _sample(self, pos_batch: Batch, as_matrix: bool, sample_target: str) -> Batch:
+        assert self.model is not None, "NSCaching scores its candidates with the model; call set_model() first"
+
+        if sample_target == 'head':
+            samples = self._corrupt(pos_batch, 'head')
+        elif sample_target == 'tail':
+            samples = self._corrupt(pos_batch, 'tail')
+        else:
+            samples = Batch.cat((self._corrupt(pos_batch, 'head'), self._corrupt(pos_batch, 'tail')))
+
+        if as_matrix:
+            samples = samples.as_matrix(self.num_samples + 1)
+
+        return samples
+
+    def _corrupt(self, pos_batch: Batch, target: str) -> Batch:
+        batch_size = len(pos_batch)
+        slot = 0 if target == 'head' else 2
+
+        num_cached = int(round(self.num_samples * self.cache_ratio))
+        num_uniform = self.num_samples - num_cached
+
+        cached = self._refresh(pos_batch, target)
+        cached = cached.gather(1, torch.randint(self.cache_size, (batch_size, num_cached)))
+        uniform = torch.randint(self.dataset.num_entities(), (batch_size, num_uniform))
+
+        entities = torch.cat((pos_batch.ids[:, slot:slot + 1], cached, uniform), dim=1)
+
+        samples = pos_batch.repeat_interleave(1 + self.num_samples)
+        samples.ids[:, slot] = entities.view(-1)
+
+        return samples
+
+    def _refresh(self, pos_batch: Batch, target: str) -> torch.Tensor:
+        """
+        Refreshes the caches of all queries in the batch and returns them as a batch_size * cache_size tensor.
+        """
+        slot = 0 if target == 'head' else 2
+        cache = self.cache[target]
+
+        # a query is keyed by the raw bytes of its ids and timestamps, which are more compact than a tuple
+        key_cols = [c for c in range(pos_batch.ids.size(1)) if c != slot]
+        keys = [i.tobytes() + t.tobytes() for i, t in zip(pos_batch.ids[:, key_cols].numpy(), pos_batch.times.numpy())]
+        table = self._table(target, keys[0])
+
+        # each distinct query is refreshed once per batch
+        first_row = OrderedDict()
+        for i, key in enumerate(keys):
+            first_row.setdefault(key, i)
+        queries = list(first_row.keys())
+
+        pool_size = self.cache_size + self.candidate_size
+        candidates = torch.randint(self.dataset.num_entities(), (len(queries), pool_size))
+        for i, key in enumerate(queries):
+            if key in cache:
+                candidates[i, :self.cache_size] = table[cache[key]]
+
+        samples = pos_batch[list(first_row.values())].repeat_interleave(pool_size)
+        samples.ids[:, slot] = candidates.view(-1)
+
+        scores = self._score(samples).view(len(queries), pool_size)
+        best = scores.topk(self.cache_size, dim=1, largest=self.descending)[1]
+        refreshed = candidates.gather(1, best)
+
+        # the query refreshed last wins a row taken over within the batch
+        rows = dict()
+        for i, key in enumerate(queries):
+            if key in cache:
+                cache.move_to_end(key)
+            elif len(cache) < len(table):
+                cache[key] = len(cache)
+            else:
+                _, cache[key] = cache.popitem(last=False)
+
+            rows[cache[key]] = i
+
+        table[list(rows.keys())] = refreshed[list(rows.values())].int()
+
+        query_index = {key: i for i, key in enumerate(queries)}
+        return refreshed[[query_index[key] for key in keys]]
+
+    def _score(self, samples: Batch) -> torch.Tensor:
+        training = self.model.training
+        self.model.eval()
+
+        with torch.no_grad():
+            samples = samples.to(self.device)
+            scores, _ = self.model.forward(samples)
+
+            # models scoring against all entities return one row per sample
+            if scores.dim() == 2:
+                scores = scores.gather(1, samples.ids[:, 2].unsqueeze(1))
+
+        self.model.train(training)
+
+        return scores.view(-1).cpu()
+
+
 @NegativeSampler.register(name="atise_time")
 class AtiseTimeNegativeSampler(NegativeSampler):
     def __init__(self, config: Config, dataset: DatasetProcessor, as_matrix: bool):
         super().__init__(config, dataset, as_matrix)
 
-    def _sample(self, pos_batch: torch.Tensor, as_matrix: bool, sample_target: str):
-        batch_size, dim = list(pos_batch.size())
+    def _sample(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
+        batch_size = len(pos_batch)
 
-        samples = pos_batch.clone()
+        samples = Batch.cat([pos_batch] * self.num_samples)
 
-        for i in range(self.num_samples):
-            samples = torch.cat((samples, pos_batch), 0)
-
-        samples[:, 3] = torch.randint(self.dataset.num_timestamps(), (batch_size * self.num_samples))
+        samples.ids[:, 3] = torch.randint(self.dataset.num_timestamps(), (batch_size * self.num_samples,))
 
         if as_matrix:
             raise NotImplementedError
 
-        return torch.cat((pos_batch, samples), 0)
+        return Batch.cat((pos_batch, samples))
 
-    def _label(self, pos_batch: torch.Tensor, as_matrix: bool, sample_target: str):
-        batch_size, dim = list(pos_batch.size())
+    def _label(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
+        batch_size = len(pos_batch)
 
         ones = torch.ones((batch_size, 1))
         zeros = torch.zeros((batch_size * self.num_samples, 1))
@@ -273,10 +492,10 @@ class SelfAdversarialNegativeSampler(NegativeSampler):
     def __init__(self, config: Config, dataset: DatasetProcessor, as_matrix: bool):
         super().__init__(config, dataset, as_matrix)
 
-    def _sample(self, pos_batch: torch.Tensor, as_matrix: bool, sample_target: str):
+    def _sample(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
         raise NotImplementedError
 
-    def _label(self, pos_batch: torch.Tensor, as_matrix: bool, sample_target: str):
+    def _label(self, pos_batch: Batch, as_matrix: bool, sample_target: str):
         raise NotImplementedError
 
 
@@ -452,6 +671,8 @@ class UniformNegativeSampler(DepNegativeSampler):
         # numba lists 2. Using a python list and convert it to an np.array and use
         # offsets 3. Growing a np.array with np.append 4. leaving the loop in python and
         # calling a numba function within the loop
+        import numba
+
         positives_index = numba.typed.Dict()
         for i in range(batch_size):
             pair = (pairs[i][0], pairs[i][1])
@@ -462,7 +683,7 @@ class UniformNegativeSampler(DepNegativeSampler):
         )
         return torch.tensor(negative_samples, dtype=torch.int64)
 
-    @numba.njit
+    @lazy_njit(calls=[where_in])
     def _filter_and_resample_numba(negative_samples, pairs, positives_index, batch_size, voc_size):
         for i in range(batch_size):
             positives = positives_index[(pairs[i][0], pairs[i][1])]
@@ -0,0 +1,64 @@
+import torch
+
+from typing import Dict, List
+
+
+class LossStatistics:
+    """
+    Accumulates the loss terms of training steps on their device.
+
+    Every step adds its batch-mean terms, e.g. the total loss, the data loss and the penalty of each regularizer, as
+    0-dim tensors without synchronizing with the device. Only `summary` copies the sums back to the host, so it
+    should be called at logging intervals, not per step.
+
+    The sums are kept weighted by batch size (for per-sample means) and unweighted (for per-batch means), as the
+    batches of an epoch differ in size, e.g. the last one.
+    """
+
+    def __init__(self, names: List[str], device: str = "cpu"):
+        self.names = names
+
+        # [0]: sums weighted by batch size, [1]: unweighted sums
+        self.sums = torch.zeros(2, len(names), dtype=torch.float64, device=device)
+        self.num_samples = 0
+        self.num_batches = 0
+
+    def add(self, terms: Dict[str, torch.Tensor], batch_size: int):
+        """Adds the batch-mean loss terms of a step. Terms missing in `terms` count as 0."""
+        zero = self.sums.new_zeros(())
+        values = torch.stack([torch.as_tensor(terms.get(name, zero), device=self.sums.device).detach().double()
+                              for name in self.names])
+
+        self.sums += torch.stack([values * batch_size, values])
+        self.num_samples += batch_size
+        self.num_batches += 1
+
+    def to_tensor(self) -> torch.Tensor:
+        """Flat float64 tensor of the sums and counts, which can be summed over processes, see `from_tensor`."""
+        counts = self.sums.new_tensor([self.num_samples, self.num_batches])
+
+        return torch.cat([self.sums.view(-1), counts])
+
+    @staticmethod
+    def from_tensor(names: List[str], tensor: torch.Tensor) -> "LossStatistics":
+        """
+        Statistics from the (summed) tensors of `to_tensor`. Summing the statistics of processes training on shards
+        of the data yields the statistics over all batches of all processes.
+        """
+        statistics = LossStatistics(names, tensor.device)
+
+        statistics.sums = tensor[:-2].view(2, len(names)).clone()
+        statistics.num_samples, statistics.num_batches = [int(c) for c in tensor[-2:].tolist()]
+
+        return statistics
+
+    def summary(self) -> Dict[str, float]:
+        """Per-sample and per-batch means of every term, e.g. avg_loss and avg_loss_per_batch."""
+        weighted, unweighted = self.sums.tolist()
+
+        summary = dict()
+        for name, weighted_sum, unweighted_sum in zip(self.names, weighted, unweighted):
+            summary[f"avg_{name}"] = weighted_sum / max(self.num_samples, 1)
+            summary[f"avg_{name}_per_batch"] = unweighted_sum / max(self.num_batches, 1)
+
+        return summary